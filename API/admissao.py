@@ -0,0 +1,189 @@
+import asyncio
+import math
+import time
+from collections import deque
+
+
+class AdmissaoRecusada(Exception):
+    """Orçamento sem espaço: a requisição deve ser respondida com 429"""
+
+    def __init__(self, orcamento, retry_after):
+        super().__init__(f"Limite de concorrência de '{orcamento}' atingido")
+        self.orcamento = orcamento
+        self.retry_after = retry_after
+
+
+class OrcamentoAdmissao:
+    """
+    Limite adaptativo de concorrência (AIMD) para um grupo de endpoints.
+
+    O limite é medido em linhas em voo: uma chamada de /predict pesa 1 e um lote
+    pesa o número de linhas, então um lote grande ocupa o orçamento na proporção
+    do trabalho que gera. Quem não cabe espera em uma fila FIFO limitada por no
+    máximo max_espera segundos; com a fila cheia, ou depois da espera, a
+    requisição é recusada na hora com AdmissaoRecusada, em vez de acumular no
+    event loop até todos os clientes estourarem o timeout juntos.
+
+    O limite se ajusta pela latência observada de cada requisição admitida:
+    - acima de latencia_alvo, é multiplicado por fator_reducao (no máximo uma
+      redução por latencia_alvo, para uma rajada de respostas lentas contar uma vez);
+    - abaixo do alvo, e com o limite em uso, cresce `incremento` linhas a cada
+      limite inteiro de linhas concluídas.
+
+    Uma requisição sempre é admitida com o orçamento vazio, mesmo que pese mais
+    que o limite, para um lote maior que o limite não ficar recusado para sempre.
+    Roda inteiro no event loop, sem locks.
+    """
+
+    def __init__(self, nome, limite_inicial, latencia_alvo, limite_min=1, limite_max=None,
+                 fator_reducao=0.7, incremento=1.0, max_fila=64, max_espera=0.05):
+        self.nome = nome
+        self.limite = float(limite_inicial)
+        self.latencia_alvo = latencia_alvo
+        self.limite_min = float(limite_min)
+        self.limite_max = float(limite_max) if limite_max is not None else float("inf")
+        self.fator_reducao = fator_reducao
+        self.incremento = incremento
+        self.max_fila = max_fila
+        self.max_espera = max_espera
+        self.em_uso = 0
+        self.fila = deque()
+        self.ultima_reducao = 0.0
+        self.latencia_media = None
+
+        # Métricas
+        self.admitidas = 0
+        self.recusadas = 0
+        self.enfileiradas = 0
+        self.reducoes = 0
+
+    def lotado(self):
+        """Nem cabe direto nem na fila de espera: a próxima requisição seria recusada"""
+        return len(self.fila) >= self.max_fila and (bool(self.fila) or self.em_uso >= self.limite)
+
+    def retry_after(self):
+        """Segundos sugeridos no Retry-After: a latência média, arredondada para cima"""
+        return max(1, math.ceil(self.latencia_media or 0))
+
+    def _cabe(self, peso):
+        return self.em_uso == 0 or self.em_uso + peso <= self.limite
+
+    def _recusar(self):
+        self.recusadas += 1
+        raise AdmissaoRecusada(self.nome, self.retry_after())
+
+    async def adquirir(self, peso):
+        if not self.fila and self._cabe(peso):
+            self.em_uso += peso
+            self.admitidas += 1
+            return
+        if len(self.fila) >= self.max_fila or self.max_espera <= 0:
+            self._recusar()
+
+        loop = asyncio.get_running_loop()
+        item = (peso, loop.create_future())
+        self.fila.append(item)
+        self.enfileiradas += 1
+        expiracao = loop.call_later(self.max_espera, self._expirar, item)
+        try:
+            await item[1]
+        except asyncio.CancelledError:
+            # Cliente desconectou: sai da fila, ou devolve o espaço se já tinha sido admitido
+            if item in self.fila:
+                self.fila.remove(item)
+            elif item[1].done() and not item[1].cancelled() and item[1].exception() is None:
+                self.liberar(peso)
+            raise
+        finally:
+            expiracao.cancel()
+
+    def _expirar(self, item):
+        if item in self.fila:
+            self.fila.remove(item)
+            self.recusadas += 1
+            item[1].set_exception(AdmissaoRecusada(self.nome, self.retry_after()))
+            # A cabeça da fila pode ter mudado
+            self._despachar()
+
+    def _despachar(self):
+        while self.fila and self._cabe(self.fila[0][0]):
+            peso, futuro = self.fila.popleft()
+            self.em_uso += peso
+            self.admitidas += 1
+            futuro.set_result(None)
+
+    def liberar(self, peso, latencia=None):
+        """
+        Devolve o espaço ocupado por adquirir(peso). latencia é o tempo da
+        requisição admitida (None se ela falhou) e ajusta o limite antes de
+        despachar a fila.
+        """
+        self.em_uso -= peso
+        if latencia is not None:
+            self._ajustar(peso, latencia)
+        self._despachar()
+
+    def _ajustar(self, peso, latencia):
+        if self.latencia_media is None:
+            self.latencia_media = latencia
+        else:
+            self.latencia_media = 0.9 * self.latencia_media + 0.1 * latencia
+
+        if latencia > self.latencia_alvo:
+            agora = time.monotonic()
+            if agora - self.ultima_reducao >= self.latencia_alvo:
+                self.limite = max(self.limite_min, self.limite * self.fator_reducao)
+                self.ultima_reducao = agora
+                self.reducoes += 1
+        elif self.em_uso + peso >= self.limite / 2:
+            # Só cresce se o limite estava sendo usado; senão a latência baixa não diz nada
+            self.limite = min(self.limite_max, self.limite + self.incremento * min(1.0, peso / self.limite))
+
+    def metricas(self):
+        return {
+            "limite": self.limite,
+            "limite_min": self.limite_min,
+            "limite_max": self.limite_max if math.isfinite(self.limite_max) else None,
+            "latencia_alvo_ms": self.latencia_alvo * 1000,
+            "latencia_media_ms": self.latencia_media * 1000 if self.latencia_media is not None else None,
+            "em_uso": self.em_uso,
+            "profundidade_fila": len(self.fila),
+            "max_fila": self.max_fila,
+            "admitidas": self.admitidas,
+            "enfileiradas": self.enfileiradas,
+            "recusadas": self.recusadas,
+            "reducoes": self.reducoes,
+        }
+
+
+class MiddlewareAdmissao:
+    """
+    Middleware ASGI que recusa com 429 antes de ler o corpo quando o orçamento
+    da rota já está lotado, para um pico de lotes grandes não gastar CPU
+    desserializando e validando requisições que seriam recusadas de qualquer jeito.
+    A admissão com o peso certo é feita no handler, depois da validação.
+    """
+
+    def __init__(self, app, orcamentos):
+        self.app = app
+        # Caminho -> OrcamentoAdmissao
+        self.orcamentos = orcamentos
+
+    async def __call__(self, scope, receive, send):
+        orcamento = self.orcamentos.get(scope["path"]) if scope["type"] == "http" else None
+        if orcamento is None or not orcamento.lotado():
+            await self.app(scope, receive, send)
+            return
+
+        orcamento.recusadas += 1
+        corpo = b'{"detail":"Servidor sobrecarregado, tente novamente"}'
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(corpo)).encode()),
+                (b"retry-after", str(orcamento.retry_after()).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": corpo})
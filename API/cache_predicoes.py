@@ -0,0 +1,131 @@
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Passo de arredondamento de cada feature, na unidade dela: a precisão com que o
+# sensor reporta (temperaturas em 0.1 K, rotação em rpm inteiros, desgaste em
+# minutos). Assim o erro máximo da chave é meio passo do sensor em cada feature,
+# em vez de um mesmo passo que é grosso para umas e fino demais para outras.
+RESOLUCOES_PADRAO = {
+    'temperatura_ar': 0.1,
+    'temperatura_processo': 0.1,
+    'umidade_relativa': 0.01,
+    'velocidade_rotacional': 1.0,
+    'torque': 0.1,
+    'desgaste_da_ferramenta': 1.0,
+    # Códigos e indicadores 0/1: exatos
+    'tipo': 1.0,
+    'fdf_falha_desgaste_ferramenta': 1.0,
+    'fdc_falha_dissipacao_calor': 1.0,
+    'fp_falha_potencia': 1.0,
+    'fte_falha_tensao_excessiva': 1.0,
+    'fa_falha_aleatoria': 1.0,
+}
+
+
+def ler_resolucoes(colunas, padrao=None, por_coluna=""):
+    """
+    Resolução de cada coluna: RESOLUCOES_PADRAO, ou `padrao` para todas se
+    informado, com os ajustes de por_coluna ("torque=0.5,velocidade_rotacional=10")
+    """
+    resolucoes = {col: padrao if padrao is not None else RESOLUCOES_PADRAO[col] for col in colunas}
+    for item in filter(None, (parte.strip() for parte in por_coluna.split(","))):
+        col, _, valor = item.partition("=")
+        if col.strip() not in resolucoes:
+            raise ValueError(f"Coluna desconhecida em CACHE_RESOLUCOES: {col.strip()}")
+        resolucoes[col.strip()] = float(valor)
+    return [resolucoes[col] for col in colunas]
+
+
+class CachePredicoes:
+    """
+    Cache de predições com chave quantizada, despejo LRU e expiração por TTL.
+
+    A chave é a linha de features (antes do scaler) arredondada, coluna a coluna,
+    para a resolução de cada sensor (um número para todas as colunas ou um por
+    coluna), então leituras praticamente iguais reaproveitam a mesma predição.
+    O cache guarda a versão do modelo e é esvaziado sempre que ela muda.
+    """
+
+    def __init__(self, max_itens=100_000, ttl=300.0, resolucao=0.1, versao=None):
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self.resolucao = np.asarray(resolucao, dtype=np.float64)
+        self.versao = versao
+        self.itens = OrderedDict()
+
+        # Métricas
+        self.acertos = 0
+        self.faltas = 0
+        self.despejos = 0
+        self.expirados = 0
+        self.invalidacoes = 0
+
+    def verificar_versao(self, versao):
+        """Esvazia o cache se o modelo em uso mudou"""
+        if versao != self.versao:
+            self.itens.clear()
+            self.versao = versao
+            self.invalidacoes += 1
+
+    def chaves(self, features):
+        quantizado = np.round(np.asarray(features) / self.resolucao).astype(np.int64)
+        return [linha.tobytes() for linha in quantizado]
+
+    def consultar(self, features):
+        """
+        Devolve (chaves, predicoes, probabilidades, faltando). As posições de
+        faltando=True não estavam no cache e precisam ser calculadas pelo modelo.
+        """
+        chaves = self.chaves(features)
+        n = len(chaves)
+        predicoes = np.zeros(n, dtype=bool)
+        probabilidades = np.zeros(n, dtype=np.float64)
+        faltando = np.ones(n, dtype=bool)
+        agora = time.monotonic()
+
+        for i, chave in enumerate(chaves):
+            item = self.itens.get(chave)
+            if item is None:
+                continue
+            predicao, probabilidade, expira_em = item
+            if expira_em <= agora:
+                del self.itens[chave]
+                self.expirados += 1
+                continue
+            self.itens.move_to_end(chave)
+            predicoes[i] = predicao
+            probabilidades[i] = probabilidade
+            faltando[i] = False
+
+        acertos = n - int(faltando.sum())
+        self.acertos += acertos
+        self.faltas += n - acertos
+        return chaves, predicoes, probabilidades, faltando
+
+    def guardar(self, chaves, predicoes, probabilidades):
+        expira_em = time.monotonic() + self.ttl
+        for chave, predicao, probabilidade in zip(chaves, predicoes.tolist(), probabilidades.tolist()):
+            self.itens[chave] = (predicao, probabilidade, expira_em)
+            self.itens.move_to_end(chave)
+        while len(self.itens) > self.max_itens:
+            self.itens.popitem(last=False)
+            self.despejos += 1
+
+    def metricas(self):
+        total = self.acertos + self.faltas
+        return {
+            "ativo": True,
+            "versao_modelo": self.versao,
+            "itens": len(self.itens),
+            "max_itens": self.max_itens,
+            "ttl_s": self.ttl,
+            "resolucao": self.resolucao.tolist(),
+            "acertos": self.acertos,
+            "faltas": self.faltas,
+            "taxa_acerto": self.acertos / total if total else 0.0,
+            "despejos": self.despejos,
+            "expirados": self.expirados,
+            "invalidacoes": self.invalidacoes,
+        }
@@ -0,0 +1,35 @@
+import os
+import sys
+import tempfile
+import time
+
+import pytest
+
+DIRETORIO_API = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture(scope="session")
+def diretorio_api():
+    # Os caminhos dos .pkl são relativos ao diretório da API
+    os.chdir(DIRETORIO_API)
+    sys.path.insert(0, DIRETORIO_API)
+    return DIRETORIO_API
+
+
+@pytest.fixture(scope="session")
+def api(diretorio_api):
+    """Módulo main com o modelo carregado, rodando em processo a partir do diretório da API"""
+    os.environ.setdefault("JOBS_DIR", tempfile.mkdtemp(prefix="jobs-teste-"))
+    import main
+    return main
+
+
+@pytest.fixture(scope="session")
+def cliente(api):
+    from fastapi.testclient import TestClient
+    with TestClient(api.app) as cliente:
+        limite = time.monotonic() + 120
+        while cliente.get("/ready").status_code != 200:
+            assert time.monotonic() < limite, "Modelo não ficou pronto"
+            time.sleep(0.1)
+        yield cliente
@@ -0,0 +1,246 @@
+import os
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Leituras guardadas por máquina, na ordem das primeiras colunas da matriz de features
+SENSORES = ['temperatura_ar', 'temperatura_processo', 'umidade_relativa',
+            'velocidade_rotacional', 'torque', 'desgaste_da_ferramenta']
+ESTATISTICAS = ['media', 'inclinacao', 'delta']
+
+
+class EstadoMaquinas:
+    """
+    Histórico recente de leituras por id_produto, para tendências que uma leitura
+    isolada não mostra (taxa de desgaste, inclinação da temperatura).
+
+    Cada máquina ocupa uma linha de um buffer circular NumPy pré-alocado
+    (max_maquinas x janela x sensores, em float32). A soma e a soma ponderada
+    pela posição na janela são mantidas a cada leitura, então média, inclinação
+    (regressão linear sobre as últimas leituras, em unidades por leitura) e delta
+    desde a leitura anterior custam O(1) por atualização. A cada volta completa
+    do buffer as somas são recalculadas da janela, para o erro de arredondamento
+    não acumular.
+
+    A memória é fixa: máquinas sem leitura há mais de ttl segundos são
+    despejadas e, com todas as linhas ocupadas, a menos recente cede a sua.
+    Roda no event loop, sem locks.
+    """
+
+    def __init__(self, janela=32, max_maquinas=10000, ttl=3600.0, sensores=SENSORES):
+        self.janela = janela
+        self.max_maquinas = max_maquinas
+        self.ttl = ttl
+        self.sensores = list(sensores)
+        n = len(self.sensores)
+        self.buffers = np.zeros((max_maquinas, janela, n), dtype=np.float32)
+        # Leituras recebidas por máquina desde que ela entrou (não só as da janela)
+        self.contagens = np.zeros(max_maquinas, dtype=np.int64)
+        self.somas = np.zeros((max_maquinas, n))
+        # Soma de posição * valor, com a leitura mais antiga da janela na posição 0
+        self.somas_ponderadas = np.zeros((max_maquinas, n))
+        self.ultimo_acesso = np.zeros(max_maquinas)
+        # id_produto -> linha, da menos para a mais recentemente atualizada
+        self.linhas = OrderedDict()
+        self.livres = list(range(max_maquinas - 1, -1, -1))
+
+        # Métricas
+        self.atualizacoes = 0
+        self.despejos_ociosas = 0
+        self.despejos_capacidade = 0
+
+    @property
+    def nomes_features(self):
+        """Nome de cada coluna devolvida por atualizar_lote (sensor_estatistica)"""
+        return [f"{sensor}_{estatistica}" for estatistica in ESTATISTICAS for sensor in self.sensores]
+
+    def __len__(self):
+        return len(self.linhas)
+
+    def __contains__(self, id_produto):
+        return id_produto in self.linhas
+
+    def _linha(self, id_produto, agora):
+        linha = self.linhas.get(id_produto)
+        if linha is not None:
+            self.linhas.move_to_end(id_produto)
+            return linha
+        self.despejar_ociosas(agora)
+        if not self.livres:
+            _, antiga = self.linhas.popitem(last=False)
+            self.livres.append(antiga)
+            self.despejos_capacidade += 1
+        linha = self.livres.pop()
+        self.contagens[linha] = 0
+        self.somas[linha] = 0.0
+        self.somas_ponderadas[linha] = 0.0
+        self.linhas[id_produto] = linha
+        return linha
+
+    def despejar_ociosas(self, agora=None):
+        """Libera as máquinas sem leitura há mais de ttl segundos"""
+        agora = time.time() if agora is None else agora
+        while self.linhas:
+            id_produto, linha = next(iter(self.linhas.items()))
+            if agora - self.ultimo_acesso[linha] <= self.ttl:
+                break
+            del self.linhas[id_produto]
+            self.livres.append(linha)
+            self.despejos_ociosas += 1
+
+    def atualizar(self, id_produto, leitura, agora=None):
+        """
+        Acrescenta uma leitura (um valor por sensor) ao histórico da máquina e
+        devolve as features de tendência já com ela, como em estatisticas()
+        """
+        agora = time.time() if agora is None else agora
+        linha = self._linha(id_produto, agora)
+        self.ultimo_acesso[linha] = agora
+        self.atualizacoes += 1
+
+        valor = np.asarray(leitura, dtype=np.float32)
+        buffer = self.buffers[linha]
+        contagem = int(self.contagens[linha])
+        posicao = contagem % self.janela
+        soma, soma_ponderada = self.somas[linha], self.somas_ponderadas[linha]
+
+        if contagem >= self.janela:
+            # Sai a mais antiga (posição 0) e as demais descem uma posição
+            soma -= buffer[posicao]
+            soma_ponderada -= soma
+            tamanho_anterior = self.janela - 1
+        else:
+            tamanho_anterior = contagem
+        delta = valor - buffer[(contagem - 1) % self.janela] if contagem else np.zeros_like(valor)
+
+        buffer[posicao] = valor
+        soma += valor
+        soma_ponderada += tamanho_anterior * valor.astype(np.float64)
+        contagem += 1
+        self.contagens[linha] = contagem
+
+        if contagem % self.janela == 0:
+            # Volta completa: a mais antiga está na posição 0 do buffer; recalcula exato
+            soma[:] = buffer.sum(axis=0, dtype=np.float64)
+            soma_ponderada[:] = np.arange(self.janela, dtype=np.float64) @ buffer.astype(np.float64)
+
+        return self._estatisticas(linha, delta)
+
+    def atualizar_lote(self, ids, leituras, agora=None):
+        """
+        Atualiza várias máquinas, na ordem das linhas; ids None são ignorados.
+        Devolve a matriz (n x 3 * sensores) na ordem de nomes_features, com NaN nas
+        linhas sem id_produto.
+        """
+        agora = time.time() if agora is None else agora
+        resultado = np.full((len(ids), len(self.nomes_features)), np.nan)
+        for i, id_produto in enumerate(ids):
+            if id_produto is not None:
+                resultado[i] = self.atualizar(id_produto, leituras[i], agora)
+        return resultado
+
+    def _estatisticas(self, linha, delta):
+        n = min(int(self.contagens[linha]), self.janela)
+        soma, soma_ponderada = self.somas[linha], self.somas_ponderadas[linha]
+        media = soma / n
+        if n > 1:
+            # Mínimos quadrados com x = 0..n-1: somas de x e x² em forma fechada
+            soma_x = n * (n - 1) / 2
+            soma_x2 = (n - 1) * n * (2 * n - 1) / 6
+            inclinacao = (n * soma_ponderada - soma_x * soma) / (n * soma_x2 - soma_x ** 2)
+        else:
+            inclinacao = np.zeros_like(media)
+        return np.concatenate([media, inclinacao, delta])
+
+    def estatisticas(self, id_produto):
+        """
+        Features de tendência atuais da máquina: média, inclinação e delta por
+        sensor (na ordem de nomes_features), ou None se ela não está no estado
+        """
+        linha = self.linhas.get(id_produto)
+        if linha is None:
+            return None
+        contagem = int(self.contagens[linha])
+        buffer = self.buffers[linha]
+        if contagem > 1:
+            delta = buffer[(contagem - 1) % self.janela] - buffer[(contagem - 2) % self.janela]
+        else:
+            delta = np.zeros(len(self.sensores), dtype=np.float32)
+        return self._estatisticas(linha, delta)
+
+    def formatar(self, valores):
+        """Linha de features de tendência para JSON: sensor -> {media, inclinacao, delta}"""
+        n = len(self.sensores)
+        return {sensor: {estatistica: float(valores[k * n + j]) for k, estatistica in enumerate(ESTATISTICAS)}
+                for j, sensor in enumerate(self.sensores)}
+
+    def descrever(self, id_produto):
+        """Estado de uma máquina para a resposta JSON, com o total de leituras recebidas"""
+        valores = self.estatisticas(id_produto)
+        if valores is None:
+            return None
+        return {"leituras": int(self.contagens[self.linhas[id_produto]]), **self.formatar(valores)}
+
+    def instantaneo(self):
+        """Cópia das máquinas em memória, para gravar() fora do event loop"""
+        linhas = np.fromiter(self.linhas.values(), dtype=np.int64, count=len(self.linhas))
+        return {
+            "janela": self.janela,
+            "sensores": np.array(self.sensores),
+            "ids": np.array(list(self.linhas), dtype=str),
+            "buffers": self.buffers[linhas],
+            "contagens": self.contagens[linhas],
+            "somas": self.somas[linhas],
+            "somas_ponderadas": self.somas_ponderadas[linhas],
+            "ultimo_acesso": self.ultimo_acesso[linhas],
+        }
+
+    @staticmethod
+    def gravar(instantaneo, caminho):
+        """Grava um instantaneo() em .npz (arquivo temporário do processo + rename)"""
+        temporario = f"{caminho}.{os.getpid()}.tmp"
+        with open(temporario, "wb") as f:
+            np.savez(f, **instantaneo)
+        os.replace(temporario, caminho)
+        return len(instantaneo["ids"])
+
+    def salvar(self, caminho):
+        return self.gravar(self.instantaneo(), caminho)
+
+    def restaurar(self, caminho):
+        """
+        Carrega um .npz gravado por salvar() ou gravar(), substituindo o estado atual. Com
+        menos capacidade que o arquivo, ficam as máquinas mais recentes; as já
+        ociosas pelo ttl são descartadas.
+        """
+        with np.load(caminho) as dados:
+            if int(dados["janela"]) != self.janela or list(dados["sensores"]) != self.sensores:
+                raise ValueError(f"Snapshot com janela {int(dados['janela'])} e sensores {list(dados['sensores'])}, "
+                                 f"esperado janela {self.janela} e sensores {self.sensores}")
+            ids = [str(i) for i in dados["ids"]][-self.max_maquinas:]
+            inicio = len(dados["ids"]) - len(ids)
+            n = len(ids)
+            self.linhas = OrderedDict(zip(ids, range(n)))
+            self.livres = list(range(self.max_maquinas - 1, n - 1, -1))
+            self.buffers[:n] = dados["buffers"][inicio:]
+            self.contagens[:n] = dados["contagens"][inicio:]
+            self.somas[:n] = dados["somas"][inicio:]
+            self.somas_ponderadas[:n] = dados["somas_ponderadas"][inicio:]
+            self.ultimo_acesso[:n] = dados["ultimo_acesso"][inicio:]
+        self.despejar_ociosas()
+        return len(self.linhas)
+
+    def metricas(self):
+        return {
+            "maquinas": len(self.linhas),
+            "max_maquinas": self.max_maquinas,
+            "janela": self.janela,
+            "ttl_s": self.ttl,
+            "sensores": self.sensores,
+            "atualizacoes": self.atualizacoes,
+            "despejos_ociosas": self.despejos_ociosas,
+            "despejos_capacidade": self.despejos_capacidade,
+            "memoria_bytes": int(self.buffers.nbytes + self.contagens.nbytes + self.somas.nbytes
+                                 + self.somas_ponderadas.nbytes + self.ultimo_acesso.nbytes),
+        }
@@ -0,0 +1,42 @@
+"""
+Configuração do gunicorn para servir a API com vários workers compartilhando o modelo.
+
+Uso:
+    gunicorn -c gunicorn_conf.py main:app
+
+Com preload_app o main.py é importado uma única vez no processo mestre, e o
+pre_fork carrega os modelos ali, antes do fork. Os workers herdam as árvores, os
+coeficientes e os vetores de suporte por copy-on-write, então as páginas de
+memória do modelo ficam compartilhadas entre todos eles.
+"""
+import gc
+import itertools
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("GUNICORN_WORKERS", "16"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+
+
+def pre_fork(server, worker):
+    # O main.py carrega o modelo em segundo plano no lifespan de cada worker; aqui
+    # ele é carregado uma vez no mestre para que os workers o herdem já pronto
+    import main
+    if main.artefatos is None:
+        main.carregar_artefatos()
+
+    # Move os objetos já carregados (modelo incluso) para a geração permanente do
+    # coletor de lixo; sem isso cada coleta nos workers escreve nos cabeçalhos dos
+    # objetos e força a cópia das páginas compartilhadas
+    gc.freeze()
+
+    # Índice estável (0, 1, ...) que um worker substituto herda do que saiu; o
+    # main.py usa para dar a cada worker o seu snapshot do estado por máquina
+    em_uso = {getattr(w, "indice", None) for w in server.WORKERS.values()}
+    worker.indice = next(i for i in itertools.count() if i not in em_uso)
+
+
+def post_fork(server, worker):
+    os.environ["WORKER_INDICE"] = str(worker.indice)
@@ -0,0 +1,434 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import joblib
+import numpy as np
+from sklearn.ensemble import (ExtraTreesClassifier, GradientBoostingClassifier,
+                              HistGradientBoostingClassifier, RandomForestClassifier)
+from sklearn.kernel_approximation import Nystroem, RBFSampler
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.svm import SVC, NuSVC
+from sklearn.tree import DecisionTreeClassifier
+
+from motor_arvores import ModeloCompilado, PrimeiroEstagioCompilado, verificar_equivalencia
+
+# Configuração e versões do modelo carregadas em cada processo do pool (modo "process")
+_config_worker = (None, "sklearn", 128, False, (0.01, 0.99), 0.0, False)
+_versoes_worker = OrderedDict()
+_avaliador_worker = None
+# Modelos base carregados em cada processo do pool de membros (AvaliadorMembros)
+_membros_processo = OrderedDict()
+
+# Estimadores cujo predict_proba roda em Cython/C (árvores, libsvm) ou BLAS sem
+# segurar o GIL: podem ser avaliados em paralelo por threads
+ESTIMADORES_SEM_GIL = (
+    RandomForestClassifier, ExtraTreesClassifier, GradientBoostingClassifier,
+    HistGradientBoostingClassifier, DecisionTreeClassifier, SVC, NuSVC, LogisticRegression,
+    Nystroem, RBFSampler, StandardScaler,
+)
+
+
+def _libera_gil(estimador):
+    # Pipeline (ex.: Nystroem + LogisticRegression) libera o GIL se todas as etapas liberam
+    if isinstance(estimador, Pipeline):
+        return all(_libera_gil(etapa) for _, etapa in estimador.steps if etapa != 'passthrough')
+    return isinstance(estimador, ESTIMADORES_SEM_GIL)
+
+
+def _saida_stacking(stacking, estimador, metodo, X):
+    # Mesma montagem das colunas do meta-modelo feita em StackingClassifier._concatenate_predictions
+    predicoes = getattr(estimador, metodo)(X)
+    if predicoes.ndim == 1:
+        return predicoes.reshape(-1, 1)
+    if metodo == 'predict_proba' and len(stacking.classes_) == 2:
+        return predicoes[:, 1:]
+    return predicoes
+
+
+def calcular_confianca(prob_falha):
+    """Classifica a probabilidade de falha em Alta, Média ou Baixa"""
+    return np.select([prob_falha > 0.8, prob_falha > 0.5], ["Alta", "Média"], default="Baixa")
+
+
+def etapas_do_modelo(modelo):
+    """Modelos base como [(nome, funcao(X) -> colunas do meta-modelo)] e a função do meta-modelo"""
+    if hasattr(modelo, 'etapas'):
+        return modelo.etapas()
+
+    # StackingClassifier do scikit-learn: o mesmo encadeamento do predict_proba
+    nomes = [nome for nome, estimador in modelo.named_estimators_.items() if estimador != 'drop']
+    membros = [
+        (nome, lambda X, est=estimador, met=metodo: _saida_stacking(modelo, est, met, X))
+        for nome, estimador, metodo in zip(nomes, modelo.estimators_, modelo.stack_method_)
+    ]
+    return membros, modelo.final_estimator_.predict_proba
+
+
+def prever_com_modelo(modelo, scaler, features, medir=False, avaliador=None, caminho_modelo=None):
+    """
+    Normaliza e roda o modelo uma única vez para todo o lote. Devolve
+    (predicoes, probabilidades, tempos, cascata); com medir=True, tempos traz a
+    duração em segundos do scaler, de cada modelo base e do meta-modelo. Modelos
+    com o scaler incorporado (features_brutas) recebem as features sem normalizar.
+    cascata traz as contagens do ModeloCascata (None para os outros modelos).
+    Com um AvaliadorMembros, os modelos base de lotes grandes rodam em paralelo.
+    """
+    if isinstance(modelo, ModeloCascata):
+        return prever_em_cascata(modelo, scaler, features, medir, avaliador, caminho_modelo)
+
+    escolhido = modelo.escolher(len(features)) if isinstance(modelo, ModeloPorTamanho) else modelo
+    brutas = getattr(escolhido, 'features_brutas', False)
+    paralelo = avaliador is not None and len(features) >= avaliador.min_linhas
+    if not medir and not paralelo:
+        features_scaled = features if brutas else scaler.transform(features)
+        probabilidades = escolhido.predict_proba(features_scaled)
+        tempos = None
+    else:
+        tempos = {}
+        if brutas:
+            features_scaled = features
+        else:
+            inicio = time.perf_counter()
+            features_scaled = scaler.transform(features)
+            tempos['scaler'] = time.perf_counter() - inicio
+
+        membros, meta = etapas_do_modelo(escolhido)
+        if paralelo:
+            saidas = avaliador.avaliar(escolhido, membros, features_scaled, caminho_modelo, tempos)
+        else:
+            saidas = []
+            for nome, funcao in membros:
+                inicio = time.perf_counter()
+                saidas.append(funcao(features_scaled))
+                tempos[f'modelo_{nome}'] = time.perf_counter() - inicio
+        X_meta = np.hstack(saidas)
+        if getattr(escolhido, 'passthrough', False):
+            X_meta = np.hstack([X_meta, features_scaled])
+
+        inicio = time.perf_counter()
+        probabilidades = meta(X_meta)
+        tempos['meta'] = time.perf_counter() - inicio
+        if not medir:
+            tempos = None
+
+    # Mesmo critério do model.predict, sem rodar o ensemble uma segunda vez
+    predicoes = modelo.classes_.take(np.argmax(probabilidades, axis=1))
+    return predicoes.astype(bool), probabilidades[:, 1], tempos, None
+
+
+def prever_em_cascata(cascata, scaler, features, medir=False, avaliador=None, caminho_modelo=None):
+    """
+    Pontua o lote com o primeiro estágio e roda o modelo completo só nas linhas
+    dentro da banda de incerteza, mais uma amostra das demais para medir a
+    concordância entre os dois.
+    """
+    inicio = time.perf_counter()
+    probabilidades = cascata.primeiro_estagio.probabilidade(features)
+    escalar = (probabilidades >= cascata.inferior) & (probabilidades <= cascata.superior)
+    comparar = ~escalar
+    if cascata.amostra_concordancia < 1:
+        # Gerador por chamada: a cascata é compartilhada pelas threads do executor
+        comparar &= np.random.default_rng().random(len(features)) < cascata.amostra_concordancia
+    tempos = {'primeiro_estagio': time.perf_counter() - inicio} if medir else None
+    # Mesmo critério do argmax do predict_proba
+    predicoes = probabilidades > 0.5
+
+    contagens = {
+        "linhas": len(features),
+        "escaladas": int(escalar.sum()),
+        "comparadas": int(comparar.sum()),
+        "concordantes": 0,
+    }
+    indices = np.flatnonzero(escalar | comparar)
+    if len(indices):
+        predicoes_completo, probabilidades_completo, tempos_completo, _ = prever_com_modelo(
+            cascata.completo, scaler, features[indices], medir, avaliador, caminho_modelo
+        )
+        if medir:
+            tempos.update(tempos_completo)
+        comparadas = comparar[indices]
+        contagens["concordantes"] = int((predicoes[indices][comparadas] == predicoes_completo[comparadas]).sum())
+
+        escaladas = escalar[indices]
+        predicoes[indices[escaladas]] = predicoes_completo[escaladas]
+        probabilidades[indices[escaladas]] = probabilidades_completo[escaladas]
+    return predicoes, probabilidades, tempos, contagens
+
+
+class ModeloPorTamanho:
+    """
+    Usa o motor compilado em lotes pequenos e o scikit-learn nos grandes.
+
+    O motor compilado elimina o custo fixo por chamada do scikit-learn, que domina
+    a latência de uma linha, mas o percurso das árvores em NumPy perde para o
+    Cython quando o lote passa de algumas centenas de linhas.
+    """
+
+    def __init__(self, compilado, modelo, max_lote):
+        self.compilado = compilado
+        self.modelo = modelo
+        self.max_lote = max_lote
+        self.classes_ = modelo.classes_
+
+    def escolher(self, n_linhas):
+        return self.compilado if n_linhas <= self.max_lote else self.modelo
+
+    def predict_proba(self, X):
+        return self.escolher(len(X)).predict_proba(X)
+
+
+def _membros_no_processo(caminho_modelo):
+    # Modelos base por nome, carregados uma vez por versão em cada processo do pool de membros
+    membros = _membros_processo.get(caminho_modelo)
+    if membros is None:
+        membros = dict(etapas_do_modelo(joblib.load(caminho_modelo))[0])
+        _membros_processo[caminho_modelo] = membros
+        while len(_membros_processo) > MAX_VERSOES_WORKER:
+            _membros_processo.popitem(last=False)
+    return membros
+
+
+def _avaliar_membro_no_processo(caminho_modelo, nome, nome_memoria, forma, dtype="float64"):
+    funcao = _membros_no_processo(caminho_modelo)[nome]
+    memoria = shared_memory.SharedMemory(name=nome_memoria)
+    X = np.ndarray(forma, dtype=dtype, buffer=memoria.buf)
+    inicio = time.perf_counter()
+    saida = funcao(X)
+    duracao = time.perf_counter() - inicio
+    # A saída é uma matriz nova; a view sobre a memória compartilhada precisa sair antes do close
+    del X
+    memoria.close()
+    return saida, duracao
+
+
+class AvaliadorMembros:
+    """
+    Avalia os modelos base do stacking ao mesmo tempo sobre a mesma matriz de
+    features, antes do meta-modelo.
+
+    Membros cujo predict_proba libera o GIL (ESTIMADORES_SEM_GIL e o motor
+    compilado, que roda em NumPy) vão para um pool de threads e leem a matriz
+    sem cópia. Os demais vão para um pool de processos, que carrega o modelo pelo
+    caminho e lê a matriz de um bloco de memória compartilhada.
+    Só vale a pena em lotes grandes (min_linhas), em que cada membro é caro.
+    """
+
+    def __init__(self, workers=None, min_linhas=2048):
+        self.workers = workers or os.cpu_count() or 1
+        self.min_linhas = min_linhas
+        self.threads = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="membros")
+        self.processos = None
+
+    @staticmethod
+    def modos(modelo):
+        """Modo de cada membro: nome -> ("thread" ou "process")"""
+        if not hasattr(modelo, 'named_estimators_'):
+            return {}
+        return {
+            nome: "thread" if _libera_gil(estimador) else "process"
+            for nome, estimador in modelo.named_estimators_.items() if estimador != 'drop'
+        }
+
+    def avaliar(self, modelo, membros, X, caminho_modelo, tempos):
+        """Devolve as saídas dos membros na ordem de membros e anota a duração de cada um em tempos"""
+        modos = self.modos(modelo)
+        em_processo = [nome for nome, _ in membros if modos.get(nome) == "process"]
+        if em_processo and caminho_modelo is None:
+            # Sem o caminho o processo não tem como carregar o modelo
+            em_processo = []
+
+        # float32 fica em float32 (modo float32); o resto vai para float64
+        X = np.ascontiguousarray(X, dtype=np.float32 if X.dtype == np.float32 else np.float64)
+        memoria = None
+        if em_processo:
+            if self.processos is None:
+                self.processos = ProcessPoolExecutor(
+                    max_workers=len(em_processo), mp_context=multiprocessing.get_context("spawn")
+                )
+            memoria = shared_memory.SharedMemory(create=True, size=max(X.nbytes, 1))
+            np.ndarray(X.shape, dtype=X.dtype, buffer=memoria.buf)[:] = X
+
+        def medir_thread(funcao):
+            inicio = time.perf_counter()
+            saida = funcao(X)
+            return saida, time.perf_counter() - inicio
+
+        try:
+            futuros = [
+                self.processos.submit(_avaliar_membro_no_processo, caminho_modelo, nome, memoria.name, X.shape,
+                                       X.dtype.str)
+                if nome in em_processo else self.threads.submit(medir_thread, funcao)
+                for nome, funcao in membros
+            ]
+            saidas = []
+            for (nome, _), futuro in zip(membros, futuros):
+                saida, duracao = futuro.result()
+                saidas.append(saida)
+                tempos[f'modelo_{nome}'] = duracao
+            return saidas
+        finally:
+            if memoria is not None:
+                memoria.close()
+                memoria.unlink()
+
+    def encerrar(self):
+        self.threads.shutdown(wait=False, cancel_futures=True)
+        if self.processos is not None:
+            self.processos.shutdown(wait=False, cancel_futures=True)
+
+
+class ModeloCascata:
+    """
+    Cascata de dois estágios: um modelo barato (primeiro estágio, com o scaler
+    incorporado) responde as linhas em que está confiante, e as linhas com
+    probabilidade entre inferior e superior vão para o modelo completo.
+    """
+
+    def __init__(self, primeiro_estagio, completo, inferior, superior, amostra_concordancia=0.0):
+        self.primeiro_estagio = primeiro_estagio
+        self.completo = completo
+        self.inferior = inferior
+        self.superior = superior
+        self.amostra_concordancia = amostra_concordancia
+        self.classes_ = completo.classes_
+
+
+def preparar_modelo(modelo, backend="sklearn", verificar=False, max_lote_compilado=128, scaler=None,
+                    primeiro_estagio=None, banda_cascata=(0.01, 0.99), amostra_concordancia=0.0, float32=False):
+    """
+    Devolve o modelo usado na inferência: o próprio StackingClassifier ou o motor
+    compilado. Com scaler, o motor compilado o incorpora e recebe as features brutas.
+    Com primeiro_estagio, o resultado é envolvido em um ModeloCascata. Com float32,
+    os modelos compilados passam a calcular em float32 (o scikit-learn já recebe
+    as features em float32 de quem chama).
+    """
+    if primeiro_estagio is not None:
+        completo = preparar_modelo(modelo, backend, verificar, max_lote_compilado, scaler, float32=float32)
+        estagio = PrimeiroEstagioCompilado(primeiro_estagio, scaler)
+        return ModeloCascata(
+            estagio.para_float32() if float32 else estagio,
+            completo,
+            *banda_cascata,
+            amostra_concordancia=amostra_concordancia
+        )
+
+    if backend == "sklearn":
+        return modelo
+    if backend != "compilado":
+        raise ValueError(f"Backend de inferência inválido: {backend}")
+
+    compilado = ModeloCompilado(modelo, scaler)
+    if verificar:
+        # Features normalizadas em torno da distribuição do treino
+        X = np.random.default_rng(42).normal(size=(1000, modelo.n_features_in_))
+        if scaler is not None:
+            verificar_equivalencia(modelo, compilado, scaler.inverse_transform(X), scaler=scaler)
+        else:
+            verificar_equivalencia(modelo, compilado, X)
+    if float32:
+        # A verificação acima confere a compilação; a diferença do float32 é medida por relatorio_float32
+        compilado.para_float32()
+    return ModeloPorTamanho(compilado, modelo, max_lote_compilado)
+
+
+# Versões carregadas em cada processo do pool; a anterior fica para as predições
+# que ainda estavam na fila quando o modelo foi trocado
+MAX_VERSOES_WORKER = 2
+
+
+def _inicializar_worker(mmap_mode=None, backend="sklearn", max_lote_compilado=128, medir=False,
+                        banda_cascata=(0.01, 0.99), amostra_concordancia=0.0, membros_min_lote=None,
+                        float32=False):
+    global _config_worker, _versoes_worker, _avaliador_worker
+    _config_worker = (mmap_mode, backend, max_lote_compilado, medir, banda_cascata, amostra_concordancia, float32)
+    _versoes_worker = OrderedDict()
+    if membros_min_lote:
+        _avaliador_worker = AvaliadorMembros(min_linhas=membros_min_lote)
+
+
+def _prever_no_worker(features, versao, caminho_modelo, caminho_scaler, caminho_primeiro_estagio=None):
+    mmap_mode, backend, max_lote_compilado, medir, banda_cascata, amostra_concordancia, float32 = _config_worker
+    carregado = _versoes_worker.get(versao)
+    if carregado is None:
+        modelo = joblib.load(caminho_modelo, mmap_mode=mmap_mode)
+        scaler = joblib.load(caminho_scaler)
+        primeiro_estagio = joblib.load(caminho_primeiro_estagio) if caminho_primeiro_estagio else None
+        carregado = (
+            preparar_modelo(modelo, backend, max_lote_compilado=max_lote_compilado, scaler=scaler,
+                            primeiro_estagio=primeiro_estagio, banda_cascata=banda_cascata,
+                            amostra_concordancia=amostra_concordancia, float32=float32),
+            scaler
+        )
+        _versoes_worker[versao] = carregado
+        while len(_versoes_worker) > MAX_VERSOES_WORKER:
+            _versoes_worker.popitem(last=False)
+    _versoes_worker.move_to_end(versao)
+    modelo, scaler = carregado
+    return prever_com_modelo(modelo, scaler, features, medir=medir, avaliador=_avaliador_worker,
+                             caminho_modelo=caminho_modelo)
+
+
+def _cronometrar(funcao, *argumentos):
+    # Roda no worker: mede só a inferência, sem a espera na fila do executor
+    inicio = time.perf_counter()
+    resultado = funcao(*argumentos)
+    return resultado, time.perf_counter() - inicio
+
+
+class ExecutorInferencia:
+    """
+    Executa a inferência fora do event loop, com concorrência limitada.
+
+    modo="thread": pool de threads usando o modelo já carregado no processo.
+    modo="process": pool de processos; cada processo carrega cada versão do modelo
+    na primeira predição que a usa.
+
+    executar recebe os artefatos (registro_modelos.ArtefatosModelo) da versão que
+    deve responder, capturados quando a predição começou, e devolve o resultado
+    da inferência e a duração em segundos medida no próprio worker.
+    """
+
+    def __init__(self, funcao_local, modo="thread", workers=None, max_concorrencia=None,
+                 mmap_mode=None, backend="sklearn", max_lote_compilado=128, medir=False,
+                 banda_cascata=(0.01, 0.99), amostra_concordancia=0.0, membros_min_lote=None, float32=False):
+        if modo not in ("thread", "process"):
+            raise ValueError(f"Modo de executor inválido: {modo}")
+
+        self.modo = modo
+        self.workers = workers or os.cpu_count() or 1
+        self.max_concorrencia = max_concorrencia or self.workers
+        self.semaforo = asyncio.Semaphore(self.max_concorrencia)
+
+        if modo == "process":
+            self.funcao = _prever_no_worker
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_inicializar_worker,
+                initargs=(mmap_mode, backend, max_lote_compilado, medir, banda_cascata, amostra_concordancia,
+                          membros_min_lote, float32)
+            )
+        else:
+            self.funcao = funcao_local
+            self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inferencia")
+
+    async def executar(self, features, artefatos):
+        if self.modo == "process":
+            # Só os caminhos atravessam para o processo, que carrega a versão sob demanda
+            argumentos = (artefatos.versao, artefatos.caminho_modelo, artefatos.caminho_scaler,
+                          artefatos.caminho_primeiro_estagio)
+        else:
+            argumentos = (artefatos,)
+        async with self.semaforo:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.pool, _cronometrar, self.funcao, features, *argumentos)
+
+    def encerrar(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
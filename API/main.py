@@ -1,28 +1,634 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from contextlib import asynccontextmanager
+from functools import partial
+from fastapi import FastAPI, File, HTTPException, Request, UploadFile, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, ValidationError
+import asyncio
+import io
+import json
+import os
+import time
 import joblib
 import numpy as np
-import pandas as pd
-from typing import Optional
+from typing import Literal, Optional
 import uvicorn
 
-# Carregar modelos e preprocessadores
 try:
-    model = joblib.load('stacking_model.pkl')
-    scaler = joblib.load('scaler.pkl')
-    label_encoder = joblib.load('label_encoder.pkl')
-except FileNotFoundError as e:
-    print(f"Erro ao carregar modelos: {e}")
-    model = None
-    scaler = None
-    label_encoder = None
+    import orjson
+except ImportError:
+    orjson = None
+
+from admissao import AdmissaoRecusada, MiddlewareAdmissao, OrcamentoAdmissao
+from cache_predicoes import CachePredicoes, ler_resolucoes
+from estado_maquinas import SENSORES, EstadoMaquinas
+from inferencia import (AvaliadorMembros, ExecutorInferencia, calcular_confianca, preparar_modelo,
+                        prever_com_modelo)
+from metricas import MiddlewareMetricas, RegistroMetricas
+from microbatch import FilaMicroBatchCheia, MicroBatcher, coletar_lote
+from perfil import MiddlewarePerfil
+from pontuar_lote import CSV_TREINO, medianas_do_treino, montar_features_bloco, resultado_bloco
+from registro_modelos import ArtefatosModelo, RegistroModelos, impressao_artefatos
+from sombra import AvaliadorSombra
+from tarefas import MARGEM_MULTIPART, ErroTarefa, GerenciadorTarefas, MiddlewareLimiteUpload
+
+# Métricas por etapa expostas em /metrics
+METRICAS_ATIVAS = os.getenv("METRICAS_ATIVAS", "1") == "1"
+
+# Configuração do micro-batching de /predict (variáveis de ambiente)
+MICROBATCH_ATIVO = os.getenv("MICROBATCH_ATIVO", "1") == "1"
+MICROBATCH_MAX_TAMANHO = int(os.getenv("MICROBATCH_MAX_TAMANHO", "64"))
+MICROBATCH_MAX_ESPERA_MS = float(os.getenv("MICROBATCH_MAX_ESPERA_MS", "2"))
+MICROBATCH_MAX_FILA = int(os.getenv("MICROBATCH_MAX_FILA", "1024"))
+MICROBATCH_LOTES_SIMULTANEOS = int(os.getenv("MICROBATCH_LOTES_SIMULTANEOS", "2"))
+
+# Configuração do executor de inferência: "thread" ou "process"
+INFERENCIA_EXECUTOR = os.getenv("INFERENCIA_EXECUTOR", "thread")
+INFERENCIA_WORKERS = int(os.getenv("INFERENCIA_WORKERS", "0")) or None
+INFERENCIA_MAX_CONCORRENCIA = int(os.getenv("INFERENCIA_MAX_CONCORRENCIA", "0")) or None
+
+# "r" carrega os arrays NumPy do modelo como memmap somente leitura, compartilhando
+# as páginas do arquivo entre processos (workers do gunicorn ou do pool "process")
+MODELO_MMAP_MODE = os.getenv("MODELO_MMAP_MODE") or None
+
+# Backend do modelo: "sklearn" ou "compilado" (motor_arvores.py); com
+# INFERENCIA_VERIFICAR=1 o motor compilado é conferido contra o sklearn ao carregar
+INFERENCIA_BACKEND = os.getenv("INFERENCIA_BACKEND", "sklearn")
+INFERENCIA_VERIFICAR = os.getenv("INFERENCIA_VERIFICAR", "0") == "1"
+# Lotes maiores que isso vão para o sklearn, que é mais rápido em lotes grandes
+INFERENCIA_COMPILADO_MAX_LOTE = int(os.getenv("INFERENCIA_COMPILADO_MAX_LOTE", "128"))
+# Inferência em float32: matriz de features, scaler e modelos compilados
+# (diferença para o float64 medida com `python motor_arvores.py float32`)
+INFERENCIA_FLOAT32 = os.getenv("INFERENCIA_FLOAT32", "0") == "1"
+DTYPE_FEATURES = np.float32 if INFERENCIA_FLOAT32 else np.float64
+
+# Avaliação dos modelos base em paralelo dentro de uma predição, em lotes a partir
+# de INFERENCIA_MEMBROS_MIN_LOTE linhas
+INFERENCIA_MEMBROS_PARALELOS = os.getenv("INFERENCIA_MEMBROS_PARALELOS", "0") == "1"
+INFERENCIA_MEMBROS_MIN_LOTE = int(os.getenv("INFERENCIA_MEMBROS_MIN_LOTE", "2048"))
+
+# Cascata: o primeiro estágio (primeiro_estagio.pkl, treinado em train_model.py)
+# responde as linhas fora da banda de incerteza e o stacking só roda nas demais.
+# Uma fração das linhas não escaladas também passa pelo stacking para medir a concordância.
+CASCATA_ATIVA = os.getenv("CASCATA_ATIVA", "0") == "1"
+CASCATA_BANDA = (float(os.getenv("CASCATA_BANDA_INFERIOR", "0.01")), float(os.getenv("CASCATA_BANDA_SUPERIOR", "0.99")))
+CASCATA_AMOSTRA_CONCORDANCIA = float(os.getenv("CASCATA_AMOSTRA_CONCORDANCIA", "0.01"))
+
+# Cache de predições (opcional)
+CACHE_ATIVO = os.getenv("CACHE_ATIVO", "0") == "1"
+CACHE_MAX_ITENS = int(os.getenv("CACHE_MAX_ITENS", "100000"))
+CACHE_TTL_S = float(os.getenv("CACHE_TTL_S", "300"))
+# Sem CACHE_RESOLUCAO, cada feature usa a precisão do seu sensor (RESOLUCOES_PADRAO);
+# CACHE_RESOLUCOES ajusta colunas específicas ("torque=0.5,velocidade_rotacional=10")
+CACHE_RESOLUCAO = float(os.environ["CACHE_RESOLUCAO"]) if os.getenv("CACHE_RESOLUCAO") else None
+CACHE_RESOLUCOES = os.getenv("CACHE_RESOLUCOES", "")
+
+# Tamanho dos lotes do /predict_stream
+STREAM_TAMANHO_LOTE = int(os.getenv("STREAM_TAMANHO_LOTE", "1000"))
+STREAM_MAX_BYTES_LINHA = 64 * 1024
+
+# Agrupamento de leituras no WebSocket /ws/predict
+WS_MAX_TAMANHO_LOTE = int(os.getenv("WS_MAX_TAMANHO_LOTE", "256"))
+WS_MAX_ESPERA_MS = float(os.getenv("WS_MAX_ESPERA_MS", "0"))
+
+# Aquecimento antes de reportar pronto: tamanhos dos lotes sintéticos e repetições
+AQUECIMENTO_LOTES = [int(n) for n in os.getenv("AQUECIMENTO_LOTES", "1,64,1024").split(",") if n]
+AQUECIMENTO_REPETICOES = int(os.getenv("AQUECIMENTO_REPETICOES", "2"))
+
+# Registro de versões do modelo (registro_modelos.py). Sem versões publicadas a API
+# usa os .pkl do diretório atual. Com MODELOS_OBSERVAR_S > 0 o registro é consultado
+# nesse intervalo e a versão ativa é carregada e trocada sem reiniciar.
+MODELOS_DIR = os.getenv("MODELOS_DIR", "modelos")
+MODELOS_OBSERVAR_S = float(os.getenv("MODELOS_OBSERVAR_S", "0"))
+# Lote sintético que a nova versão precisa pontuar antes da troca e a concordância
+# mínima com a versão atual nesse lote (0 desliga a checagem)
+CANARIO_TAMANHO = int(os.getenv("CANARIO_TAMANHO", "256"))
+CANARIO_MIN_CONCORDANCIA = float(os.getenv("CANARIO_MIN_CONCORDANCIA", "0"))
+
+# Modo sombra: uma fração das requisições é reavaliada pela versão candidata do
+# registro depois da resposta enviada, em uma fila limitada que descarta o excesso
+SOMBRA_VERSAO = os.getenv("SOMBRA_VERSAO") or None
+SOMBRA_FRACAO = float(os.getenv("SOMBRA_FRACAO", "0.05"))
+SOMBRA_MAX_FILA = int(os.getenv("SOMBRA_MAX_FILA", "100"))
+
+# Controle de admissão: limite adaptativo (AIMD) de linhas em voo, com um orçamento
+# para /predict e outro para os lotes; o excesso recebe 429 com Retry-After na hora
+ADMISSAO_ATIVA = os.getenv("ADMISSAO_ATIVA", "0") == "1"
+ADMISSAO_PREDICT_LIMITE = int(os.getenv("ADMISSAO_PREDICT_LIMITE", "64"))
+ADMISSAO_PREDICT_LATENCIA_ALVO_MS = float(os.getenv("ADMISSAO_PREDICT_LATENCIA_ALVO_MS", "50"))
+ADMISSAO_LOTE_LIMITE = int(os.getenv("ADMISSAO_LOTE_LIMITE", "20000"))
+ADMISSAO_LOTE_LATENCIA_ALVO_MS = float(os.getenv("ADMISSAO_LOTE_LATENCIA_ALVO_MS", "1000"))
+ADMISSAO_MAX_FILA = int(os.getenv("ADMISSAO_MAX_FILA", "64"))
+ADMISSAO_MAX_ESPERA_MS = float(os.getenv("ADMISSAO_MAX_ESPERA_MS", "50"))
+
+# Estado por máquina: leituras recentes de cada id_produto em buffers circulares, com
+# média, inclinação e delta por sensor; o snapshot é lido ao subir e gravado ao desligar
+ESTADO_ATIVO = os.getenv("ESTADO_ATIVO", "0") == "1"
+ESTADO_JANELA = int(os.getenv("ESTADO_JANELA", "32"))
+ESTADO_MAX_MAQUINAS = int(os.getenv("ESTADO_MAX_MAQUINAS", "10000"))
+ESTADO_TTL_S = float(os.getenv("ESTADO_TTL_S", "3600"))
+ESTADO_ARQUIVO = os.getenv("ESTADO_ARQUIVO") or None
+ESTADO_SNAPSHOT_S = float(os.getenv("ESTADO_SNAPSHOT_S", "0"))
+
+# Perfil por requisição: com PERFIL_DIR, as requisições com o cabeçalho X-Profile: 1
+# e uma fração sorteada das demais são amostradas e o perfil é gravado nesse diretório
+PERFIL_DIR = os.getenv("PERFIL_DIR") or None
+PERFIL_FRACAO = float(os.getenv("PERFIL_FRACAO", "0"))
+PERFIL_INTERVALO_MS = float(os.getenv("PERFIL_INTERVALO_MS", "1"))
+PERFIL_FORMATO = os.getenv("PERFIL_FORMATO", "collapsed")
+
+# Tarefas de pontuação: uploads CSV/Parquet gravados em JOBS_DIR e pontuados em
+# segundo plano, bloco a bloco, sem manter a conexão HTTP aberta
+JOBS_DIR = os.getenv("JOBS_DIR", "jobs")
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "1"))
+JOBS_MAX_FILA = int(os.getenv("JOBS_MAX_FILA", "16"))
+JOBS_TAMANHO_BLOCO = int(os.getenv("JOBS_TAMANHO_BLOCO", "10000"))
+JOBS_MAX_MB = float(os.getenv("JOBS_MAX_MB", "1024"))
+JOBS_RETENCAO_S = float(os.getenv("JOBS_RETENCAO_S", "86400"))
+
+CAMINHO_MODELO = 'stacking_model.pkl'
+CAMINHO_SCALER = 'scaler.pkl'
+CAMINHO_LABEL_ENCODER = 'label_encoder.pkl'
+CAMINHO_PRIMEIRO_ESTAGIO = 'primeiro_estagio.pkl'
+
+registro_modelos = RegistroModelos(MODELOS_DIR)
+
+# Versão em uso e a anterior, mantida em memória para o rollback imediato. Cada
+# predição lê artefatos uma vez e usa esse objeto até o fim, então a troca é uma
+# única atribuição e as predições em andamento terminam na versão antiga.
+artefatos = None
+artefatos_anterior = None
+cache_predicoes = None
+trava_troca = None
+
+# "carregando" -> "aquecendo" -> "pronto", ou "erro" se os artefatos não carregarem
+estado_modelo = "carregando"
+erro_modelo = None
+
+micro_batcher = None
+executor_inferencia = None
+avaliador_membros = None
+avaliador_sombra = None
+gerenciador_tarefas = None
+
+def criar_orcamento(nome, limite, latencia_alvo_ms):
+    """Orçamento de admissão que varia entre 1/16 e 16 vezes o limite inicial"""
+    minimo = max(1, limite // 16)
+    return OrcamentoAdmissao(
+        nome, limite, latencia_alvo_ms / 1000,
+        limite_min=minimo, limite_max=limite * 16, incremento=minimo,
+        max_fila=ADMISSAO_MAX_FILA, max_espera=ADMISSAO_MAX_ESPERA_MS / 1000
+    )
+
+# /predict pesa 1; /predict_batch e /predict_columnar pesam o número de linhas
+orcamento_predict = orcamento_lote = None
+if ADMISSAO_ATIVA:
+    orcamento_predict = criar_orcamento("predict", ADMISSAO_PREDICT_LIMITE, ADMISSAO_PREDICT_LATENCIA_ALVO_MS)
+    orcamento_lote = criar_orcamento("lote", ADMISSAO_LOTE_LIMITE, ADMISSAO_LOTE_LATENCIA_ALVO_MS)
+
+estado_maquinas = EstadoMaquinas(ESTADO_JANELA, ESTADO_MAX_MAQUINAS, ESTADO_TTL_S) if ESTADO_ATIVO else None
+
+# Contagens acumuladas da cascata: linhas, escaladas para o stacking, comparadas e concordantes
+contagens_cascata = {"linhas": 0, "escaladas": 0, "comparadas": 0, "concordantes": 0}
+
+def ler_artefatos(versao=None):
+    """Carrega uma versão do registro (a ativa se versao=None) ou, sem registro, os .pkl locais (bloqueante)"""
+    versao = versao or registro_modelos.versao_ativa()
+    if versao is not None:
+        caminho_modelo, caminho_scaler, caminho_label_encoder = registro_modelos.caminhos(versao)
+        caminho_primeiro_estagio = registro_modelos.caminho_primeiro_estagio(versao)
+    else:
+        caminho_modelo, caminho_scaler, caminho_label_encoder = CAMINHO_MODELO, CAMINHO_SCALER, CAMINHO_LABEL_ENCODER
+        caminho_primeiro_estagio = CAMINHO_PRIMEIRO_ESTAGIO if os.path.isfile(CAMINHO_PRIMEIRO_ESTAGIO) else None
+        versao = impressao_artefatos(caminho_modelo, caminho_scaler, caminho_label_encoder)
+
+    if not CASCATA_ATIVA:
+        caminho_primeiro_estagio = None
+    elif caminho_primeiro_estagio is None:
+        print(f"Versão {versao} sem primeiro estágio: cascata desligada")
+
+    modelo = joblib.load(caminho_modelo, mmap_mode=MODELO_MMAP_MODE)
+    scaler = joblib.load(caminho_scaler)
+    return ArtefatosModelo(
+        versao=versao,
+        modelo=modelo,
+        scaler=scaler,
+        label_encoder=joblib.load(caminho_label_encoder),
+        modelo_inferencia=preparar_modelo(
+            modelo,
+            INFERENCIA_BACKEND,
+            verificar=INFERENCIA_VERIFICAR,
+            max_lote_compilado=INFERENCIA_COMPILADO_MAX_LOTE,
+            scaler=scaler,
+            primeiro_estagio=joblib.load(caminho_primeiro_estagio) if caminho_primeiro_estagio else None,
+            banda_cascata=CASCATA_BANDA,
+            amostra_concordancia=CASCATA_AMOSTRA_CONCORDANCIA,
+            float32=INFERENCIA_FLOAT32
+        ),
+        caminho_modelo=caminho_modelo,
+        caminho_scaler=caminho_scaler,
+        caminho_label_encoder=caminho_label_encoder,
+        caminho_primeiro_estagio=caminho_primeiro_estagio
+    )
+
+def carregar_artefatos():
+    """Carrega a versão inicial do modelo (bloqueante; roda fora do event loop)"""
+    global artefatos, cache_predicoes
+    artefatos = ler_artefatos()
+    if CACHE_ATIVO and cache_predicoes is None:
+        cache_predicoes = CachePredicoes(
+            max_itens=CACHE_MAX_ITENS,
+            ttl=CACHE_TTL_S,
+            resolucao=ler_resolucoes(COLUNAS_NUMERICAS + ['tipo'] + COLUNAS_FALHA, CACHE_RESOLUCAO, CACHE_RESOLUCOES),
+            versao=artefatos.versao
+        )
+
+def colunas_sinteticas(n, semente=0, art=None):
+    """Leituras sintéticas em torno da média do treino, para o aquecimento e o canário"""
+    art = art or artefatos
+    rng = np.random.default_rng(semente)
+    colunas = {
+        col: rng.normal(art.scaler.mean_[j], art.scaler.scale_[j], size=n)
+        for j, col in enumerate(COLUNAS_NUMERICAS)
+    }
+    colunas['tipo'] = rng.choice(art.label_encoder.classes_, size=n)
+    return colunas
+
+async def aquecer():
+    """Passa lotes sintéticos por todas as etapas (label_encoder, scaler, modelos, resposta)"""
+    for repeticao in range(AQUECIMENTO_REPETICOES):
+        for tamanho in AQUECIMENTO_LOTES:
+            features = montar_features_colunar(colunas_sinteticas(tamanho, semente=repeticao))
+            # Várias chamadas simultâneas para aquecer todos os workers do executor
+            resultados = await asyncio.gather(*[
+                executar_no_modelo(features) for _ in range(executor_inferencia.workers if executor_inferencia else 1)
+            ])
+            formatar_predicoes(*resultados[0][:2])
+
+async def validar_canario(novos):
+    """
+    Pontua um lote sintético com a nova versão pelo mesmo caminho das predições
+    (aquecendo também os workers do executor) e compara com a versão atual.
+    Levanta ValueError se a nova versão não puder substituir a atual.
+    """
+    if list(novos.label_encoder.classes_) != list(artefatos.label_encoder.classes_):
+        raise ValueError(f"label_encoder incompatível: {list(novos.label_encoder.classes_)}")
+    if novos.modelo.n_features_in_ != len(COLUNAS_NUMERICAS) + 1 + len(COLUNAS_FALHA):
+        raise ValueError(f"Modelo espera {novos.modelo.n_features_in_} features")
+
+    features = montar_features_colunar(colunas_sinteticas(CANARIO_TAMANHO, art=novos))
+    predicoes, probabilidades, _, _ = await executar_no_modelo(features, novos)
+    if predicoes.shape != (CANARIO_TAMANHO,) or not np.isfinite(probabilidades).all():
+        raise ValueError("Saída inválida no lote canário")
+    if ((probabilidades < 0) | (probabilidades > 1)).any():
+        raise ValueError("Probabilidades fora de [0, 1] no lote canário")
+
+    predicoes_atuais, probabilidades_atuais, _, _ = await executar_no_modelo(features, artefatos)
+    concordancia = float((predicoes == predicoes_atuais).mean())
+    if concordancia < CANARIO_MIN_CONCORDANCIA:
+        raise ValueError(f"Concordância com a versão atual abaixo do mínimo: {concordancia:.3f}")
+    return {
+        "linhas": CANARIO_TAMANHO,
+        "concordancia": concordancia,
+        "max_diferenca_probabilidade": float(np.max(np.abs(probabilidades - probabilidades_atuais))),
+    }
+
+async def trocar_versao(versao=None):
+    """
+    Carrega uma versão em segundo plano, valida com o lote canário e troca de uma
+    vez. Uma versão que falha na validação nunca chega a responder predições.
+    """
+    global artefatos, artefatos_anterior
+    async with trava_troca:
+        versao = versao or registro_modelos.versao_ativa()
+        if versao is not None and versao == artefatos.versao:
+            return {"versao_modelo": artefatos.versao, "trocado": False}
+        if artefatos_anterior is not None and versao == artefatos_anterior.versao:
+            # Versão anterior ainda em memória e já validada: troca imediata
+            novos, canario = artefatos_anterior, None
+        else:
+            novos = await asyncio.to_thread(ler_artefatos, versao)
+            if novos.versao == artefatos.versao:
+                return {"versao_modelo": artefatos.versao, "trocado": False}
+            canario = await validar_canario(novos)
+        artefatos_anterior, artefatos = artefatos, novos
+        if registro_modelos.versao_ativa() not in (None, novos.versao):
+            registro_modelos.ativar(novos.versao)
+        print(f"Modelo trocado: {artefatos_anterior.versao} -> {novos.versao}")
+        return {
+            "versao_modelo": novos.versao,
+            "versao_anterior": artefatos_anterior.versao,
+            "trocado": True,
+            "canario": canario,
+        }
+
+async def observar_registro():
+    """Troca para a versão ativa do registro quando ela muda (uma tentativa por versão)"""
+    rejeitada = None
+    while True:
+        await asyncio.sleep(MODELOS_OBSERVAR_S)
+        if estado_modelo != "pronto":
+            continue
+        versao = await asyncio.to_thread(registro_modelos.versao_ativa)
+        if versao is None or versao in (artefatos.versao, rejeitada):
+            continue
+        try:
+            await trocar_versao(versao)
+        except Exception as e:
+            print(f"Versão {versao} rejeitada: {e}")
+            rejeitada = versao
+
+def prever_sombra(candidato, features):
+    """Inferência do modelo sombra, direto no modelo candidato (sem cache nem micro-batcher)"""
+    predicoes, probabilidades, _, _ = prever_com_modelo(candidato.modelo_inferencia, candidato.scaler, features)
+    return predicoes, probabilidades
+
+async def iniciar_sombra():
+    """Carrega a versão candidata do registro e inicia o avaliador sombra; uma falha só desliga o modo sombra"""
+    global avaliador_sombra
+    try:
+        candidato = await asyncio.to_thread(ler_artefatos, SOMBRA_VERSAO)
+        # Primeira chamada fora da medição, para a latência não incluir a inicialização do modelo
+        await asyncio.to_thread(prever_sombra, candidato, montar_features_colunar(colunas_sinteticas(8, art=candidato)))
+    except Exception as e:
+        print(f"Modo sombra desligado: versão {SOMBRA_VERSAO} não carregou ({e})")
+        return
+    avaliador_sombra = AvaliadorSombra(
+        partial(prever_sombra, candidato),
+        candidato.versao,
+        fracao=SOMBRA_FRACAO,
+        max_fila=SOMBRA_MAX_FILA
+    )
+    avaliador_sombra.iniciar()
+    print(f"Modo sombra ativo: versão {candidato.versao} em {SOMBRA_FRACAO:.0%} das requisições")
+
+def com_sombra(resposta, features, predicoes, probabilidades, latencia):
+    """
+    Sorteia a requisição para o modo sombra e, se for o caso, agenda o envio para
+    a fila do avaliador como tarefa de fundo, que só roda depois da resposta enviada
+    """
+    if avaliador_sombra is not None and avaliador_sombra.amostrar():
+        resposta.background = BackgroundTask(avaliador_sombra.submeter, features, predicoes, probabilidades, latencia)
+    return resposta
+
+def arquivo_estado():
+    """
+    Snapshot deste processo. O estado é de cada worker: sob o gunicorn_conf.py,
+    cada um grava e restaura o seu arquivo (estado.npz -> estado.3.npz)
+    """
+    indice = os.getenv("WORKER_INDICE")
+    if indice is None:
+        return ESTADO_ARQUIVO
+    raiz, extensao = os.path.splitext(ESTADO_ARQUIVO)
+    return f"{raiz}.{indice}{extensao}"
+
+async def gravar_estado():
+    """Snapshot do estado por máquina: cópia no event loop, escrita em uma thread"""
+    caminho = arquivo_estado()
+    try:
+        maquinas = await asyncio.to_thread(EstadoMaquinas.gravar, estado_maquinas.instantaneo(), caminho)
+        print(f"Estado de {maquinas} máquinas salvo em {caminho}")
+    except Exception as e:
+        print(f"Erro ao salvar o estado das máquinas: {e}")
+
+async def gravar_estado_periodicamente():
+    while True:
+        await asyncio.sleep(ESTADO_SNAPSHOT_S)
+        await gravar_estado()
+
+def restaurar_estado():
+    caminho = arquivo_estado()
+    if not os.path.exists(caminho):
+        return
+    try:
+        print(f"Estado de {estado_maquinas.restaurar(caminho)} máquinas restaurado de {caminho}")
+    except Exception as e:
+        print(f"Erro ao restaurar o estado das máquinas: {e}")
+
+async def preparar_tarefa():
+    """Versão do modelo e medianas do treino usadas em todos os blocos de uma tarefa"""
+    art = artefatos
+    medianas = await asyncio.to_thread(medianas_do_treino, CSV_TREINO, art.scaler)
+    return art.versao, (art, medianas)
+
+async def pontuar_bloco_tarefa(bloco, inicio, contexto):
+    """Pontua um bloco de uma tarefa no executor de inferência, como um lote comum"""
+    art, medianas = contexto
+    features, validas = await asyncio.to_thread(montar_features_bloco, bloco, medianas, art.label_encoder.classes_)
+    predicoes = probabilidades = None
+    if validas.any():
+        features = features[validas].astype(DTYPE_FEATURES)
+        while True:
+            # Passa pelo mesmo orçamento dos lotes online; recusado, espera o Retry-After e tenta de novo
+            try:
+                async with admitir(orcamento_lote, len(features)):
+                    predicoes, probabilidades, _, _ = await executar_no_modelo(features, art)
+                break
+            except HTTPException as e:
+                if e.status_code != 429:
+                    raise
+                await asyncio.sleep(int(e.headers["Retry-After"]))
+    return await asyncio.to_thread(resultado_bloco, bloco, inicio, validas, predicoes, probabilidades)
+
+async def preparar_servico():
+    """Carrega os modelos (se ainda não foram carregados antes do fork) e aquece antes de ficar pronto"""
+    global estado_modelo, erro_modelo
+    try:
+        if artefatos is None:
+            await asyncio.to_thread(carregar_artefatos)
+        estado_modelo = "aquecendo"
+        inicio = time.perf_counter()
+        await aquecer()
+        # As linhas sintéticas do aquecimento não entram nas contagens da cascata
+        for chave in contagens_cascata:
+            contagens_cascata[chave] = 0
+        print(f"Modelo {artefatos.versao} pronto (aquecimento em {time.perf_counter() - inicio:.2f}s)")
+        estado_modelo = "pronto"
+        if SOMBRA_VERSAO:
+            await iniciar_sombra()
+    except Exception as e:
+        print(f"Erro ao carregar modelos: {e}")
+        estado_modelo = "erro"
+        erro_modelo = str(e)
+
+def exigir_modelo():
+    """Responde 503 enquanto o modelo carrega e 500 se o carregamento falhou"""
+    if artefatos is None:
+        if estado_modelo == "erro":
+            raise HTTPException(status_code=500, detail="Modelo não carregado")
+        raise HTTPException(status_code=503, detail="Modelo carregando", headers={"Retry-After": "1"})
+
+@asynccontextmanager
+async def lifespan(app):
+    global micro_batcher, executor_inferencia, avaliador_membros, avaliador_sombra, gerenciador_tarefas, trava_troca
+    trava_troca = asyncio.Lock()
+    if INFERENCIA_MEMBROS_PARALELOS and INFERENCIA_EXECUTOR == "thread":
+        # No modo "process" cada processo do executor cria o seu
+        avaliador_membros = AvaliadorMembros(min_linhas=INFERENCIA_MEMBROS_MIN_LOTE)
+    executor_inferencia = ExecutorInferencia(
+        prever_features,
+        modo=INFERENCIA_EXECUTOR,
+        workers=INFERENCIA_WORKERS,
+        max_concorrencia=INFERENCIA_MAX_CONCORRENCIA,
+        mmap_mode=MODELO_MMAP_MODE,
+        backend=INFERENCIA_BACKEND,
+        max_lote_compilado=INFERENCIA_COMPILADO_MAX_LOTE,
+        medir=METRICAS_ATIVAS,
+        banda_cascata=CASCATA_BANDA,
+        amostra_concordancia=CASCATA_AMOSTRA_CONCORDANCIA,
+        membros_min_lote=INFERENCIA_MEMBROS_MIN_LOTE if INFERENCIA_MEMBROS_PARALELOS else None,
+        float32=INFERENCIA_FLOAT32
+    )
+    if MICROBATCH_ATIVO:
+        micro_batcher = MicroBatcher(
+            executar_no_modelo,
+            max_tamanho=MICROBATCH_MAX_TAMANHO,
+            max_espera=MICROBATCH_MAX_ESPERA_MS / 1000,
+            max_fila=MICROBATCH_MAX_FILA,
+            max_lotes_simultaneos=MICROBATCH_LOTES_SIMULTANEOS
+        )
+        micro_batcher.iniciar()
+    gerenciador_tarefas = GerenciadorTarefas(
+        JOBS_DIR, preparar_tarefa, pontuar_bloco_tarefa,
+        workers=JOBS_WORKERS,
+        max_fila=JOBS_MAX_FILA,
+        tamanho_bloco=JOBS_TAMANHO_BLOCO,
+        max_bytes=int(JOBS_MAX_MB * 1024 * 1024),
+        retencao=JOBS_RETENCAO_S
+    )
+    gerenciador_tarefas.iniciar()
+    persistir_estado = estado_maquinas is not None and ESTADO_ARQUIVO is not None
+    if persistir_estado:
+        restaurar_estado()
+    # O servidor começa a aceitar conexões enquanto o modelo carrega
+    tarefa_preparo = asyncio.create_task(preparar_servico())
+    tarefa_observador = asyncio.create_task(observar_registro()) if MODELOS_OBSERVAR_S > 0 else None
+    tarefa_snapshot = (asyncio.create_task(gravar_estado_periodicamente())
+                       if persistir_estado and ESTADO_SNAPSHOT_S > 0 else None)
+    yield
+    tarefa_preparo.cancel()
+    if tarefa_observador is not None:
+        tarefa_observador.cancel()
+    if tarefa_snapshot is not None:
+        tarefa_snapshot.cancel()
+    if persistir_estado:
+        await gravar_estado()
+    await gerenciador_tarefas.parar()
+    if micro_batcher is not None:
+        await micro_batcher.parar()
+        micro_batcher = None
+    if executor_inferencia is not None:
+        executor_inferencia.encerrar()
+        executor_inferencia = None
+    if avaliador_membros is not None:
+        avaliador_membros.encerrar()
+        avaliador_membros = None
+    if avaliador_sombra is not None:
+        await avaliador_sombra.parar()
+        avaliador_sombra = None
+
+def _valor_json(obj):
+    # Arrays e escalares NumPy para o json padrão (o orjson os serializa direto)
+    if isinstance(obj, (np.ndarray, np.generic)):
+        return obj.tolist()
+    raise TypeError(f"Objeto do tipo {type(obj).__name__} não é serializável em JSON")
+
+def para_json(conteudo):
+    """Serializa para JSON compacto (bytes), com orjson quando disponível"""
+    if orjson is not None:
+        return orjson.dumps(conteudo, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(conteudo, default=_valor_json, ensure_ascii=False, separators=(",", ":")).encode()
+
+def ler_json(corpo):
+    """Desserializa JSON com orjson quando disponível (os erros de ambos são ValueError)"""
+    if orjson is not None:
+        return orjson.loads(corpo)
+    return json.loads(corpo)
+
+class RespostaJSON(JSONResponse):
+    """
+    Resposta JSON serializada com orjson, sem o jsonable_encoder nem a validação do
+    response_model do FastAPI. Aceita arrays NumPy no conteúdo, então a resposta
+    colunar sai direto dos arrays de resultado.
+    """
+
+    def render(self, content):
+        return para_json(content)
 
 app = FastAPI(
     title="API de Predição de Falhas em Máquinas",
     description="API para predição de falhas em máquinas usando Stacking Ensemble",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+if ADMISSAO_ATIVA:
+    # Adicionado antes do middleware de métricas, que fica por fora e conta os 429
+    app.add_middleware(MiddlewareAdmissao, orcamentos={
+        "/predict": orcamento_predict, "/predict_batch": orcamento_lote, "/predict_columnar": orcamento_lote
+    })
+
+# Antes do middleware de métricas, que fica por fora e conta os 413
+app.add_middleware(MiddlewareLimiteUpload, max_bytes=int(JOBS_MAX_MB * 1024 * 1024) + MARGEM_MULTIPART,
+                   rotas={"/jobs"})
+
+metricas = RegistroMetricas()
+if METRICAS_ATIVAS:
+    app.add_middleware(MiddlewareMetricas, registro=metricas, rotas=app.routes)
+    metricas.registrar_coletor(
+        "api_microbatch_profundidade_fila", "gauge", "Chamadas de /predict aguardando o micro-batcher",
+        lambda: [([], micro_batcher.fila.qsize() if micro_batcher is not None and micro_batcher.fila else 0)]
+    )
+    metricas.registrar_coletor(
+        "api_cache_consultas_total", "counter", "Consultas ao cache de predições por resultado",
+        lambda: [([("resultado", "acerto")], cache_predicoes.acertos),
+                 ([("resultado", "falta")], cache_predicoes.faltas)] if cache_predicoes is not None else []
+    )
+    metricas.registrar_coletor(
+        "api_cascata_linhas_total", "counter", "Linhas pontuadas pela cascata por estágio que respondeu",
+        lambda: [([("estagio", "primeiro")], contagens_cascata["linhas"] - contagens_cascata["escaladas"]),
+                 ([("estagio", "completo")], contagens_cascata["escaladas"])] if CASCATA_ATIVA else []
+    )
+    metricas.registrar_coletor(
+        "api_cascata_comparacoes_total", "counter",
+        "Linhas não escaladas também pontuadas pelo stacking, por concordância entre os estágios",
+        lambda: [([("concorda", "sim")], contagens_cascata["concordantes"]),
+                 ([("concorda", "nao")], contagens_cascata["comparadas"] - contagens_cascata["concordantes"])]
+        if CASCATA_ATIVA else []
+    )
+    metricas.registrar_coletor(
+        "api_sombra_requisicoes_total", "counter", "Requisições sorteadas para o modelo sombra por destino",
+        lambda: [([("destino", "avaliada")], avaliador_sombra.avaliadas),
+                 ([("destino", "descartada")], avaliador_sombra.descartadas),
+                 ([("destino", "erro")], avaliador_sombra.erros)] if avaliador_sombra is not None else []
+    )
+    metricas.registrar_coletor(
+        "api_sombra_linhas_total", "counter", "Linhas reavaliadas pelo modelo sombra por concordância com o principal",
+        lambda: [([("concorda", "sim")], avaliador_sombra.linhas - avaliador_sombra.linhas_discordantes),
+                 ([("concorda", "nao")], avaliador_sombra.linhas_discordantes)] if avaliador_sombra is not None else []
+    )
+    if ADMISSAO_ATIVA:
+        orcamentos = (orcamento_predict, orcamento_lote)
+        metricas.registrar_coletor(
+            "api_admissao_limite", "gauge", "Limite adaptativo de linhas em voo por orçamento",
+            lambda: [([("orcamento", o.nome)], o.limite) for o in orcamentos]
+        )
+        metricas.registrar_coletor(
+            "api_admissao_em_uso", "gauge", "Linhas em voo por orçamento",
+            lambda: [([("orcamento", o.nome)], o.em_uso) for o in orcamentos]
+        )
+        metricas.registrar_coletor(
+            "api_admissao_requisicoes_total", "counter", "Requisições por orçamento e resultado da admissão",
+            lambda: [item for o in orcamentos for item in (
+                ([("orcamento", o.nome), ("resultado", "admitida")], o.admitidas),
+                ([("orcamento", o.nome), ("resultado", "recusada")], o.recusadas))]
+        )
+
+if PERFIL_DIR:
+    # Por último: fica por fora de todos e o perfil cobre a requisição inteira
+    app.add_middleware(MiddlewarePerfil, diretorio=PERFIL_DIR, fracao=PERFIL_FRACAO,
+                       intervalo=PERFIL_INTERVALO_MS / 1000, formato=PERFIL_FORMATO)
+
 class MachineData(BaseModel):
     temperatura_ar: float
     temperatura_processo: float
@@ -36,11 +642,15 @@ class MachineData(BaseModel):
     fp_falha_potencia: int = 0
     fte_falha_tensao_excessiva: int = 0
     fa_falha_aleatoria: int = 0
+    # Identifica a máquina no estado por máquina (ESTADO_ATIVO); opcional
+    id_produto: Optional[str] = None
 
 class PredictionResponse(BaseModel):
     falha_prevista: bool
     probabilidade_falha: float
-    confianca: str
+    confianca: Optional[str] = None
+    versao_modelo: Optional[str] = None
+    tendencia: Optional[dict] = None
 
 @app.get("/")
 async def root():
@@ -48,112 +658,779 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    if model is None:
-        return {"status": "erro", "message": "Modelos não carregados"}
-    return {"status": "ok", "message": "API funcionando corretamente"}
+    # Liveness: responde enquanto o processo estiver de pé, mesmo com o modelo carregando
+    if estado_modelo == "erro":
+        return {"status": "erro", "message": f"Modelos não carregados: {erro_modelo}"}
+    return {"status": "ok", "message": "API funcionando corretamente", "modelo": estado_modelo}
 
-@app.post("/predict", response_model=PredictionResponse)
-async def predict_failure(data: MachineData):
-    if model is None:
-        raise HTTPException(status_code=500, detail="Modelo não carregado")
-
-    try:
-        # Preparar dados de entrada
-        # Codificar tipo de máquina
-        if data.tipo not in ['L', 'M', 'H']:
-            raise HTTPException(status_code=400, detail="Tipo deve ser L, M ou H")
-
-        tipo_encoded = label_encoder.transform([data.tipo])[0]
-
-        # Criar array de features
-        features = np.array([[
-            data.temperatura_ar,
-            data.temperatura_processo,
-            data.umidade_relativa,
-            data.velocidade_rotacional,
-            data.torque,
-            data.desgaste_da_ferramenta,
-            tipo_encoded,
-            data.fdf_falha_desgaste_ferramenta,
-            data.fdc_falha_dissipacao_calor,
-            data.fp_falha_potencia,
-            data.fte_falha_tensao_excessiva,
-            data.fa_falha_aleatoria
-        ]])
-
-        # Normalizar features
-        features_scaled = scaler.transform(features)
-
-        # Fazer predição
-        prediction = model.predict(features_scaled)[0]
-        probability = model.predict_proba(features_scaled)[0]
-
-        # Calcular confiança
-        prob_falha = probability[1]
-        if prob_falha > 0.8:
-            confianca = "Alta"
-        elif prob_falha > 0.5:
-            confianca = "Média"
+@app.get("/ready")
+async def readiness_check():
+    # Readiness: 200 só depois de carregar e aquecer o modelo
+    if estado_modelo != "pronto":
+        versao = artefatos.versao if artefatos is not None else None
+        return JSONResponse(status_code=503, content={"status": estado_modelo, "versao_modelo": versao})
+    return {"status": "pronto", "versao_modelo": artefatos.versao}
+
+# Ordem das colunas usada no treino (feature_cols em train_model.py)
+COLUNAS_NUMERICAS = [
+    'temperatura_ar',
+    'temperatura_processo',
+    'umidade_relativa',
+    'velocidade_rotacional',
+    'torque',
+    'desgaste_da_ferramenta',
+]
+COLUNAS_FALHA = [
+    'fdf_falha_desgaste_ferramenta',
+    'fdc_falha_dissipacao_calor',
+    'fp_falha_potencia',
+    'fte_falha_tensao_excessiva',
+    'fa_falha_aleatoria',
+]
+TIPOS_VALIDOS = ['L', 'M', 'H']
+MENSAGEM_TIPO = f"Tipo deve ser {', '.join(TIPOS_VALIDOS[:-1])} ou {TIPOS_VALIDOS[-1]}"
+
+def codificar_tipos(tipos):
+    """Codifica o tipo de máquina de forma vetorizada (equivalente ao label_encoder.transform)"""
+    inicio = time.perf_counter()
+    tipos = np.asarray(tipos, dtype=object)
+    # As classes são as mesmas em todas as versões (conferido em validar_canario)
+    classes = artefatos.label_encoder.classes_
+    codigos = np.searchsorted(classes, tipos)
+    validos = (codigos < len(classes)) & (classes[np.minimum(codigos, len(classes) - 1)] == tipos)
+    if not validos.all():
+        invalidos = np.flatnonzero(~validos)[:10].tolist()
+        raise HTTPException(status_code=400, detail=f"{MENSAGEM_TIPO} (itens inválidos: {invalidos})")
+    if METRICAS_ATIVAS:
+        metricas.observar_etapa("label_encoder", time.perf_counter() - inicio)
+    return codigos
+
+def montar_features(data_list):
+    """Monta a matriz de features (n x 12) a partir de uma lista de MachineData"""
+    n = len(data_list)
+    features = np.empty((n, len(COLUNAS_NUMERICAS) + 1 + len(COLUNAS_FALHA)), dtype=DTYPE_FEATURES)
+    for j, col in enumerate(COLUNAS_NUMERICAS):
+        features[:, j] = [getattr(d, col) for d in data_list]
+    features[:, len(COLUNAS_NUMERICAS)] = codificar_tipos([d.tipo for d in data_list])
+    for j, col in enumerate(COLUNAS_FALHA, start=len(COLUNAS_NUMERICAS) + 1):
+        features[:, j] = [getattr(d, col) for d in data_list]
+    return features
+
+# Valores padrão do MachineData para colunas opcionais no formato colunar
+PADROES_COLUNAS = {'umidade_relativa': 90.0, **{col: 0 for col in COLUNAS_FALHA}}
+
+def coluna_numerica(nome, valores, n):
+    """Converte uma coluna para float64 e valida tudo de uma vez"""
+    try:
+        coluna = np.asarray(valores, dtype=np.float64)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Coluna '{nome}' deve conter apenas números")
+    if coluna.shape != (n,):
+        raise HTTPException(status_code=400, detail=f"Coluna '{nome}' deve ter {n} valores")
+    if not np.isfinite(coluna).all():
+        raise HTTPException(status_code=400, detail=f"Coluna '{nome}' contém valores inválidos (NaN/inf)")
+    return coluna
+
+def montar_features_colunar(colunas):
+    """Monta a matriz de features a partir de um dicionário coluna -> valores, sem objetos por linha"""
+    faltando = [c for c in COLUNAS_NUMERICAS + ['tipo'] if c not in colunas and c not in PADROES_COLUNAS]
+    if faltando:
+        raise HTTPException(status_code=400, detail=f"Colunas obrigatórias ausentes: {faltando}")
+
+    tipos = np.asarray(colunas['tipo'], dtype=object)
+    if tipos.ndim != 1:
+        raise HTTPException(status_code=400, detail="Coluna 'tipo' deve ser uma lista de valores")
+    nao_texto = [i for i, tipo in enumerate(tipos) if not isinstance(tipo, str)]
+    if nao_texto:
+        # null ou número quebrariam o searchsorted de codificar_tipos
+        raise HTTPException(status_code=400, detail=f"{MENSAGEM_TIPO} (itens inválidos: {nao_texto[:10]})")
+    n = len(tipos)
+    features = np.empty((n, len(COLUNAS_NUMERICAS) + 1 + len(COLUNAS_FALHA)), dtype=DTYPE_FEATURES)
+    for j, col in enumerate(COLUNAS_NUMERICAS):
+        if col in colunas:
+            features[:, j] = coluna_numerica(col, colunas[col], n)
+        else:
+            features[:, j] = PADROES_COLUNAS[col]
+    features[:, len(COLUNAS_NUMERICAS)] = codificar_tipos(tipos)
+    for j, col in enumerate(COLUNAS_FALHA, start=len(COLUNAS_NUMERICAS) + 1):
+        if col in colunas:
+            coluna = coluna_numerica(col, colunas[col], n)
+            if not (coluna == np.round(coluna)).all():
+                raise HTTPException(status_code=400, detail=f"Coluna '{col}' deve conter inteiros")
+            features[:, j] = coluna
         else:
-            confianca = "Baixa"
+            features[:, j] = PADROES_COLUNAS[col]
+    return features
 
-        return PredictionResponse(
-            falha_prevista=bool(prediction),
-            probabilidade_falha=float(prob_falha),
-            confianca=confianca
-        )
+def ler_arrow(corpo, formato_arquivo):
+    """Lê um corpo Arrow IPC (stream ou file) e devolve um dicionário de colunas"""
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise HTTPException(status_code=415, detail="Suporte a Arrow requer o pacote pyarrow")
 
+    try:
+        if formato_arquivo:
+            tabela = pa.ipc.open_file(pa.BufferReader(corpo)).read_all()
+        else:
+            tabela = pa.ipc.open_stream(pa.BufferReader(corpo)).read_all()
+    except pa.ArrowInvalid as e:
+        raise HTTPException(status_code=400, detail=f"Corpo Arrow inválido: {e}")
+    return {nome: tabela.column(nome).to_numpy() for nome in tabela.column_names}
+
+def ler_npy(corpo):
+    """Lê uma matriz .npy (n x 12) já na ordem de feature_cols, com tipo codificado"""
+    try:
+        features = np.load(io.BytesIO(corpo), allow_pickle=False)
+    except (ValueError, OSError, EOFError) as e:
+        raise HTTPException(status_code=400, detail=f"Corpo .npy inválido: {e}")
+
+    n_colunas = len(COLUNAS_NUMERICAS) + 1 + len(COLUNAS_FALHA)
+    if features.ndim != 2 or features.shape[1] != n_colunas:
+        raise HTTPException(status_code=400, detail=f"Matriz .npy deve ter formato (n, {n_colunas})")
+    features = np.ascontiguousarray(features, dtype=DTYPE_FEATURES)
+    if not np.isfinite(features).all():
+        raise HTTPException(status_code=400, detail="Matriz .npy contém valores inválidos (NaN/inf)")
+    tipo = features[:, len(COLUNAS_NUMERICAS)]
+    if not np.isin(tipo, np.arange(len(artefatos.label_encoder.classes_))).all():
+        raise HTTPException(status_code=400, detail="Coluna tipo_encoded fora dos códigos do label_encoder")
+    return features
+
+def prever_features(features, art):
+    """Normaliza e roda o modelo uma única vez para todo o lote"""
+    return prever_com_modelo(art.modelo_inferencia, art.scaler, features, medir=METRICAS_ATIVAS,
+                             avaliador=avaliador_membros, caminho_modelo=art.caminho_modelo)
+
+async def executar_no_modelo(features, art=None):
+    """
+    Roda a inferência no executor, sem bloquear o event loop. Devolve
+    (predicoes, probabilidades, versao, duracao): a versão do modelo que respondeu
+    e o tempo em segundos só da inferência, sem a espera no executor.
+    """
+    # Captura a versão uma única vez: uma troca no meio não afeta este lote
+    art = art or artefatos
+    if executor_inferencia is None:
+        inicio = time.perf_counter()
+        predicoes, probabilidades, tempos, cascata = prever_features(features, art)
+        duracao = time.perf_counter() - inicio
+    else:
+        (predicoes, probabilidades, tempos, cascata), duracao = await executor_inferencia.executar(features, art)
+    if cascata is not None:
+        for chave, valor in cascata.items():
+            contagens_cascata[chave] += valor
+    if METRICAS_ATIVAS:
+        metricas.registrar_etapas(tempos)
+        metricas.tamanho_lote.observar(len(features))
+    return predicoes, probabilidades, art.versao, duracao
+
+async def submeter_micro_batcher(features):
+    # A duração é a do lote do micro-batcher em que a linha foi pontuada
+    predicao, prob_falha, versao, duracao = await micro_batcher.submeter(features)
+    return np.array([predicao]), np.array([prob_falha]), versao, duracao
+
+async def executar_inferencia(features, funcao=executar_no_modelo):
+    """
+    Consulta o cache (se ativo) e roda funcao apenas nas linhas que faltam.
+    Devolve (predicoes, probabilidades, versao, duracao); duracao é None quando
+    alguma linha veio do cache, porque aí ela não cobre o lote inteiro.
+    """
+    if cache_predicoes is None:
+        return await funcao(features)
+
+    versao = artefatos.versao
+    cache_predicoes.verificar_versao(versao)
+    chaves, predicoes, probabilidades, faltando = cache_predicoes.consultar(features)
+    duracao = None
+    if faltando.any():
+        indices = np.flatnonzero(faltando)
+        predicoes_novas, probabilidades_novas, versao, duracao_modelo = await funcao(features[indices])
+        predicoes[indices] = predicoes_novas
+        probabilidades[indices] = probabilidades_novas
+        if versao == cache_predicoes.versao:
+            cache_predicoes.guardar([chaves[i] for i in indices], predicoes_novas, probabilidades_novas)
+        if faltando.all():
+            duracao = duracao_modelo
+    return predicoes, probabilidades, versao, duracao
+
+@asynccontextmanager
+async def admitir(orcamento, linhas):
+    """
+    Ocupa `linhas` do orçamento durante o bloco (a inferência) e devolve a
+    latência dele ao limite adaptativo; sem espaço, responde 429 com Retry-After.
+    Sem controle de admissão não faz nada.
+    """
+    if orcamento is None:
+        yield
+        return
+    try:
+        await orcamento.adquirir(linhas)
+    except AdmissaoRecusada as e:
+        raise HTTPException(status_code=429, detail="Servidor sobrecarregado, tente novamente",
+                            headers={"Retry-After": str(e.retry_after)})
+    inicio = time.perf_counter()
+    latencia = None
+    try:
+        yield
+        latencia = time.perf_counter() - inicio
+    finally:
+        orcamento.liberar(linhas, latencia)
+
+def formatar_predicoes(predicoes, prob_falha, versao=None, incluir_confianca=True):
+    """Converte os arrays de resultado na lista de dicionários da resposta"""
+    extra = {"versao_modelo": versao} if versao is not None else {}
+    if not incluir_confianca:
+        return [
+            {"falha_prevista": falha, "probabilidade_falha": prob, **extra}
+            for falha, prob in zip(predicoes.tolist(), prob_falha.tolist())
+        ]
+    confiancas = calcular_confianca(prob_falha)
+    return [
+        {
+            "falha_prevista": falha,
+            "probabilidade_falha": prob,
+            "confianca": conf,
+            **extra
+        }
+        for falha, prob, conf in zip(predicoes.tolist(), prob_falha.tolist(), confiancas.tolist())
+    ]
+
+def resposta_lote(predicoes, prob_falha, versao, formato="registros", incluir_confianca=True):
+    """
+    Corpo da resposta dos endpoints de lote. formato="registros" devolve
+    {"predictions": [{...}, ...]}; formato="colunar" devolve uma lista por campo,
+    montada direto dos arrays NumPy, sem um dicionário por linha.
+    """
+    if formato == "colunar":
+        resposta = {"falha_prevista": predicoes, "probabilidade_falha": prob_falha}
+        if incluir_confianca:
+            resposta["confianca"] = calcular_confianca(prob_falha).tolist()
+    else:
+        resposta = {"predictions": formatar_predicoes(predicoes, prob_falha, incluir_confianca=incluir_confianca)}
+    if versao is not None:
+        resposta["versao_modelo"] = versao
+    return resposta
+
+def atualizar_estado(data_list, features):
+    """
+    Acrescenta as leituras com id_produto ao estado por máquina e devolve as
+    features de tendência (n x 3 * sensores, NaN nas linhas sem id_produto), ou
+    None se o estado está desligado ou nenhuma linha tem id_produto
+    """
+    if estado_maquinas is None:
+        return None
+    ids = [d.id_produto for d in data_list]
+    if all(id_produto is None for id_produto in ids):
+        return None
+    return estado_maquinas.atualizar_lote(ids, features[:, :len(SENSORES)])
+
+def acrescentar_tendencias(predicoes, tendencias):
+    """Acrescenta a tendência a cada predição (dicionário) cuja linha tem id_produto"""
+    for predicao, linha in zip(predicoes, tendencias):
+        if not np.isnan(linha[0]):
+            predicao["tendencia"] = estado_maquinas.formatar(linha)
+
+def incluir_tendencias(resposta, tendencias, formato):
+    """Acrescenta a tendência de cada linha com id_produto à resposta de lote"""
+    if formato == "colunar":
+        resposta["tendencia"] = [None if np.isnan(linha[0]) else estado_maquinas.formatar(linha)
+                                 for linha in tendencias]
+    else:
+        acrescentar_tendencias(resposta["predictions"], tendencias)
+
+# Lote vazio, com os mesmos tipos dos arrays de resultado
+SEM_PREDICOES = (np.zeros(0, dtype=bool), np.zeros(0))
+
+@app.get("/microbatch/metrics")
+async def microbatch_metrics():
+    if micro_batcher is None:
+        return {"ativo": False}
+    return micro_batcher.metricas()
+
+@app.get("/cache/metrics")
+async def cache_metrics():
+    if cache_predicoes is None:
+        return {"ativo": False}
+    return cache_predicoes.metricas()
+
+@app.get("/shadow/metrics")
+async def sombra_metrics():
+    if avaliador_sombra is None:
+        return {"ativo": False, "versao_candidata": SOMBRA_VERSAO}
+    return avaliador_sombra.metricas()
+
+@app.get("/admission/metrics")
+async def admissao_metrics():
+    if not ADMISSAO_ATIVA:
+        return {"ativo": False}
+    return {"ativo": True, "predict": orcamento_predict.metricas(), "lote": orcamento_lote.metricas()}
+
+@app.get("/state/metrics")
+async def estado_metrics():
+    if estado_maquinas is None:
+        return {"ativo": False}
+    return {"ativo": True, **estado_maquinas.metricas()}
+
+@app.get("/state/{id_produto}")
+async def estado_maquina(id_produto: str):
+    if estado_maquinas is None:
+        raise HTTPException(status_code=404, detail="Estado por máquina desligado (ESTADO_ATIVO=0)")
+    descricao = estado_maquinas.descrever(id_produto)
+    if descricao is None:
+        raise HTTPException(status_code=404, detail=f"Máquina '{id_produto}' sem leituras no estado")
+    return {"id_produto": id_produto, **descricao}
+
+@app.get("/cascade/metrics")
+async def cascata_metrics():
+    c = contagens_cascata
+    return {
+        "ativo": artefatos is not None and artefatos.caminho_primeiro_estagio is not None,
+        "banda": {"inferior": CASCATA_BANDA[0], "superior": CASCATA_BANDA[1]},
+        "amostra_concordancia": CASCATA_AMOSTRA_CONCORDANCIA,
+        "linhas": c["linhas"],
+        "escaladas": c["escaladas"],
+        "taxa_escalonamento": c["escaladas"] / c["linhas"] if c["linhas"] else 0.0,
+        "comparadas": c["comparadas"],
+        "concordancia": c["concordantes"] / c["comparadas"] if c["comparadas"] else None,
+    }
+
+@app.get("/models")
+async def listar_modelos():
+    return {
+        "atual": artefatos.descricao() if artefatos is not None else None,
+        "anterior": artefatos_anterior.descricao() if artefatos_anterior is not None else None,
+        "registro": MODELOS_DIR,
+        "versao_ativa_registro": registro_modelos.versao_ativa(),
+        "versoes": registro_modelos.versoes(),
+    }
+
+@app.post("/models/reload")
+async def recarregar_modelo(versao: Optional[str] = None):
+    """
+    Carrega uma versão do registro (a ativa, se nenhuma for informada), valida com
+    o lote canário e troca sem reiniciar. As predições em andamento terminam na
+    versão anterior, que continua em memória para o rollback.
+    """
+    if estado_modelo != "pronto":
+        raise HTTPException(status_code=503, detail="Modelo ainda não está pronto", headers={"Retry-After": "1"})
+    try:
+        return await trocar_versao(versao)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"Versão rejeitada: {str(e)}")
+
+@app.post("/models/rollback")
+async def rollback_modelo():
+    """Volta para a versão anterior, que já está carregada: a troca é imediata"""
+    global artefatos, artefatos_anterior
+    if artefatos_anterior is None:
+        raise HTTPException(status_code=409, detail="Não há versão anterior carregada")
+    async with trava_troca:
+        artefatos, artefatos_anterior = artefatos_anterior, artefatos
+        if artefatos.versao in registro_modelos.versoes():
+            # Evita que o observador do registro volte para a versão desfeita
+            registro_modelos.ativar(artefatos.versao)
+    print(f"Rollback do modelo: {artefatos_anterior.versao} -> {artefatos.versao}")
+    return {"versao_modelo": artefatos.versao, "versao_anterior": artefatos_anterior.versao}
+
+def registrar_validacao(request):
+    """Tempo entre a chegada da requisição e o início do handler: leitura e validação do corpo"""
+    if METRICAS_ATIVAS and hasattr(request.state, "inicio"):
+        metricas.observar_etapa("validacao", time.perf_counter() - request.state.inicio)
+
+def marcar_fim_handler(request):
+    """Marca o fim do handler; o middleware mede a serialização a partir daqui"""
+    if METRICAS_ATIVAS:
+        request.state.fim_handler = time.perf_counter()
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(metricas.exportar(), media_type="text/plain; version=0.0.4")
+
+@app.post("/predict", response_model=PredictionResponse)
+async def predict_failure(data: MachineData, request: Request, confianca: bool = True):
+    registrar_validacao(request)
+    exigir_modelo()
+
+    try:
+        features = montar_features([data])
+        async with admitir(orcamento_predict, 1):
+            if micro_batcher is not None and micro_batcher.ativo:
+                # Agrupa com outras chamadas concorrentes em um único predict_proba
+                predicoes, probabilidades, versao, latencia = await executar_inferencia(features, submeter_micro_batcher)
+            else:
+                predicoes, probabilidades, versao, latencia = await executar_inferencia(features)
+        predicao, prob_falha = predicoes[0], probabilidades[0]
+
+        resposta = {"falha_prevista": bool(predicao), "probabilidade_falha": float(prob_falha)}
+        if confianca:
+            resposta["confianca"] = str(calcular_confianca(prob_falha))
+        resposta["versao_modelo"] = versao
+        tendencias = atualizar_estado([data], features)
+        if tendencias is not None:
+            resposta["tendencia"] = estado_maquinas.formatar(tendencias[0])
+        marcar_fim_handler(request)
+        return com_sombra(RespostaJSON(resposta), features, predicoes, probabilidades, latencia)
+
+    except HTTPException:
+        raise
+    except FilaMicroBatchCheia:
+        raise HTTPException(status_code=429, detail="Servidor sobrecarregado, tente novamente",
+                            headers={"Retry-After": "1"})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro na predição: {str(e)}")
 
 @app.post("/predict_batch")
-async def predict_batch(data_list: list[MachineData]):
-    if model is None:
-        raise HTTPException(status_code=500, detail="Modelo não carregado")
-
-    try:
-        results = []
-        for data in data_list:
-            # Preparar dados
-            tipo_encoded = label_encoder.transform([data.tipo])[0]
-
-            features = np.array([[
-                data.temperatura_ar,
-                data.temperatura_processo,
-                data.umidade_relativa,
-                data.velocidade_rotacional,
-                data.torque,
-                data.desgaste_da_ferramenta,
-                tipo_encoded,
-                data.fdf_falha_desgaste_ferramenta,
-                data.fdc_falha_dissipacao_calor,
-                data.fp_falha_potencia,
-                data.fte_falha_tensao_excessiva,
-                data.fa_falha_aleatoria
-            ]])
-
-            features_scaled = scaler.transform(features)
-            prediction = model.predict(features_scaled)[0]
-            probability = model.predict_proba(features_scaled)[0]
-            prob_falha = probability[1]
-
-            if prob_falha > 0.8:
-                confianca = "Alta"
-            elif prob_falha > 0.5:
-                confianca = "Média"
-            else:
-                confianca = "Baixa"
+async def predict_batch(data_list: list[MachineData], request: Request,
+                        formato: Literal["registros", "colunar"] = "registros", confianca: bool = True):
+    """
+    Predição em lote. formato=colunar devolve uma lista por campo em vez de um
+    objeto por linha; confianca=false omite o campo confianca.
+    """
+    registrar_validacao(request)
+    exigir_modelo()
 
-            results.append({
-                "falha_prevista": bool(prediction),
-                "probabilidade_falha": float(prob_falha),
-                "confianca": confianca
-            })
+    if not data_list:
+        return RespostaJSON(resposta_lote(*SEM_PREDICOES, None, formato, confianca))
 
-        return {"predictions": results}
+    try:
+        # Uma única matriz, um único scaler.transform e um único predict_proba
+        features = montar_features(data_list)
+        async with admitir(orcamento_lote, len(features)):
+            predicoes, prob_falha, versao, latencia = await executar_inferencia(features)
+        resposta = resposta_lote(predicoes, prob_falha, versao, formato, confianca)
+        tendencias = atualizar_estado(data_list, features)
+        if tendencias is not None:
+            incluir_tendencias(resposta, tendencias, formato)
+        marcar_fim_handler(request)
+        return com_sombra(RespostaJSON(resposta), features, predicoes, prob_falha, latencia)
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro na predição em lote: {str(e)}")
 
+@app.post("/predict_columnar")
+async def predict_columnar(request: Request, formato: Literal["registros", "colunar"] = "registros",
+                           confianca: bool = True):
+    """
+    Predição em lote com entrada colunar. Aceita:
+    - application/json: {"temperatura_ar": [...], "torque": [...], "tipo": [...], ...}
+    - application/vnd.apache.arrow.stream ou .file: tabela Arrow com as mesmas colunas
+    - application/x-npy: matriz (n x 12) na ordem de feature_cols, com tipo já codificado
+    A resposta segue formato e confianca, como em /predict_batch.
+    """
+    exigir_modelo()
+
+    content_type = request.headers.get("content-type", "application/json").split(";")[0].strip()
+    corpo = await request.body()
+    inicio_validacao = time.perf_counter()
+
+    try:
+        if content_type == "application/json":
+            try:
+                colunas = ler_json(corpo)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"JSON inválido: {e}")
+            if not isinstance(colunas, dict):
+                raise HTTPException(status_code=400, detail="JSON deve ser um objeto coluna -> lista de valores")
+            features = montar_features_colunar(colunas)
+        elif content_type in ("application/vnd.apache.arrow.stream", "application/vnd.apache.arrow.file"):
+            colunas = ler_arrow(corpo, formato_arquivo=content_type.endswith(".file"))
+            features = montar_features_colunar(colunas)
+        elif content_type == "application/x-npy":
+            features = ler_npy(corpo)
+        else:
+            raise HTTPException(status_code=415, detail=f"Content-Type não suportado: {content_type}")
+    except HTTPException:
+        raise
+    except Exception as e:
+        # Formato de entrada que as validações acima não previram: é erro do cliente, não 500
+        raise HTTPException(status_code=400, detail=f"Entrada colunar inválida: {str(e)}")
+    if METRICAS_ATIVAS:
+        metricas.observar_etapa("validacao", time.perf_counter() - inicio_validacao)
+
+    if len(features) == 0:
+        return RespostaJSON(resposta_lote(*SEM_PREDICOES, None, formato, confianca))
+
+    try:
+        async with admitir(orcamento_lote, len(features)):
+            predicoes, prob_falha, versao, latencia = await executar_inferencia(features)
+        resposta = resposta_lote(predicoes, prob_falha, versao, formato, confianca)
+        marcar_fim_handler(request)
+        return com_sombra(RespostaJSON(resposta), features, predicoes, prob_falha, latencia)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro na predição colunar: {str(e)}")
+
+@app.post("/jobs", status_code=202)
+async def criar_tarefa(arquivo: UploadFile = File(...), saida: Literal["parquet", "csv"] = "parquet"):
+    """
+    Envia um CSV ou Parquet no formato do bootcamp_train.csv para pontuação em
+    segundo plano. Responde 202 na hora; o progresso fica em GET /jobs/{id} e o
+    resultado (saida=parquet ou csv) em GET /jobs/{id}/resultado.
+    """
+    exigir_modelo()
+    try:
+        tarefa = await gerenciador_tarefas.submeter(arquivo.file, arquivo.filename, saida)
+    except ErroTarefa as e:
+        raise HTTPException(status_code=e.status, detail=str(e), headers=e.headers)
+    finally:
+        await arquivo.close()
+    return JSONResponse(status_code=202, content=tarefa.descrever(), headers={"Location": f"/jobs/{tarefa.id}"})
+
+@app.get("/jobs")
+async def listar_tarefas():
+    tarefas = await asyncio.to_thread(gerenciador_tarefas.listar)
+    return {"tarefas": [tarefa.descrever() for tarefa in tarefas]}
+
+async def buscar_tarefa(id_tarefa):
+    """Lida do disco: a tarefa pode ter sido criada por outro worker"""
+    tarefa = await asyncio.to_thread(gerenciador_tarefas.buscar, id_tarefa)
+    if tarefa is None:
+        raise HTTPException(status_code=404, detail=f"Tarefa '{id_tarefa}' não encontrada")
+    return tarefa
+
+@app.get("/jobs/{id_tarefa}")
+async def consultar_tarefa(id_tarefa: str):
+    return (await buscar_tarefa(id_tarefa)).descrever()
+
+@app.get("/jobs/{id_tarefa}/resultado")
+async def baixar_resultado(id_tarefa: str):
+    tarefa = await buscar_tarefa(id_tarefa)
+    if tarefa.status != "concluida":
+        raise HTTPException(status_code=409, detail=f"Tarefa ainda não concluída (status: {tarefa.status})")
+    tipo = "text/csv" if tarefa.formato_saida == "csv" else "application/vnd.apache.parquet"
+    return FileResponse(tarefa.resultado, media_type=tipo, filename=f"resultado-{tarefa.id}.{tarefa.formato_saida}")
+
+@app.delete("/jobs/{id_tarefa}")
+async def remover_tarefa(id_tarefa: str):
+    """Cancela a tarefa, se ainda estiver na fila ou rodando, e apaga os seus arquivos"""
+    await buscar_tarefa(id_tarefa)
+    try:
+        await asyncio.to_thread(gerenciador_tarefas.remover, id_tarefa)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Tarefa '{id_tarefa}' não encontrada")
+    return {"id": id_tarefa, "removida": True}
+
+async def ler_ndjson(request):
+    """
+    Lê o corpo NDJSON aos poucos, devolvendo (registro, erro) por linha não vazia.
+    Uma linha que não é JSON, ou maior que STREAM_MAX_BYTES_LINHA, vira
+    (None, mensagem) e a leitura continua na linha seguinte.
+    """
+    buffer = b""
+    descartando = False
+    async for pedaco in request.stream():
+        buffer += pedaco
+        *linhas, buffer = buffer.split(b"\n")
+        for linha in linhas:
+            if descartando:
+                # Fim da linha grande demais, já reportada
+                descartando = False
+            elif len(linha) > STREAM_MAX_BYTES_LINHA:
+                yield None, f"Linha maior que {STREAM_MAX_BYTES_LINHA} bytes"
+            elif linha.strip():
+                yield ler_linha_ndjson(linha)
+        if len(buffer) > STREAM_MAX_BYTES_LINHA:
+            if not descartando:
+                yield None, f"Linha maior que {STREAM_MAX_BYTES_LINHA} bytes"
+            buffer = b""
+            descartando = True
+    if buffer.strip() and not descartando:
+        yield ler_linha_ndjson(buffer)
+
+def ler_linha_ndjson(linha):
+    try:
+        return ler_json(linha), None
+    except ValueError as e:
+        return None, f"JSON inválido: {e}"
+
+class StreamingDuplexResponse(StreamingResponse):
+    """
+    StreamingResponse que pode ler o corpo da requisição enquanto responde.
+
+    A versão do Starlette escuta desconexões consumindo as mensagens de receive(),
+    o que roubaria os pedaços do corpo que o gerador ainda está lendo. Aqui a
+    desconexão é percebida quando o envio para o cliente falha.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+def validar_registro_stream(registro):
+    """Valida um registro do stream; devolve o MachineData ou a mensagem de erro"""
+    if not isinstance(registro, dict):
+        return "Registro deve ser um objeto JSON"
+    try:
+        dados = MachineData.model_validate(registro)
+    except ValidationError as e:
+        return f"Registro inválido: {e}"
+    if dados.tipo not in TIPOS_VALIDOS:
+        return MENSAGEM_TIPO
+    return dados
+
+async def pontuar_lote_stream(itens, inicio):
+    """
+    Pontua os registros válidos de um lote do stream em uma única chamada e devolve
+    as linhas NDJSON da resposta, uma por registro e na ordem da entrada. itens
+    traz, por registro, o MachineData ou a mensagem de erro da validação.
+    """
+    validos = [item for item in itens if isinstance(item, MachineData)]
+    predicoes = iter(())
+    erro_lote = None
+    if validos:
+        try:
+            features = montar_features(validos)
+            predicoes, prob_falha, versao, _ = await executar_inferencia(features)
+            predicoes = formatar_predicoes(predicoes, prob_falha, versao)
+            tendencias = atualizar_estado(validos, features)
+            if tendencias is not None:
+                acrescentar_tendencias(predicoes, tendencias)
+            predicoes = iter(predicoes)
+        except Exception as e:
+            erro_lote = f"Erro na predição: {str(e)}"
+
+    linhas = []
+    for i, item in enumerate(itens, start=inicio):
+        if not isinstance(item, MachineData):
+            linhas.append({"erro": item, "linha": i})
+        elif erro_lote is not None:
+            linhas.append({"erro": erro_lote, "linha": i})
+        else:
+            linhas.append(next(predicoes))
+    return b"".join(para_json(linha) + b"\n" for linha in linhas)
+
+@app.post("/predict_stream")
+async def predict_stream(request: Request):
+    """
+    Predição para entradas sem limite de tamanho, em NDJSON (um MachineData por linha).
+    Os registros são lidos e pontuados em lotes de tamanho fixo e cada lote é enviado
+    de volta assim que fica pronto, também em NDJSON, com uma linha por registro e na
+    mesma ordem da entrada. Um registro inválido (JSON malformado, campo faltando,
+    tipo desconhecido) gera uma linha {"erro": ..., "linha": indice} no lugar da sua
+    predição; os demais registros do lote e do stream são pontuados normalmente.
+    """
+    exigir_modelo()
+
+    async def gerar():
+        itens = []
+        inicio = 0
+        async for registro, erro in ler_ndjson(request):
+            itens.append(erro if erro is not None else validar_registro_stream(registro))
+            if len(itens) >= STREAM_TAMANHO_LOTE:
+                yield await pontuar_lote_stream(itens, inicio)
+                inicio += len(itens)
+                itens = []
+        if itens:
+            yield await pontuar_lote_stream(itens, inicio)
+
+    return StreamingDuplexResponse(gerar(), media_type="application/x-ndjson")
+
+async def pontuar_frames_ws(websocket, frames):
+    """Valida os frames recebidos, pontua os válidos em um único lote e responde um frame por leitura"""
+    respostas = [None] * len(frames)
+    validos = []
+    indices = []
+    for i, frame in enumerate(frames):
+        if isinstance(frame, bytes):
+            respostas[i] = {"erro": "Frame binário não suportado: envie o JSON em um frame de texto"}
+            continue
+        try:
+            registro = ler_json(frame)
+        except ValueError as e:
+            respostas[i] = {"erro": f"Frame inválido: {e}"}
+            continue
+        if not isinstance(registro, dict):
+            respostas[i] = {"erro": "Frame deve ser um objeto JSON"}
+            continue
+
+        respostas[i] = {"id": registro.get("id")}
+        try:
+            dados = MachineData.model_validate(registro)
+        except ValidationError as e:
+            respostas[i]["erro"] = f"Frame inválido: {e}"
+            continue
+        if dados.tipo not in TIPOS_VALIDOS:
+            respostas[i]["erro"] = MENSAGEM_TIPO
+            continue
+        validos.append(dados)
+        indices.append(i)
+
+    if validos:
+        try:
+            features = montar_features(validos)
+            predicoes, prob_falha, versao, _ = await executar_inferencia(features)
+            for i, predicao in zip(indices, formatar_predicoes(predicoes, prob_falha, versao)):
+                respostas[i].update(predicao)
+            tendencias = atualizar_estado(validos, features)
+            if tendencias is not None:
+                acrescentar_tendencias([respostas[i] for i in indices], tendencias)
+        except Exception as e:
+            for i in indices:
+                respostas[i]["erro"] = f"Erro na predição: {str(e)}"
+
+    for resposta in respostas:
+        await websocket.send_text(para_json(resposta).decode())
+
+@app.websocket("/ws/predict")
+async def predict_websocket(websocket: WebSocket):
+    """
+    Canal contínuo de telemetria: cada frame de texto é um MachineData em JSON
+    (com um campo "id" opcional, devolvido na resposta) e cada leitura recebe um
+    frame com falha_prevista, probabilidade_falha, confianca e versao_modelo, na ordem de chegada.
+    Frames que chegam juntos são pontuados em um único lote.
+    """
+    await websocket.accept()
+    if artefatos is None:
+        # 1013: tente novamente mais tarde; 1011: erro no servidor
+        await websocket.close(code=1013 if estado_modelo != "erro" else 1011, reason="Modelo não carregado")
+        return
+
+    # Limitada: com a fila cheia a recepção para de ler o socket até o lote em andamento sair
+    fila = asyncio.Queue(maxsize=2 * WS_MAX_TAMANHO_LOTE)
+
+    async def receber():
+        # Texto ou bytes, na ordem de chegada; None marca o fim da conexão
+        cancelada = False
+        try:
+            while True:
+                mensagem = await websocket.receive()
+                if mensagem["type"] == "websocket.disconnect":
+                    break
+                frame = mensagem.get("text")
+                await fila.put(frame if frame is not None else mensagem.get("bytes") or b"")
+        except asyncio.CancelledError:
+            # Cancelada pelo laço principal, que já terminou: ninguém espera o None
+            cancelada = True
+            raise
+        except Exception as e:
+            print(f"Erro na recepção do WebSocket: {e}")
+        finally:
+            if not cancelada:
+                await fila.put(None)
+
+    tarefa_recepcao = asyncio.create_task(receber())
+    try:
+        while True:
+            frames = await coletar_lote(fila, WS_MAX_TAMANHO_LOTE, WS_MAX_ESPERA_MS / 1000)
+            desconectado = None in frames
+            frames = [f for f in frames if f is not None]
+            if frames:
+                await pontuar_frames_ws(websocket, frames)
+            if desconectado:
+                break
+    except WebSocketDisconnect:
+        pass
+    finally:
+        tarefa_recepcao.cancel()
+        try:
+            await tarefa_recepcao
+        except asyncio.CancelledError:
+            pass
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
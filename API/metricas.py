@@ -0,0 +1,166 @@
+"""
+Métricas da API no formato texto do Prometheus.
+
+Histogramas com faixas fixas e contadores simples, protegidos por lock porque a
+inferência roda em threads do executor. Registrar uma observação custa uma busca
+binária e alguns incrementos, então as métricas podem ficar ligadas em produção.
+"""
+import bisect
+import threading
+import time
+
+# Faixas de latência em segundos (de 50 µs a 10 s)
+FAIXAS_LATENCIA = [
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+]
+# Faixas de tamanho de lote (potências de 2 até 65536)
+FAIXAS_LOTE = [2 ** i for i in range(17)]
+
+
+class Histograma:
+    def __init__(self, faixas):
+        self.faixas = faixas
+        self.contagens = [0] * (len(faixas) + 1)
+        self.soma = 0.0
+        self.total = 0
+        self.lock = threading.Lock()
+
+    def observar(self, valor):
+        i = bisect.bisect_left(self.faixas, valor)
+        with self.lock:
+            self.contagens[i] += 1
+            self.soma += valor
+            self.total += 1
+
+    def linhas(self, nome, rotulos):
+        with self.lock:
+            contagens = list(self.contagens)
+            soma, total = self.soma, self.total
+        prefixo = "".join(f'{chave}="{valor}",' for chave, valor in rotulos)
+        acumulado = 0
+        for faixa, contagem in zip(self.faixas + ["+Inf"], contagens):
+            acumulado += contagem
+            yield f'{nome}_bucket{{{prefixo}le="{faixa}"}} {acumulado}'
+        sufixo = "{" + prefixo.rstrip(",") + "}" if prefixo else ""
+        yield f"{nome}_sum{sufixo} {soma}"
+        yield f"{nome}_count{sufixo} {total}"
+
+
+class RegistroMetricas:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.etapas = {}
+        self.latencia_rotas = {}
+        self.requisicoes = {}
+        self.erros = {}
+        self.tamanho_lote = Histograma(FAIXAS_LOTE)
+        # Métricas extras calculadas na hora da exposição: nome -> (tipo, ajuda, funcao)
+        self.coletores = {}
+
+    def _histograma(self, mapa, chave, faixas):
+        histograma = mapa.get(chave)
+        if histograma is None:
+            with self.lock:
+                histograma = mapa.setdefault(chave, Histograma(faixas))
+        return histograma
+
+    def observar_etapa(self, etapa, segundos):
+        self._histograma(self.etapas, etapa, FAIXAS_LATENCIA).observar(segundos)
+
+    def registrar_etapas(self, tempos):
+        for etapa, segundos in (tempos or {}).items():
+            self.observar_etapa(etapa, segundos)
+
+    def registrar_requisicao(self, rota, status, segundos):
+        self._histograma(self.latencia_rotas, rota, FAIXAS_LATENCIA).observar(segundos)
+        with self.lock:
+            chave = (rota, status)
+            self.requisicoes[chave] = self.requisicoes.get(chave, 0) + 1
+            if status >= 500:
+                self.erros[rota] = self.erros.get(rota, 0) + 1
+
+    def registrar_coletor(self, nome, tipo, ajuda, funcao):
+        """funcao() devolve uma lista de (rotulos, valor) lida no momento da exposição"""
+        self.coletores[nome] = (tipo, ajuda, funcao)
+
+    def exportar(self):
+        linhas = []
+
+        def cabecalho(nome, tipo, ajuda):
+            linhas.append(f"# HELP {nome} {ajuda}")
+            linhas.append(f"# TYPE {nome} {tipo}")
+
+        cabecalho("api_etapa_latencia_segundos", "histogram", "Latência de cada etapa da predição")
+        for etapa, histograma in sorted(self.etapas.items()):
+            linhas.extend(histograma.linhas("api_etapa_latencia_segundos", [("etapa", etapa)]))
+
+        cabecalho("api_requisicao_latencia_segundos", "histogram", "Latência total das requisições HTTP")
+        for rota, histograma in sorted(self.latencia_rotas.items()):
+            linhas.extend(histograma.linhas("api_requisicao_latencia_segundos", [("rota", rota)]))
+
+        cabecalho("api_tamanho_lote", "histogram", "Linhas por chamada do modelo")
+        linhas.extend(self.tamanho_lote.linhas("api_tamanho_lote", []))
+
+        with self.lock:
+            requisicoes = sorted(self.requisicoes.items())
+            erros = sorted(self.erros.items())
+        cabecalho("api_requisicoes_total", "counter", "Requisições HTTP por rota e status")
+        for (rota, status), total in requisicoes:
+            linhas.append(f'api_requisicoes_total{{rota="{rota}",status="{status}"}} {total}')
+        cabecalho("api_erros_total", "counter", "Requisições HTTP com erro (status 5xx) por rota")
+        for rota, total in erros:
+            linhas.append(f'api_erros_total{{rota="{rota}"}} {total}')
+
+        for nome, (tipo, ajuda, funcao) in self.coletores.items():
+            cabecalho(nome, tipo, ajuda)
+            for rotulos, valor in funcao():
+                rotulo = ",".join(f'{chave}="{v}"' for chave, v in rotulos)
+                linhas.append(f"{nome}{{{rotulo}}} {valor}" if rotulo else f"{nome} {valor}")
+
+        return "\n".join(linhas) + "\n"
+
+
+class MiddlewareMetricas:
+    """
+    Middleware ASGI que conta requisições e erros e mede a latência total por rota.
+
+    Guarda o instante de chegada em request.state.inicio, para o handler medir a
+    validação, e mede a serialização como o tempo entre request.state.fim_handler
+    (marcado pelo handler) e o início do envio da resposta.
+    """
+
+    def __init__(self, app, registro, rotas):
+        self.app = app
+        self.registro = registro
+        # Lista de rotas do app; os caminhos são lidos na primeira requisição,
+        # quando todas as rotas já foram registradas
+        self.rotas = rotas
+        self.caminhos = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        inicio = time.perf_counter()
+        estado = scope.setdefault("state", {})
+        estado["inicio"] = inicio
+        status = 500
+
+        async def enviar(mensagem):
+            nonlocal status
+            if mensagem["type"] == "http.response.start":
+                status = mensagem["status"]
+                fim_handler = estado.get("fim_handler")
+                if fim_handler is not None:
+                    self.registro.observar_etapa("serializacao", time.perf_counter() - fim_handler)
+            await send(mensagem)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            if self.caminhos is None:
+                self.caminhos = {r.path for r in self.rotas}
+            rota = scope["path"] if scope["path"] in self.caminhos else "outras"
+            self.registro.registrar_requisicao(rota, status, time.perf_counter() - inicio)
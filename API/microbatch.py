@@ -0,0 +1,163 @@
+import asyncio
+import numpy as np
+
+
+async def coletar_lote(fila, max_tamanho, max_espera):
+    """
+    Espera o primeiro item da fila e junta os que chegarem até max_espera
+    segundos depois, ou até completar max_tamanho itens
+    """
+    loop = asyncio.get_running_loop()
+    lote = [await fila.get()]
+    prazo = loop.time() + max_espera
+
+    while len(lote) < max_tamanho:
+        if not fila.empty():
+            lote.append(fila.get_nowait())
+            continue
+        restante = prazo - loop.time()
+        if restante <= 0:
+            break
+        try:
+            lote.append(await asyncio.wait_for(fila.get(), restante))
+        except asyncio.TimeoutError:
+            break
+    return lote
+
+
+class FilaMicroBatchCheia(Exception):
+    """Fila do micro-batcher cheia: a requisição deve ser recusada na hora"""
+
+
+class MicroBatcher:
+    """
+    Agrupa chamadas concorrentes de /predict em um único predict_proba.
+
+    Cada chamada coloca sua linha de features na fila e aguarda um future.
+    O lote é processado quando atinge max_tamanho itens ou quando max_espera
+    segundos se passaram desde o primeiro item do lote. funcao_lote é uma
+    corrotina; até max_lotes_simultaneos lotes ficam no modelo ao mesmo tempo e,
+    enquanto isso, o próximo continua enchendo.
+
+    A fila guarda no máximo max_fila linhas: com ela cheia, submeter() levanta
+    FilaMicroBatchCheia em vez de deixar as requisições acumularem no event loop.
+
+    funcao_lote devolve (predicoes, probabilidades, *extras); os extras valem para
+    o lote inteiro (por exemplo, a versão do modelo) e são repassados a cada chamada.
+    """
+
+    def __init__(self, funcao_lote, max_tamanho=64, max_espera=0.002, max_fila=1024, max_lotes_simultaneos=2):
+        self.funcao_lote = funcao_lote
+        self.max_tamanho = max_tamanho
+        self.max_espera = max_espera
+        self.max_fila = max_fila
+        self.max_lotes_simultaneos = max_lotes_simultaneos
+        self.fila = None
+        self.tarefa = None
+        self.vagas = None
+        self.em_andamento = set()
+
+        # Métricas
+        self.lotes_processados = 0
+        self.itens_processados = 0
+        self.maior_lote = 0
+        self.distribuicao_tamanhos = {}
+        self.recusadas = 0
+
+    @property
+    def ativo(self):
+        return self.tarefa is not None and not self.tarefa.done()
+
+    def iniciar(self):
+        self.fila = asyncio.Queue(maxsize=self.max_fila)
+        self.vagas = asyncio.Semaphore(self.max_lotes_simultaneos)
+        self.tarefa = asyncio.create_task(self._executar())
+
+    async def parar(self):
+        tarefas = list(self.em_andamento)
+        if self.tarefa is not None:
+            tarefas.append(self.tarefa)
+        for tarefa in tarefas:
+            tarefa.cancel()
+        for tarefa in tarefas:
+            try:
+                await tarefa
+            except asyncio.CancelledError:
+                pass
+        self.tarefa = None
+
+    async def submeter(self, features):
+        """Enfileira uma linha de features (1 x n) e devolve (predicao, probabilidade, *extras)"""
+        futuro = asyncio.get_running_loop().create_future()
+        try:
+            self.fila.put_nowait((features, futuro))
+        except asyncio.QueueFull:
+            self.recusadas += 1
+            raise FilaMicroBatchCheia(f"Fila do micro-batcher cheia ({self.max_fila} linhas)")
+        return await futuro
+
+    async def _coletar_lote(self):
+        return await coletar_lote(self.fila, self.max_tamanho, self.max_espera)
+
+    async def _executar(self):
+        while True:
+            # Só começa um lote novo com vaga no modelo; até lá a fila continua enchendo
+            await self.vagas.acquire()
+            try:
+                lote = await self._coletar_lote()
+            except BaseException:
+                self.vagas.release()
+                raise
+            tarefa = asyncio.create_task(self._processar_e_liberar(lote))
+            self.em_andamento.add(tarefa)
+            tarefa.add_done_callback(self.em_andamento.discard)
+
+    async def _processar_e_liberar(self, lote):
+        try:
+            await self._processar(lote)
+        finally:
+            self.vagas.release()
+
+    async def _processar(self, lote):
+        # Descarta chamadas canceladas pelo cliente antes de rodar o modelo
+        lote = [(features, futuro) for features, futuro in lote if not futuro.done()]
+        if not lote:
+            return
+
+        self._registrar(len(lote))
+        try:
+            predicoes, probabilidades, *extras = await self.funcao_lote(np.vstack([features for features, _ in lote]))
+        except Exception as e:
+            for _, futuro in lote:
+                if not futuro.done():
+                    futuro.set_exception(e)
+            return
+
+        for i, (_, futuro) in enumerate(lote):
+            if not futuro.done():
+                futuro.set_result((predicoes[i], probabilidades[i], *extras))
+
+    def _registrar(self, tamanho):
+        self.lotes_processados += 1
+        self.itens_processados += tamanho
+        self.maior_lote = max(self.maior_lote, tamanho)
+        # Faixas em potências de 2: 1, 2, 4, 8, ...
+        faixa = 1 << (tamanho - 1).bit_length()
+        self.distribuicao_tamanhos[faixa] = self.distribuicao_tamanhos.get(faixa, 0) + 1
+
+    def metricas(self):
+        return {
+            "ativo": self.ativo,
+            "max_tamanho": self.max_tamanho,
+            "max_espera_ms": self.max_espera * 1000,
+            "profundidade_fila": self.fila.qsize() if self.fila is not None else 0,
+            "max_fila": self.max_fila,
+            "max_lotes_simultaneos": self.max_lotes_simultaneos,
+            "lotes_em_andamento": len(self.em_andamento),
+            "recusadas": self.recusadas,
+            "lotes_processados": self.lotes_processados,
+            "itens_processados": self.itens_processados,
+            "tamanho_medio_lote": self.itens_processados / self.lotes_processados if self.lotes_processados else 0.0,
+            "maior_lote": self.maior_lote,
+            "distribuicao_tamanhos": {f"<={faixa}": qtd for faixa, qtd in sorted(self.distribuicao_tamanhos.items())},
+        }
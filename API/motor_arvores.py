@@ -0,0 +1,548 @@
+"""
+Motor de inferência compilado para o stacking_model.pkl.
+
+Todas as árvores do Random Forest e do Gradient Boosting são achatadas em arrays
+contíguos (feature, threshold, filhos, valor da folha) e percorridas para o lote
+inteiro de uma vez com NumPy. O SVC e a LogisticRegression final são calculados
+diretamente a partir dos coeficientes, assim como o SVC aproximado (Nystroem ou
+random Fourier features + LogisticRegression). O resultado expõe classes_ e
+predict_proba, então pode substituir o modelo do scikit-learn em prever_com_modelo.
+
+Com o StandardScaler do treino, o motor o incorpora ao próprio modelo: os
+thresholds das árvores voltam para as unidades originais e o kernel do SVC é
+reescrito sobre as features brutas, então a predição dispensa o scaler.transform.
+
+Verificação contra o scikit-learn:
+    python motor_arvores.py
+
+Exportar o modelo que consome as features brutas (sem scaler.pkl):
+    python motor_arvores.py exportar [modelo_sem_scaler.pkl]
+
+Diferença do modo float32 para o float64, nos dois backends:
+    python motor_arvores.py float32 [linhas]
+"""
+import time
+from functools import partial
+
+import numpy as np
+from scipy.special import expit
+
+from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier
+from sklearn.kernel_approximation import Nystroem, RBFSampler
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import Pipeline
+from sklearn.svm import SVC
+from sklearn.tree import DecisionTreeClassifier
+
+
+class ArvoresAchatadas:
+    """Conjunto de árvores em arrays contíguos, avaliadas juntas para o lote todo"""
+
+    def __init__(self, arvores, valores_folha):
+        # arvores: lista de sklearn.tree._tree.Tree
+        # valores_folha: lista de arrays (node_count,) com o valor de cada nó
+        deslocamentos = np.cumsum([0] + [a.node_count for a in arvores])
+        self.raizes = deslocamentos[:-1].astype(np.intp)
+        self.profundidade = max(a.max_depth for a in arvores)
+
+        feature = np.concatenate([a.feature for a in arvores]).astype(np.int32)
+        self.threshold = np.concatenate([a.threshold for a in arvores])
+        esquerda = np.concatenate([a.children_left + d for a, d in zip(arvores, deslocamentos)])
+        direita = np.concatenate([a.children_right + d for a, d in zip(arvores, deslocamentos)])
+        self.valor = np.concatenate(valores_folha).astype(np.float64)
+
+        # Folhas apontam para si mesmas, assim todas as árvores podem andar o
+        # mesmo número de passos sem tratar o fim de cada caminho
+        self.folhas = np.concatenate([a.children_left == -1 for a in arvores])
+        indices = np.arange(len(self.folhas))
+        feature[self.folhas] = 0
+        self.feature = feature
+        # filhos[2 * no] é o filho da esquerda e filhos[2 * no + 1] o da direita
+        self.filhos = np.empty(2 * len(indices), dtype=np.int32)
+        self.filhos[0::2] = np.where(self.folhas, indices, esquerda)
+        self.filhos[1::2] = np.where(self.folhas, indices, direita)
+        # O scikit-learn compara as features em float32 com thresholds em float64
+        self.dtype = np.float32
+
+    def dobrar_scaler(self, media, escala):
+        """
+        Leva os thresholds para as unidades originais, para avaliar as features sem
+        o scaler. O scikit-learn vai para a direita quando float32(x_norm) > t, o
+        que equivale a x_norm passar do ponto médio entre os dois float32 vizinhos
+        de t; esse ponto médio, convertido de volta, vira o novo threshold.
+        """
+        internos = ~self.folhas
+        t = self.threshold[internos]
+        abaixo = t.astype(np.float32)
+        abaixo = np.where(abaixo > t, np.nextafter(abaixo, np.float32(-np.inf)), abaixo)
+        acima = np.nextafter(abaixo, np.float32(np.inf))
+        limite = (abaixo.astype(np.float64) + acima.astype(np.float64)) / 2
+        f = self.feature[internos]
+        self.threshold = self.threshold.copy()
+        self.threshold[internos] = media[f] + escala[f] * limite
+        self.dtype = np.float64
+
+    def para_float32(self):
+        """
+        Passa thresholds e valores das folhas para float32 sem mudar nenhuma
+        decisão: para x em float32, x > t equivale a x passar do maior float32 <= t.
+        A única diferença para o float64 vem do arredondamento das próprias features.
+        """
+        t = self.threshold.astype(np.float32)
+        self.threshold = np.where(t > self.threshold, np.nextafter(t, np.float32(-np.inf)), t)
+        self.valor = self.valor.astype(np.float32)
+        self.dtype = np.float32
+
+    def avaliar(self, X):
+        """Devolve o valor da folha de cada árvore para cada amostra: (n_arvores, n_amostras)"""
+        X = np.ascontiguousarray(X, dtype=self.dtype)
+        n_amostras, n_features = X.shape
+        X_plano = X.ravel()
+        base = (np.arange(n_amostras, dtype=np.int32) * n_features)[np.newaxis, :]
+        nos = np.repeat(self.raizes[:, np.newaxis].astype(np.int32), n_amostras, axis=1)
+        for passo in range(self.profundidade):
+            vai_direita = X_plano[base + self.feature[nos]] > self.threshold[nos]
+            nos = self.filhos[2 * nos + vai_direita]
+            # Para assim que todos os caminhos chegaram a uma folha
+            if passo % 4 == 3 and self.folhas[nos].all():
+                break
+        return self.valor[nos]
+
+
+def _para_float32(componente):
+    """Converte os arrays e escalares float64 de um componente compilado (SVC, kernel aproximado) para float32"""
+    for nome, valor in vars(componente).items():
+        if isinstance(valor, np.ndarray) and valor.dtype == np.float64:
+            setattr(componente, nome, valor.astype(np.float32))
+        elif isinstance(valor, (float, np.floating)):
+            setattr(componente, nome, np.float32(valor))
+    return componente
+
+
+def _probabilidade_nos(arvore):
+    # Probabilidade da classe positiva em cada nó, normalizada como em predict_proba
+    contagens = arvore.value[:, 0, :]
+    return contagens[:, 1] / contagens.sum(axis=1)
+
+
+def compilar_random_forest(rf):
+    arvores = [e.tree_ for e in rf.estimators_]
+    return ArvoresAchatadas(arvores, [_probabilidade_nos(a) for a in arvores])
+
+
+def compilar_gradient_boosting(gb):
+    if gb.estimators_.shape[1] != 1:
+        raise ValueError("Apenas Gradient Boosting binário é suportado")
+    arvores = [e.tree_ for e in gb.estimators_[:, 0]]
+    valores = [a.value[:, 0, 0] * gb.learning_rate for a in arvores]
+
+    # Predição inicial constante (DummyClassifier com a priori), como em _init_raw_predictions
+    if gb.init_ == 'zero':
+        inicial = 0.0
+    elif hasattr(gb.init_, 'class_prior_') and getattr(gb.init_, 'strategy', 'prior') == 'prior':
+        eps = np.finfo(np.float32).eps
+        p = np.clip(gb.init_.class_prior_[1], eps, 1 - eps)
+        inicial = float(np.log(p / (1 - p)))
+    else:
+        raise ValueError(f"Estimador inicial não suportado: {gb.init_}")
+    return ArvoresAchatadas(arvores, valores), inicial
+
+
+class KernelSobreVetores:
+    """Kernel entre as amostras e um conjunto fixo de vetores (vetores de suporte ou componentes do Nystroem)"""
+
+    def __init__(self, vetores, kernel, gamma, coef0=0.0, degree=3):
+        self.kernel = kernel
+        self.gamma = gamma
+        self.coef0 = coef0
+        self.degree = degree
+        self.vetores = np.ascontiguousarray(vetores, dtype=np.float64)
+        self.norma_vetores = np.einsum('ij,ij->i', self.vetores, self.vetores)
+        # Termos do scaler incorporado (dobrar_scaler); None sem scaler
+        self.deslocamento = None
+
+    def dobrar_scaler(self, media, escala):
+        """
+        Reescreve o kernel sobre as features brutas. Com x_norm = D x + e, onde
+        D = 1 / escala e e = -media / escala:
+            x_norm . v   = x . (D v) + e . v
+            |x_norm|^2   = sum(D^2 x^2) + 2 (D e) . x + |e|^2
+        """
+        d = 1 / escala
+        e = -media * d
+        self.deslocamento = self.vetores @ e
+        self.vetores = self.vetores * d
+        self.peso_quadrado = d * d
+        self.peso_linear = 2 * d * e
+        self.norma_deslocamento = float(e @ e)
+
+    def _norma_quadrada(self, X):
+        if self.deslocamento is None:
+            return np.einsum('ij,ij->i', X, X)
+        return np.einsum('ij,ij,j->i', X, X, self.peso_quadrado) + X @ self.peso_linear + self.norma_deslocamento
+
+    def _kernel(self, X):
+        produto = X @ self.vetores.T
+        if self.deslocamento is not None:
+            produto += self.deslocamento
+        if self.kernel == 'rbf':
+            dist = self._norma_quadrada(X)[:, np.newaxis] - 2 * produto + self.norma_vetores
+            return np.exp(-self.gamma * np.maximum(dist, 0))
+        if self.kernel == 'linear':
+            return produto
+        if self.kernel == 'poly':
+            return (self.gamma * produto + self.coef0) ** self.degree
+        if self.kernel == 'sigmoid':
+            return np.tanh(self.gamma * produto + self.coef0)
+        raise ValueError(f"Kernel não suportado: {self.kernel}")
+
+
+class SVCCompilado(KernelSobreVetores):
+    """Função de decisão do SVC com calibração de Platt, calculada sobre os vetores de suporte"""
+
+    def __init__(self, svm):
+        if not svm.probability:
+            raise ValueError("SVC precisa ter sido treinado com probability=True")
+        super().__init__(svm.support_vectors_, svm.kernel, svm._gamma, svm.coef0, svm.degree)
+        self.coef_dual = svm.dual_coef_[0]
+        self.intercepto = svm.intercept_[0]
+        self.prob_a = svm.probA_[0]
+        self.prob_b = svm.probB_[0]
+
+    def probabilidade(self, X):
+        decisao = self._kernel(X) @ self.coef_dual + self.intercepto
+        # libsvm usa a decisão com sinal invertido e limita a probabilidade par a par em [1e-7, 1 - 1e-7]
+        r01 = np.clip(expit(-(-decisao * self.prob_a + self.prob_b)), 1e-7, 1 - 1e-7)
+        return _acoplamento_binario(r01)[1]
+
+
+class NystroemCompilado(KernelSobreVetores):
+    """Pipeline Nystroem + LogisticRegression: kernel sobre os componentes, projeção e regressão linear"""
+
+    def __init__(self, nystroem, linear):
+        if nystroem.kernel not in ('rbf', 'linear', 'poly', 'sigmoid'):
+            raise ValueError(f"Kernel do Nystroem não suportado: {nystroem.kernel}")
+        n_features = nystroem.components_.shape[1]
+        # Mesmos padrões de pairwise_kernels quando o parâmetro não foi informado
+        gamma = nystroem.gamma if nystroem.gamma is not None else 1.0 / n_features
+        coef0 = nystroem.coef0 if nystroem.coef0 is not None else 1.0
+        degree = nystroem.degree if nystroem.degree is not None else 3
+        super().__init__(nystroem.components_, nystroem.kernel, gamma, coef0, degree)
+        # A projeção e a regressão linear viram um único vetor de pesos
+        self.pesos = nystroem.normalization_.T @ linear.coef_[0]
+        self.intercepto = linear.intercept_[0]
+
+    def probabilidade(self, X):
+        return expit(self._kernel(X) @ self.pesos + self.intercepto)
+
+
+class RFFCompilado:
+    """Pipeline RBFSampler (random Fourier features) + LogisticRegression"""
+
+    def __init__(self, amostrador, linear):
+        self.pesos = np.ascontiguousarray(amostrador.random_weights_, dtype=np.float64)
+        self.offset = amostrador.random_offset_
+        self.coef = linear.coef_[0] * np.sqrt(2.0 / amostrador.n_components)
+        self.intercepto = linear.intercept_[0]
+
+    def dobrar_scaler(self, media, escala):
+        # x_norm @ W + b = x @ (W / escala) + (b - (media / escala) @ W)
+        self.offset = self.offset - (media / escala) @ self.pesos
+        self.pesos = self.pesos / escala[:, np.newaxis]
+
+    def probabilidade(self, X):
+        return expit(np.cos(X @ self.pesos + self.offset) @ self.coef + self.intercepto)
+
+
+def compilar_kernel_aproximado(pipeline):
+    """Pipeline (Nystroem ou RBFSampler) + LogisticRegression binária, como treinado em train_model.py"""
+    if len(pipeline.steps) != 2:
+        raise ValueError("Pipeline de kernel aproximado deve ter duas etapas")
+    mapa, linear = pipeline.steps[0][1], pipeline.steps[1][1]
+    if not isinstance(linear, LogisticRegression) or linear.coef_.shape[0] != 1:
+        raise ValueError("A última etapa do pipeline deve ser uma LogisticRegression binária")
+    if isinstance(mapa, Nystroem):
+        return NystroemCompilado(mapa, linear)
+    if isinstance(mapa, RBFSampler):
+        return RFFCompilado(mapa, linear)
+    raise ValueError(f"Mapa de kernel não suportado: {type(mapa).__name__}")
+
+
+def _acoplamento_binario(r01):
+    """
+    Reproduz o multiclass_probability do libsvm para duas classes.
+
+    A solução exata seria (r01, 1 - r01), mas o libsvm para a iteração assim que o
+    erro fica abaixo de 0.005 / k, e o predict_proba do SVC devolve esse valor.
+    """
+    r10 = 1 - r01
+    q00, q11, q01 = r10 * r10, r01 * r01, -r10 * r01
+    p0 = np.full_like(r01, 0.5)
+    p1 = np.full_like(r01, 0.5)
+    eps = 0.005 / 2
+
+    for _ in range(100):
+        qp0 = q00 * p0 + q01 * p1
+        qp1 = q01 * p0 + q11 * p1
+        pqp = p0 * qp0 + p1 * qp1
+        ativos = np.maximum(np.abs(qp0 - pqp), np.abs(qp1 - pqp)) >= eps
+        if not ativos.any():
+            break
+
+        for qtt, qt0, qt1, t in ((q00, q00, q01, 0), (q11, q01, q11, 1)):
+            qpt = qp0 if t == 0 else qp1
+            diff = np.where(ativos, (pqp - qpt) / qtt, 0.0)
+            if t == 0:
+                p0 = p0 + diff
+            else:
+                p1 = p1 + diff
+            pqp = (pqp + diff * (diff * qtt + 2 * qpt)) / (1 + diff) / (1 + diff)
+            qp0 = (qp0 + diff * qt0) / (1 + diff)
+            qp1 = (qp1 + diff * qt1) / (1 + diff)
+            p0 = p0 / (1 + diff)
+            p1 = p1 / (1 + diff)
+    return p0, p1
+
+
+class PrimeiroEstagioCompilado:
+    """
+    Primeiro estágio da cascata (árvore de decisão rasa ou LogisticRegression),
+    com o scaler incorporado: recebe as features brutas e devolve a probabilidade
+    da classe positiva.
+    """
+
+    def __init__(self, estimador, scaler):
+        n = estimador.n_features_in_
+        media = scaler.mean_ if scaler.with_mean else np.zeros(n)
+        escala = scaler.scale_ if scaler.with_std else np.ones(n)
+        if isinstance(estimador, DecisionTreeClassifier):
+            self.arvore = ArvoresAchatadas([estimador.tree_], [_probabilidade_nos(estimador.tree_)])
+            self.arvore.dobrar_scaler(media, escala)
+        elif isinstance(estimador, LogisticRegression) and estimador.coef_.shape[0] == 1:
+            # coef . (x - media) / escala + b = (coef / escala) . x + (b - coef . media / escala)
+            self.arvore = None
+            self.coef = estimador.coef_[0] / escala
+            self.intercepto = estimador.intercept_[0] - float(estimador.coef_[0] @ (media / escala))
+        else:
+            raise ValueError(f"Primeiro estágio não suportado: {type(estimador).__name__}")
+
+        self.dtype = np.float64
+
+    def para_float32(self):
+        if self.arvore is not None:
+            self.arvore.para_float32()
+        else:
+            self.coef = self.coef.astype(np.float32)
+            self.intercepto = np.float32(self.intercepto)
+        self.dtype = np.float32
+        return self
+
+    def probabilidade(self, X):
+        if self.arvore is not None:
+            return self.arvore.avaliar(X)[0]
+        return expit(np.asarray(X, dtype=self.dtype) @ self.coef + self.intercepto)
+
+
+class ModeloCompilado:
+    """
+    Substituto do StackingClassifier binário com RF, GB, SVC e LogisticRegression.
+
+    Com scaler (StandardScaler do treino), o modelo recebe as features brutas e
+    features_brutas é True; sem ele, recebe as features já normalizadas.
+    """
+
+    def __init__(self, stacking, scaler=None):
+        if len(stacking.classes_) != 2:
+            raise ValueError("Apenas classificação binária é suportada")
+        if stacking.passthrough:
+            raise ValueError("Stacking com passthrough não é suportado")
+
+        self.classes_ = stacking.classes_
+        self.membros = []
+        nomes = [nome for nome, estimador in stacking.named_estimators_.items() if estimador != 'drop']
+        for nome, estimador, metodo in zip(nomes, stacking.estimators_, stacking.stack_method_):
+            if metodo != 'predict_proba':
+                raise ValueError(f"Método de stacking não suportado para '{nome}': {metodo}")
+            if isinstance(estimador, RandomForestClassifier):
+                self.membros.append((nome, 'rf', compilar_random_forest(estimador)))
+            elif isinstance(estimador, GradientBoostingClassifier):
+                self.membros.append((nome, 'gb', compilar_gradient_boosting(estimador)))
+            elif isinstance(estimador, SVC):
+                self.membros.append((nome, 'svm', SVCCompilado(estimador)))
+            elif isinstance(estimador, Pipeline):
+                self.membros.append((nome, 'kernel', compilar_kernel_aproximado(estimador)))
+            else:
+                raise ValueError(f"Estimador não suportado: {type(estimador).__name__}")
+
+        meta = stacking.final_estimator_
+        if not isinstance(meta, LogisticRegression) or meta.coef_.shape[0] != 1:
+            raise ValueError("O meta-modelo deve ser uma LogisticRegression binária")
+        self.meta_coef = meta.coef_[0]
+        self.meta_intercepto = meta.intercept_[0]
+
+        self.features_brutas = scaler is not None
+        if scaler is not None:
+            n = stacking.n_features_in_
+            media = scaler.mean_ if scaler.with_mean else np.zeros(n)
+            escala = scaler.scale_ if scaler.with_std else np.ones(n)
+            for _, tipo, membro in self.membros:
+                (membro[0] if tipo == 'gb' else membro).dobrar_scaler(media, escala)
+        self.dtype = np.float64
+
+    def para_float32(self):
+        """
+        Passa todo o modelo para float32: features, thresholds, folhas, vetores e
+        coeficientes. As matrizes intermediárias ocupam metade da memória; a
+        diferença para o caminho em float64 é medida por relatorio_float32.
+        """
+        convertidos = []
+        for nome, tipo, membro in self.membros:
+            if tipo == 'gb':
+                arvores, inicial = membro
+                arvores.para_float32()
+                membro = (arvores, np.float32(inicial))
+            elif tipo == 'rf':
+                membro.para_float32()
+            else:
+                _para_float32(membro)
+            convertidos.append((nome, tipo, membro))
+        self.membros = convertidos
+        self.meta_coef = self.meta_coef.astype(np.float32)
+        self.meta_intercepto = np.float32(self.meta_intercepto)
+        self.dtype = np.float32
+        return self
+
+    def _probabilidade_membro(self, tipo, membro, X):
+        if tipo == 'rf':
+            folhas = membro.avaliar(X)
+            return folhas.sum(axis=0) / folhas.shape[0]
+        if tipo == 'gb':
+            arvores, inicial = membro
+            return expit(inicial + arvores.avaliar(X).sum(axis=0))
+        return membro.probabilidade(X)
+
+    def probabilidades_membros(self, X):
+        """Probabilidade da classe positiva de cada modelo base: (n_amostras, n_membros)"""
+        X = np.asarray(X, dtype=self.dtype)
+        return np.column_stack([self._probabilidade_membro(tipo, membro, X) for _, tipo, membro in self.membros])
+
+    def _saida_membro(self, tipo, membro, X):
+        return self._probabilidade_membro(tipo, membro, np.asarray(X, dtype=self.dtype))[:, np.newaxis]
+
+    def etapas(self):
+        """Modelos base como [(nome, funcao(X) -> colunas do meta-modelo)] e a função do meta-modelo"""
+        membros = [(nome, partial(self._saida_membro, tipo, membro)) for nome, tipo, membro in self.membros]
+        return membros, self.predict_proba_meta
+
+    def predict_proba_meta(self, X_meta):
+        p = expit(X_meta @ self.meta_coef + self.meta_intercepto)
+        return np.column_stack([1 - p, p])
+
+    def predict_proba(self, X):
+        return self.predict_proba_meta(self.probabilidades_membros(X))
+
+    def predict(self, X):
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1))
+
+
+def verificar_equivalencia(modelo_sklearn, modelo_compilado, X, tolerancia=1e-9, scaler=None):
+    """
+    Confere se as probabilidades do motor compilado batem com as do scikit-learn.
+    Com scaler, X está em unidades originais: o scikit-learn recebe scaler.transform(X)
+    e o motor compilado (com o scaler incorporado) recebe X direto.
+    """
+    esperado = modelo_sklearn.predict_proba(scaler.transform(X) if scaler is not None else X)
+    obtido = modelo_compilado.predict_proba(X)
+    diferenca = float(np.max(np.abs(esperado - obtido)))
+    assert diferenca <= tolerancia, (
+        f"Motor compilado diverge do scikit-learn: diferença máxima {diferenca:.3g} > {tolerancia:.3g}"
+    )
+    return diferenca
+
+
+def relatorio_float32(modelo_sklearn, scaler, X_bruto):
+    """
+    Compara o modo float32 com o caminho em float64 nos dois backends, com as
+    features em unidades originais: scikit-learn (scaler + modelo) e motor
+    compilado com o scaler incorporado. Devolve, por backend, as diferenças de
+    probabilidade, as linhas que mudaram mais que 1e-6, as predições que mudaram,
+    o tamanho da matriz de features e a latência do lote nas duas precisões.
+    """
+    X64 = np.ascontiguousarray(X_bruto, dtype=np.float64)
+    X32 = X64.astype(np.float32)
+    compilado32 = ModeloCompilado(modelo_sklearn, scaler).para_float32()
+    backends = {
+        "scikit-learn": (lambda X: modelo_sklearn.predict_proba(scaler.transform(X)),) * 2,
+        "compilado": (ModeloCompilado(modelo_sklearn, scaler).predict_proba, compilado32.predict_proba),
+    }
+
+    relatorio = {}
+    for nome, (funcao64, funcao32) in backends.items():
+        tempos = []
+        for funcao, X in ((funcao64, X64), (funcao32, X32)):
+            inicio = time.perf_counter()
+            p = funcao(X)[:, 1]
+            tempos.append((time.perf_counter() - inicio, p))
+        (duracao64, p64), (duracao32, p32) = tempos
+        diferenca = np.abs(p64.astype(np.float64) - p32)
+        relatorio[nome] = {
+            "linhas": len(X64),
+            "dtype_saida": str(p32.dtype),
+            "max_diferenca": float(diferenca.max()),
+            "media_diferenca": float(diferenca.mean()),
+            "p99_diferenca": float(np.quantile(diferenca, 0.99)),
+            "linhas_acima_1e-6": int((diferenca > 1e-6).sum()),
+            "predicoes_diferentes": int(((p64 > 0.5) != (p32 > 0.5)).sum()),
+            "bytes_features_float64": X64.nbytes,
+            "bytes_features_float32": X32.nbytes,
+            "latencia_float64_ms": duracao64 * 1000,
+            "latencia_float32_ms": duracao32 * 1000,
+        }
+    return relatorio
+
+
+if __name__ == "__main__":
+    import json
+    import sys
+    import joblib
+
+    modelo = joblib.load('stacking_model.pkl')
+    scaler = joblib.load('scaler.pkl')
+    # Leituras em unidades originais, em torno da distribuição do treino
+    rng = np.random.default_rng(42)
+    X_bruto = rng.normal(scaler.mean_, scaler.scale_, size=(5000, modelo.n_features_in_))
+    X = scaler.transform(X_bruto)
+
+    if sys.argv[1:2] == ["exportar"]:
+        import motor_arvores
+        saida = sys.argv[2] if len(sys.argv) > 2 else 'modelo_sem_scaler.pkl'
+        # Classe do módulo importável (e não de __main__), para o pickle abrir em outros scripts
+        sem_scaler = motor_arvores.ModeloCompilado(modelo, scaler)
+        diferenca = verificar_equivalencia(modelo, sem_scaler, X_bruto, scaler=scaler)
+        joblib.dump(sem_scaler, saida)
+        print(f"Modelo sem scaler salvo em {saida} (diferença máxima para scaler + modelo: {diferenca:.3g})")
+        sys.exit()
+
+    if sys.argv[1:2] == ["float32"]:
+        n = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+        X_grande = rng.normal(scaler.mean_, scaler.scale_, size=(n, modelo.n_features_in_))
+        print(json.dumps(relatorio_float32(modelo, scaler, X_grande), indent=2))
+        sys.exit()
+
+    compilado = ModeloCompilado(modelo)
+    diferenca = verificar_equivalencia(modelo, compilado, X)
+    print(f"Diferença máxima de probabilidade: {diferenca:.3g}")
+    sem_scaler = ModeloCompilado(modelo, scaler)
+    diferenca = verificar_equivalencia(modelo, sem_scaler, X_bruto, scaler=scaler)
+    print(f"Diferença máxima com o scaler incorporado: {diferenca:.3g}")
+
+    funcoes = [
+        ("scikit-learn", lambda x: modelo.predict_proba(scaler.transform(x))),
+        ("compilado", lambda x: compilado.predict_proba(scaler.transform(x))),
+        ("compilado sem scaler", sem_scaler.predict_proba),
+    ]
+    for nome, funcao in funcoes:
+        inicio = time.perf_counter()
+        for i in range(200):
+            funcao(X_bruto[i:i + 1])
+        print(f"{nome}: {(time.perf_counter() - inicio) / 200 * 1000:.3f} ms por linha")
@@ -0,0 +1,178 @@
+import asyncio
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+# Quadros em que uma thread está parada esperando trabalho: amostras com um
+# deles no topo da pilha não entram no perfil
+QUADROS_OCIOSOS = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+
+def _nome_quadro(codigo):
+    # Sem ';', que separa os quadros no formato colapsado
+    return f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})".replace(";", ",")
+
+
+class AmostradorPilhas:
+    """
+    Perfil estatístico do processo enquanto uma requisição roda: uma thread lê a
+    pilha de todas as outras threads a cada `intervalo` segundos com
+    sys._current_frames(). Cobre o event loop (validação do pydantic, handler,
+    serialização) e as threads do executor (scaler, membros do stacking), mas
+    também o que mais estiver rodando no processo no mesmo período; com pouca
+    concorrência, o perfil é o da requisição. Inferência em processos separados
+    (INFERENCIA_EXECUTOR=process) fica de fora.
+    """
+
+    def __init__(self, intervalo=0.001):
+        self.intervalo = intervalo
+        # (thread, pilha da raiz para o topo) -> (amostras, milissegundos)
+        self.amostras = Counter()
+        self.tempos = Counter()
+        self._parar = threading.Event()
+        self._thread = None
+        self.inicio = None
+        self.duracao = 0.0
+
+    def iniciar(self):
+        self.inicio = time.perf_counter()
+        self._thread = threading.Thread(target=self._executar, name="perfil", daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+        self._thread.join()
+        self.duracao = time.perf_counter() - self.inicio
+
+    def _executar(self):
+        proprio = threading.get_ident()
+        nomes = {}
+        anterior = time.perf_counter()
+        while not self._parar.wait(self.intervalo):
+            agora = time.perf_counter()
+            # O intervalo real passa do pedido quando a thread demora a pegar o GIL
+            peso = (agora - anterior) * 1000
+            anterior = agora
+            for ident, quadro in sys._current_frames().items():
+                if ident == proprio:
+                    continue
+                codigo = quadro.f_code
+                if (os.path.basename(codigo.co_filename), codigo.co_name) in QUADROS_OCIOSOS:
+                    continue
+                if ident not in nomes:
+                    nomes = {t.ident: t.name for t in threading.enumerate()}
+                pilha = []
+                while quadro is not None:
+                    pilha.append(_nome_quadro(quadro.f_code))
+                    quadro = quadro.f_back
+                chave = (nomes.get(ident, str(ident)), tuple(reversed(pilha)))
+                self.amostras[chave] += 1
+                self.tempos[chave] += peso
+
+    def colapsado(self):
+        """Formato colapsado (flamegraph.pl, speedscope): 'thread;quadro;...;quadro amostras' por linha"""
+        return "".join(f"{';'.join((thread,) + pilha)} {n}\n" for (thread, pilha), n in sorted(self.amostras.items()))
+
+    def speedscope(self, nome):
+        """Perfil no formato de arquivo do speedscope, um perfil por thread, com o tempo em ms"""
+        indices = {}
+        quadros = []
+        por_thread = {}
+        for (thread, pilha), ms in sorted(self.tempos.items()):
+            amostra = []
+            for quadro in pilha:
+                if quadro not in indices:
+                    indices[quadro] = len(quadros)
+                    quadros.append({"name": quadro})
+                amostra.append(indices[quadro])
+            amostras, pesos = por_thread.setdefault(thread, ([], []))
+            amostras.append(amostra)
+            pesos.append(ms)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": nome,
+            "exporter": "perfil.py",
+            "shared": {"frames": quadros},
+            "profiles": [
+                {"type": "sampled", "name": thread, "unit": "milliseconds",
+                 "startValue": 0, "endValue": sum(pesos), "samples": amostras, "weights": pesos}
+                for thread, (amostras, pesos) in por_thread.items()
+            ],
+        }
+
+
+class MiddlewarePerfil:
+    """
+    Middleware ASGI que perfila requisições escolhidas: as que trazem o
+    cabeçalho X-Profile: 1 e uma fração sorteada das demais. O arquivo do
+    perfil vai para `diretorio` e o nome volta no cabeçalho X-Profile-File da
+    resposta. No máximo max_simultaneos perfis rodam ao mesmo tempo; as outras
+    requisições passam direto, com o custo de um sorteio e da busca do cabeçalho.
+    """
+
+    def __init__(self, app, diretorio, fracao=0.0, intervalo=0.001, formato="collapsed", max_simultaneos=1):
+        self.app = app
+        self.diretorio = diretorio
+        self.fracao = fracao
+        self.intervalo = intervalo
+        self.formato = formato
+        self.vagas = threading.BoundedSemaphore(max_simultaneos)
+        self.rng = random.Random()
+        os.makedirs(diretorio, exist_ok=True)
+
+    def _pedido(self, scope):
+        for nome, valor in scope["headers"]:
+            if nome == b"x-profile":
+                return valor in (b"1", b"true")
+        return False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not (self._pedido(scope) or self.rng.random() < self.fracao):
+            await self.app(scope, receive, send)
+            return
+        if not self.vagas.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        rota = scope["path"].strip("/").replace("/", "_") or "raiz"
+        extensao = "speedscope.json" if self.formato == "speedscope" else "collapsed.txt"
+        nome = f"{time.strftime('%Y%m%d-%H%M%S')}-{rota}-{uuid.uuid4().hex[:8]}.{extensao}"
+
+        async def enviar(mensagem):
+            if mensagem["type"] == "http.response.start":
+                mensagem["headers"] = list(mensagem.get("headers", [])) + [(b"x-profile-file", nome.encode())]
+            await send(mensagem)
+
+        amostrador = AmostradorPilhas(self.intervalo)
+        amostrador.iniciar()
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            # O join da thread de amostragem e a escrita do arquivo rodam fora do event loop
+            try:
+                await asyncio.to_thread(amostrador.parar)
+            finally:
+                self.vagas.release()
+            await asyncio.to_thread(self._gravar, amostrador, nome, f"{scope['method']} {scope['path']}")
+
+    def _gravar(self, amostrador, nome, descricao):
+        caminho = os.path.join(self.diretorio, nome)
+        try:
+            with open(caminho, "w") as f:
+                if self.formato == "speedscope":
+                    json.dump(amostrador.speedscope(f"{descricao} ({amostrador.duracao * 1000:.1f} ms)"), f)
+                else:
+                    f.write(amostrador.colapsado())
+        except OSError as e:
+            print(f"Erro ao gravar o perfil {caminho}: {e}")
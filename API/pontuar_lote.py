@@ -0,0 +1,286 @@
+"""
+Pontuação em lote, offline, sem a camada HTTP.
+
+Lê um CSV ou Parquet no formato do bootcamp_train.csv em blocos de tamanho
+limitado, aplica o mesmo tratamento do train_model.py (valores especiais
+preenchidos com as medianas do treino, colunas de falha padronizadas, tipo
+codificado pelo label_encoder.pkl salvo), pontua cada bloco em um pool de
+processos e grava uma parte Parquet por bloco:
+
+    saida/
+        _manifesto.json        <- entrada, tamanho do bloco e versão do modelo
+        parte-000000.parquet
+        parte-000001.parquet
+        ...
+        _resumo.json           <- escrito ao final: linhas, linhas/s, duração
+
+Cada parte é escrita em um arquivo temporário e renomeada, então uma parte que
+existe está completa. Rodar o mesmo comando de novo depois de uma queda pula as
+partes já gravadas e continua do ponto em que parou.
+
+Uso:
+    python pontuar_lote.py historico.csv saida/
+    python pontuar_lote.py historico.parquet saida/ --tamanho-bloco 200000 --workers 8
+    python pontuar_lote.py historico.csv saida/ --recomecar   # descarta as partes existentes
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from inferencia import calcular_confianca, prever_com_modelo
+from registro_modelos import RegistroModelos, impressao_artefatos
+from train_model import feature_cols, numeric_cols, padronizar_falhas, tratar_numericas
+
+CSV_TREINO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '2. Base de dados', 'bootcamp_train.csv')
+ARQUIVO_MANIFESTO = '_manifesto.json'
+ARQUIVO_RESUMO = '_resumo.json'
+
+# Modelo e configuração carregados uma vez em cada processo do pool
+_worker = {}
+
+
+def nome_parte(indice):
+    return f"parte-{indice:06d}.parquet"
+
+
+def ler_blocos(caminho, tamanho_bloco):
+    """DataFrames de até tamanho_bloco linhas, na ordem do arquivo (CSV ou Parquet)"""
+    if caminho.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        for lote in pq.ParquetFile(caminho).iter_batches(batch_size=tamanho_bloco):
+            yield lote.to_pandas()
+    else:
+        yield from pd.read_csv(caminho, chunksize=tamanho_bloco)
+
+
+def contar_linhas(caminho, tamanho_bloco=100000):
+    """
+    Linhas de dados do arquivo, contadas pelo mesmo leitor de ler_blocos: num
+    CSV, um campo entre aspas pode conter quebras de linha
+    """
+    if caminho.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(caminho).metadata.num_rows
+    return sum(len(bloco) for bloco in pd.read_csv(caminho, usecols=[0], chunksize=tamanho_bloco))
+
+
+def medianas_do_treino(csv_treino, scaler):
+    """
+    Medianas usadas no treino para preencher as leituras ausentes, recalculadas
+    do CSV de treino com as mesmas regras; sem ele, as médias do scaler.
+    """
+    if csv_treino and os.path.isfile(csv_treino):
+        medianas = tratar_numericas(pd.read_csv(csv_treino, usecols=numeric_cols))
+    else:
+        print(f"CSV de treino não encontrado ({csv_treino}): leituras ausentes preenchidas com as médias do scaler",
+              file=sys.stderr)
+        medianas = {col: scaler.mean_[feature_cols.index(col)] for col in numeric_cols}
+    return {col: float(valor) for col, valor in medianas.items()}
+
+
+def _inicializar_worker(caminho_modelo, caminho_scaler, caminho_label_encoder, medianas, manter, saida):
+    _worker.update(
+        modelo=joblib.load(caminho_modelo),
+        scaler=joblib.load(caminho_scaler),
+        classes=joblib.load(caminho_label_encoder).classes_,
+        medianas=medianas,
+        manter=manter,
+        saida=saida,
+    )
+
+
+def montar_features_bloco(bloco, medianas, classes):
+    """
+    Matriz de features do bloco com o tratamento do treino e a máscara das linhas
+    válidas (tipo conhecido pelo label_encoder, leituras numéricas, FTE booleano e
+    nenhuma feature ausente). Uma linha suja fica inválida sem interromper o bloco.
+    """
+    data = bloco.copy()
+    legiveis = np.ones(len(data), dtype=bool)
+    for col in numeric_cols + ['umidade_relativa']:
+        numeros = pd.to_numeric(data[col], errors='coerce')
+        # Texto torna a linha inválida; vazio segue o tratamento do treino
+        legiveis &= (numeros.notna() | data[col].isna()).to_numpy()
+        data[col] = numeros
+    tratar_numericas(data, medianas)
+    padronizar_falhas(data, fte_inteiro=False)
+
+    tipos = data['tipo'].to_numpy(dtype=object)
+    codigos = np.searchsorted(classes, tipos.astype(str))
+    tipo_valido = (codigos < len(classes)) & (classes[np.minimum(codigos, len(classes) - 1)] == tipos)
+    data['tipo_encoded'] = np.where(tipo_valido, codigos, 0)
+
+    features = data[feature_cols].to_numpy(dtype=np.float64)
+    validas = tipo_valido & legiveis & np.isfinite(features).all(axis=1)
+    return features, validas
+
+
+def resultado_bloco(bloco, inicio, validas, predicoes, probabilidades, manter=('id', 'id_produto')):
+    """
+    DataFrame de saída de um bloco: as colunas de `manter` presentes na entrada,
+    a posição da linha no arquivo, a predição, a probabilidade, a confiança e se
+    a linha era válida. predicoes e probabilidades são só das linhas válidas.
+    """
+    n = len(bloco)
+    falha_prevista = pd.array([None] * n, dtype="boolean")
+    probabilidade_falha = np.full(n, np.nan)
+    if validas.any():
+        falha_prevista[validas] = predicoes
+        probabilidade_falha[validas] = probabilidades
+
+    resultado = pd.DataFrame({col: bloco[col].to_numpy() for col in manter if col in bloco.columns})
+    resultado['linha'] = np.arange(inicio, inicio + n, dtype=np.int64)
+    resultado['falha_prevista'] = falha_prevista
+    resultado['probabilidade_falha'] = probabilidade_falha
+    # dtype string: a coluna tem o mesmo tipo no Parquet mesmo em um bloco todo inválido
+    resultado['confianca'] = pd.array(np.where(validas, calcular_confianca(probabilidade_falha), None), dtype="string")
+    resultado['valida'] = validas
+    return resultado
+
+
+def _pontuar_bloco(indice, inicio, bloco):
+    """Pontua um bloco e grava a parte Parquet; devolve (indice, linhas, invalidas, segundos)"""
+    comeco = time.perf_counter()
+    features, validas = montar_features_bloco(bloco, _worker['medianas'], _worker['classes'])
+    predicoes = probabilidades = None
+    if validas.any():
+        predicoes, probabilidades, _, _ = prever_com_modelo(_worker['modelo'], _worker['scaler'], features[validas])
+    resultado = resultado_bloco(bloco, inicio, validas, predicoes, probabilidades, _worker['manter'])
+
+    destino = os.path.join(_worker['saida'], nome_parte(indice))
+    temporario = f"{destino}.{os.getpid()}.tmp"
+    resultado.to_parquet(temporario, index=False)
+    os.replace(temporario, destino)
+    return indice, len(bloco), int((~validas).sum()), time.perf_counter() - comeco
+
+
+def preparar_saida(saida, manifesto, recomecar):
+    """Cria a pasta de saída e confere se uma execução anterior é compatível com esta"""
+    os.makedirs(saida, exist_ok=True)
+    caminho = os.path.join(saida, ARQUIVO_MANIFESTO)
+    if recomecar:
+        for nome in os.listdir(saida):
+            if nome.startswith('parte-') or nome in (ARQUIVO_MANIFESTO, ARQUIVO_RESUMO):
+                os.remove(os.path.join(saida, nome))
+    elif os.path.isfile(caminho):
+        with open(caminho) as f:
+            anterior = json.load(f)
+        diferentes = [chave for chave in manifesto if anterior.get(chave) != manifesto[chave]]
+        if diferentes:
+            raise SystemExit(f"A saída {saida} é de outra execução (difere em {diferentes}); "
+                             "use --recomecar ou outra pasta")
+    with open(caminho, 'w') as f:
+        json.dump(manifesto, f, indent=2)
+    # Temporários de uma execução interrompida
+    for nome in os.listdir(saida):
+        if nome.endswith('.tmp'):
+            os.remove(os.path.join(saida, nome))
+    return {int(nome[6:12]) for nome in os.listdir(saida) if nome.startswith('parte-') and nome.endswith('.parquet')}
+
+
+def pontuar_arquivo(entrada, saida, tamanho_bloco=100000, workers=None, versao=None, csv_treino=CSV_TREINO,
+                    manter=('id', 'id_produto'), recomecar=False):
+    """Pontua o arquivo inteiro e devolve o resumo da execução"""
+    if versao:
+        caminho_modelo, caminho_scaler, caminho_label_encoder = RegistroModelos(
+            os.getenv("MODELOS_DIR", "modelos")).caminhos(versao)
+    else:
+        caminho_modelo, caminho_scaler, caminho_label_encoder = 'stacking_model.pkl', 'scaler.pkl', 'label_encoder.pkl'
+    medianas = medianas_do_treino(csv_treino, joblib.load(caminho_scaler))
+
+    estatisticas = os.stat(entrada)
+    manifesto = {
+        "entrada": os.path.abspath(entrada),
+        "tamanho_entrada": estatisticas.st_size,
+        "modificado_em": estatisticas.st_mtime,
+        "tamanho_bloco": tamanho_bloco,
+        "versao_modelo": versao or impressao_artefatos(caminho_modelo, caminho_scaler, caminho_label_encoder),
+        "medianas": medianas,
+    }
+    prontas = preparar_saida(saida, manifesto, recomecar)
+    if prontas:
+        print(f"Retomando: {len(prontas)} partes já gravadas", file=sys.stderr)
+
+    workers = workers or os.cpu_count() or 1
+    # Limita os blocos em memória: lidos e ainda não pontuados
+    max_pendentes = 2 * workers
+    linhas = invalidas = blocos = 0
+    inicio = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_inicializar_worker,
+        initargs=(caminho_modelo, caminho_scaler, caminho_label_encoder, medianas, list(manter), saida)
+    ) as pool:
+        pendentes = set()
+
+        def concluir(futuros):
+            nonlocal linhas, invalidas, blocos
+            for futuro in futuros:
+                _, n, n_invalidas, _ = futuro.result()
+                linhas += n
+                invalidas += n_invalidas
+                blocos += 1
+                decorrido = time.perf_counter() - inicio
+                print(f"{blocos} blocos, {linhas} linhas, {linhas / decorrido:.0f} linhas/s", file=sys.stderr)
+
+        linha_inicial = 0
+        for indice, bloco in enumerate(ler_blocos(entrada, tamanho_bloco)):
+            if indice not in prontas:
+                if len(pendentes) >= max_pendentes:
+                    feitos, pendentes = wait(pendentes, return_when=FIRST_COMPLETED)
+                    concluir(feitos)
+                pendentes.add(pool.submit(_pontuar_bloco, indice, linha_inicial, bloco))
+            linha_inicial += len(bloco)
+        concluir(wait(pendentes)[0])
+
+    duracao = time.perf_counter() - inicio
+    resumo = {
+        "entrada": os.path.abspath(entrada),
+        "saida": os.path.abspath(saida),
+        "versao_modelo": manifesto["versao_modelo"],
+        "linhas_total": linha_inicial,
+        "linhas_pontuadas": linhas,
+        "linhas_invalidas": invalidas,
+        "blocos_pontuados": blocos,
+        "blocos_retomados": len(prontas),
+        "workers": workers,
+        "duracao_s": duracao,
+        "linhas_por_s": linhas / duracao if duracao else 0.0,
+    }
+    with open(os.path.join(saida, ARQUIVO_RESUMO), 'w') as f:
+        json.dump(resumo, f, indent=2)
+    return resumo
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pontuação offline de um CSV ou Parquet, com saída em Parquet")
+    parser.add_argument('entrada', help="Arquivo .csv ou .parquet no formato do bootcamp_train.csv")
+    parser.add_argument('saida', help="Pasta das partes Parquet (a mesma pasta retoma uma execução interrompida)")
+    parser.add_argument('--tamanho-bloco', type=int, default=100000, help="Linhas por bloco (padrão: 100000)")
+    parser.add_argument('--workers', type=int, default=None, help="Processos do pool (padrão: número de CPUs)")
+    parser.add_argument('--versao', help="Versão do registro (MODELOS_DIR); sem ela, os .pkl do diretório atual")
+    parser.add_argument('--csv-treino', default=CSV_TREINO, help="CSV de treino, de onde vêm as medianas")
+    parser.add_argument('--manter', default='id,id_produto',
+                        help="Colunas da entrada copiadas para a saída (padrão: id,id_produto)")
+    parser.add_argument('--recomecar', action='store_true', help="Descarta as partes existentes na saída")
+    args = parser.parse_args()
+
+    resumo = pontuar_arquivo(
+        args.entrada, args.saida,
+        tamanho_bloco=args.tamanho_bloco,
+        workers=args.workers,
+        versao=args.versao,
+        csv_treino=args.csv_treino,
+        manter=[col for col in args.manter.split(',') if col],
+        recomecar=args.recomecar,
+    )
+    print(json.dumps(resumo, indent=2))
@@ -0,0 +1,162 @@
+"""
+Registro local de versões do modelo.
+
+Cada versão é um diretório com os artefatos do treino:
+
+    modelos/
+        20261018-120000-3f9a1c2b/
+            stacking_model.pkl
+            scaler.pkl
+            label_encoder.pkl
+            primeiro_estagio.pkl   <- opcional, primeiro estágio da cascata
+        ATIVA        <- nome da versão que a API deve servir
+
+Publicar uma versão copia os artefatos para um diretório temporário e o renomeia
+de uma vez, então a API nunca enxerga uma versão pela metade. O arquivo ATIVA
+também é trocado com os.replace.
+
+Uso:
+    python registro_modelos.py publicar    # publica os .pkl do diretório atual
+    python registro_modelos.py ativar <versao>
+    python registro_modelos.py listar
+"""
+import hashlib
+import os
+import shutil
+import sys
+import time
+
+ARQUIVO_MODELO = 'stacking_model.pkl'
+ARQUIVO_SCALER = 'scaler.pkl'
+ARQUIVO_LABEL_ENCODER = 'label_encoder.pkl'
+ARQUIVO_PRIMEIRO_ESTAGIO = 'primeiro_estagio.pkl'
+ARQUIVO_ATIVA = 'ATIVA'
+
+
+def impressao_artefatos(*caminhos):
+    """Hash do conteúdo dos artefatos, usado como versão do modelo"""
+    sha = hashlib.sha256()
+    for caminho in caminhos:
+        with open(caminho, 'rb') as f:
+            sha.update(f.read())
+    return sha.hexdigest()[:12]
+
+
+class ArtefatosModelo:
+    """
+    Uma versão carregada do modelo: modelo, scaler, label_encoder e o modelo de
+    inferência preparado. A API troca o objeto inteiro de uma vez, então uma
+    predição nunca mistura o scaler de uma versão com o modelo de outra.
+    """
+
+    def __init__(self, versao, modelo, scaler, label_encoder, modelo_inferencia,
+                 caminho_modelo, caminho_scaler, caminho_label_encoder, caminho_primeiro_estagio=None):
+        self.versao = versao
+        self.modelo = modelo
+        self.scaler = scaler
+        self.label_encoder = label_encoder
+        self.modelo_inferencia = modelo_inferencia
+        self.caminho_modelo = caminho_modelo
+        self.caminho_scaler = caminho_scaler
+        self.caminho_label_encoder = caminho_label_encoder
+        # Só preenchido quando a cascata está ativa e a versão tem primeiro estágio
+        self.caminho_primeiro_estagio = caminho_primeiro_estagio
+        self.carregado_em = time.time()
+
+    def descricao(self):
+        return {
+            "versao": self.versao,
+            "caminho_modelo": self.caminho_modelo,
+            "cascata": self.caminho_primeiro_estagio is not None,
+            "carregado_em": self.carregado_em,
+        }
+
+
+class RegistroModelos:
+    def __init__(self, diretorio):
+        self.diretorio = diretorio
+
+    def versoes(self):
+        """Versões publicadas, da mais antiga para a mais nova"""
+        if not os.path.isdir(self.diretorio):
+            return []
+        return sorted(
+            nome for nome in os.listdir(self.diretorio)
+            if not nome.startswith('.') and os.path.isfile(os.path.join(self.diretorio, nome, ARQUIVO_MODELO))
+        )
+
+    def versao_ativa(self):
+        """Versão indicada em ATIVA ou, sem ela, a última publicada (None se o registro está vazio)"""
+        try:
+            with open(os.path.join(self.diretorio, ARQUIVO_ATIVA)) as f:
+                versao = f.read().strip()
+            if versao in self.versoes():
+                return versao
+        except FileNotFoundError:
+            pass
+        versoes = self.versoes()
+        return versoes[-1] if versoes else None
+
+    def caminhos(self, versao):
+        """(caminho_modelo, caminho_scaler, caminho_label_encoder) de uma versão publicada"""
+        if versao not in self.versoes():
+            raise KeyError(f"Versão não encontrada no registro: {versao}")
+        base = os.path.join(self.diretorio, versao)
+        return (
+            os.path.join(base, ARQUIVO_MODELO),
+            os.path.join(base, ARQUIVO_SCALER),
+            os.path.join(base, ARQUIVO_LABEL_ENCODER),
+        )
+
+    def caminho_primeiro_estagio(self, versao):
+        """Primeiro estágio da cascata publicado com a versão, ou None"""
+        if versao not in self.versoes():
+            raise KeyError(f"Versão não encontrada no registro: {versao}")
+        caminho = os.path.join(self.diretorio, versao, ARQUIVO_PRIMEIRO_ESTAGIO)
+        return caminho if os.path.isfile(caminho) else None
+
+    def ativar(self, versao):
+        """Marca a versão como ativa; outros processos que observam o registro passam a servi-la"""
+        if versao not in self.versoes():
+            raise KeyError(f"Versão não encontrada no registro: {versao}")
+        temporario = os.path.join(self.diretorio, f".{ARQUIVO_ATIVA}.{os.getpid()}")
+        with open(temporario, 'w') as f:
+            f.write(versao + "\n")
+        os.replace(temporario, os.path.join(self.diretorio, ARQUIVO_ATIVA))
+
+    def publicar(self, caminho_modelo, caminho_scaler, caminho_label_encoder, ativar=True,
+                 caminho_primeiro_estagio=None):
+        """Copia os artefatos para uma nova versão do registro e devolve o nome dela"""
+        impressao = impressao_artefatos(caminho_modelo, caminho_scaler, caminho_label_encoder)
+        versao = f"{time.strftime('%Y%m%d-%H%M%S')}-{impressao[:8]}"
+        os.makedirs(self.diretorio, exist_ok=True)
+
+        temporario = os.path.join(self.diretorio, f".{versao}")
+        os.makedirs(temporario)
+        for origem, nome in ((caminho_modelo, ARQUIVO_MODELO), (caminho_scaler, ARQUIVO_SCALER),
+                             (caminho_label_encoder, ARQUIVO_LABEL_ENCODER)):
+            shutil.copyfile(origem, os.path.join(temporario, nome))
+        if caminho_primeiro_estagio:
+            shutil.copyfile(caminho_primeiro_estagio, os.path.join(temporario, ARQUIVO_PRIMEIRO_ESTAGIO))
+        os.rename(temporario, os.path.join(self.diretorio, versao))
+
+        if ativar:
+            self.ativar(versao)
+        return versao
+
+
+if __name__ == "__main__":
+    registro = RegistroModelos(os.getenv("MODELOS_DIR", "modelos"))
+    comando = sys.argv[1] if len(sys.argv) > 1 else "listar"
+    if comando == "publicar":
+        primeiro_estagio = ARQUIVO_PRIMEIRO_ESTAGIO if os.path.isfile(ARQUIVO_PRIMEIRO_ESTAGIO) else None
+        versao = registro.publicar(ARQUIVO_MODELO, ARQUIVO_SCALER, ARQUIVO_LABEL_ENCODER,
+                                   caminho_primeiro_estagio=primeiro_estagio)
+        print(f"Versão publicada e ativada: {versao}")
+    elif comando == "ativar" and len(sys.argv) > 2:
+        registro.ativar(sys.argv[2])
+        print(f"Versão ativada: {sys.argv[2]}")
+    else:
+        ativa = registro.versao_ativa()
+        for versao in registro.versoes():
+            print(f"{'*' if versao == ativa else ' '} {versao}")
@@ -0,0 +1,151 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+class AvaliadorSombra:
+    """
+    Reavalia uma amostra das requisições com um modelo candidato (modo sombra).
+
+    O handler sorteia a requisição com amostrar() e, depois que a resposta foi
+    enviada, submeter() coloca as features e o resultado do modelo principal em
+    uma fila limitada. Uma tarefa em segundo plano tira os itens da fila, roda o
+    candidato em uma thread própria e acumula a discordância e a diferença de
+    latência. Com a fila cheia o item é descartado: o caminho principal nunca
+    espera pelo candidato e a fila nunca cresce sem limite.
+
+    funcao_candidato(features) roda na thread do avaliador e devolve
+    (predicoes, probabilidades). A latência do principal é a da inferência só;
+    sem ela (None, por exemplo quando parte do lote veio do cache) o item conta
+    para a discordância mas não para a comparação de latência.
+    """
+
+    def __init__(self, funcao_candidato, versao, fracao=0.05, max_fila=100, janela_latencias=1000):
+        self.funcao_candidato = funcao_candidato
+        self.versao = versao
+        self.fracao = fracao
+        self.max_fila = max_fila
+        self.fila = None
+        self.tarefa = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sombra")
+        self.rng = random.Random()
+        self.lock = threading.Lock()
+
+        # Métricas
+        self.amostradas = 0
+        self.descartadas = 0
+        self.avaliadas = 0
+        self.erros = 0
+        self.linhas = 0
+        self.linhas_discordantes = 0
+        self.soma_diferenca_probabilidade = 0.0
+        self.max_diferenca_probabilidade = 0.0
+        self.avaliadas_com_latencia = 0
+        self.soma_latencia_principal = 0.0
+        self.soma_latencia_sombra = 0.0
+        # Diferenças de latência (sombra - principal) das últimas avaliações, para os percentis
+        self.diferencas_latencia = deque(maxlen=janela_latencias)
+
+    @property
+    def ativo(self):
+        return self.tarefa is not None and not self.tarefa.done()
+
+    def iniciar(self):
+        self.fila = asyncio.Queue(maxsize=self.max_fila)
+        self.tarefa = asyncio.create_task(self._executar())
+
+    async def parar(self):
+        if self.tarefa is not None:
+            self.tarefa.cancel()
+            try:
+                await self.tarefa
+            except asyncio.CancelledError:
+                pass
+            self.tarefa = None
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def amostrar(self):
+        """Sorteia se a requisição atual vai para o modelo sombra"""
+        return self.ativo and self.rng.random() < self.fracao
+
+    async def submeter(self, features, predicoes, probabilidades, latencia_principal):
+        """
+        Enfileira sem esperar; devolve False se a fila estava cheia e o item foi
+        descartado. É uma corrotina para rodar no event loop como tarefa de fundo
+        da resposta (funções comuns iriam para o pool de threads do Starlette).
+        """
+        self.amostradas += 1
+        try:
+            self.fila.put_nowait((features, predicoes, probabilidades, latencia_principal))
+        except asyncio.QueueFull:
+            self.descartadas += 1
+            return False
+        return True
+
+    async def _executar(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            features, predicoes, probabilidades, latencia_principal = await self.fila.get()
+            inicio = time.perf_counter()
+            try:
+                predicoes_sombra, probabilidades_sombra = await loop.run_in_executor(
+                    self.executor, self.funcao_candidato, features
+                )
+            except Exception as e:
+                self.erros += 1
+                print(f"Erro no modelo sombra {self.versao}: {e}")
+                continue
+            self._registrar(predicoes, probabilidades, predicoes_sombra, probabilidades_sombra,
+                            latencia_principal, time.perf_counter() - inicio)
+
+    def _registrar(self, predicoes, probabilidades, predicoes_sombra, probabilidades_sombra,
+                   latencia_principal, latencia_sombra):
+        diferenca = np.abs(np.asarray(probabilidades, dtype=np.float64) - probabilidades_sombra)
+        with self.lock:
+            self.avaliadas += 1
+            self.linhas += len(predicoes)
+            self.linhas_discordantes += int((np.asarray(predicoes) != predicoes_sombra).sum())
+            self.soma_diferenca_probabilidade += float(diferenca.sum())
+            self.max_diferenca_probabilidade = max(self.max_diferenca_probabilidade, float(diferenca.max(initial=0.0)))
+            if latencia_principal is not None:
+                self.avaliadas_com_latencia += 1
+                self.soma_latencia_principal += latencia_principal
+                self.soma_latencia_sombra += latencia_sombra
+                self.diferencas_latencia.append(latencia_sombra - latencia_principal)
+
+    def metricas(self):
+        with self.lock:
+            diferencas = np.asarray(self.diferencas_latencia) * 1000
+            avaliadas, linhas = self.avaliadas, self.linhas
+            com_latencia = self.avaliadas_com_latencia
+            resultado = {
+                "ativo": self.ativo,
+                "versao_candidata": self.versao,
+                "fracao": self.fracao,
+                "max_fila": self.max_fila,
+                "profundidade_fila": self.fila.qsize() if self.fila is not None else 0,
+                "amostradas": self.amostradas,
+                "descartadas": self.descartadas,
+                "avaliadas": avaliadas,
+                "erros": self.erros,
+                "linhas": linhas,
+                "linhas_discordantes": self.linhas_discordantes,
+                "taxa_discordancia": self.linhas_discordantes / linhas if linhas else None,
+                "diferenca_media_probabilidade": self.soma_diferenca_probabilidade / linhas if linhas else None,
+                "max_diferenca_probabilidade": self.max_diferenca_probabilidade,
+                "avaliadas_com_latencia": com_latencia,
+                "latencia_media_principal_ms": self.soma_latencia_principal / com_latencia * 1000 if com_latencia else None,
+                "latencia_media_sombra_ms": self.soma_latencia_sombra / com_latencia * 1000 if com_latencia else None,
+            }
+        if len(diferencas):
+            resultado["diferenca_latencia_ms"] = {
+                "p50": float(np.percentile(diferencas, 50)),
+                "p95": float(np.percentile(diferencas, 95)),
+                "p99": float(np.percentile(diferencas, 99)),
+            }
+        return resultado
@@ -0,0 +1,439 @@
+import asyncio
+import fcntl
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+
+from starlette.exceptions import HTTPException
+
+from pontuar_lote import contar_linhas, ler_blocos
+
+FORMATOS_ENTRADA = {'.csv': 'csv', '.parquet': 'parquet'}
+TAMANHO_COPIA = 1024 * 1024
+ID_TAREFA = re.compile(r"[0-9a-f]{12}")
+# Folga para os cabeçalhos e delimitadores do multipart em volta do arquivo
+MARGEM_MULTIPART = 64 * 1024
+
+
+class ErroTarefa(Exception):
+    """Upload recusado; status é o código HTTP da resposta"""
+
+    def __init__(self, status, mensagem, headers=None):
+        super().__init__(mensagem)
+        self.status = status
+        self.headers = headers
+
+
+class MiddlewareLimiteUpload:
+    """
+    Middleware ASGI que recusa com 413 os uploads maiores que max_bytes nas rotas
+    indicadas sem esperar o corpo chegar inteiro: pelo Content-Length, antes de
+    ler o corpo, ou contando os bytes enquanto chegam (corpo sem Content-Length).
+    Sem ele o Starlette grava o multipart inteiro num arquivo temporário antes de
+    o handler ver o tamanho.
+    """
+
+    def __init__(self, app, max_bytes, rotas):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.rotas = rotas
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.rotas:
+            await self.app(scope, receive, send)
+            return
+
+        tamanho = next((valor for nome, valor in scope["headers"] if nome == b"content-length"), b"")
+        if tamanho.isdigit() and int(tamanho) > self.max_bytes:
+            corpo = f'{{"detail":"Upload maior que o limite de {self.max_bytes} bytes"}}'.encode()
+            await send({
+                "type": "http.response.start",
+                "status": 413,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(corpo)).encode())],
+            })
+            await send({"type": "http.response.body", "body": corpo})
+            return
+
+        recebidos = 0
+
+        async def receber():
+            nonlocal recebidos
+            mensagem = await receive()
+            recebidos += len(mensagem.get("body", b""))
+            if recebidos > self.max_bytes:
+                # O FastAPI repassa HTTPException levantada durante a leitura do formulário
+                raise HTTPException(status_code=413, detail=f"Upload maior que o limite de {self.max_bytes} bytes")
+            return mensagem
+
+        await self.app(scope, receber, send)
+
+
+class TarefaPontuacao:
+    """
+    Estado de uma tarefa: "na_fila" -> "executando" -> "concluida", ou "erro" / "cancelada".
+
+    O worker que recebeu o upload é o dono: só ele executa a tarefa e grava o
+    estado em diretorio/tarefa.json a cada mudança, e os outros workers leem esse
+    arquivo. Enquanto a tarefa não termina, o dono mantém um flock em
+    diretorio/dono.lock; uma tarefa pendente sem o lock ficou órfã (o worker parou).
+    """
+
+    CAMPOS = ("id", "nome_arquivo", "formato_entrada", "formato_saida", "tamanho_bytes", "linhas_total", "status",
+              "criada_em", "iniciada_em", "concluida_em", "versao_modelo", "linhas_processadas", "linhas_invalidas",
+              "blocos", "erro")
+
+    def __init__(self, id_tarefa, diretorio, nome_arquivo, formato_entrada, formato_saida, tamanho_bytes, linhas_total):
+        self.id = id_tarefa
+        self.diretorio = diretorio
+        self.nome_arquivo = nome_arquivo
+        self.formato_entrada = formato_entrada
+        self.formato_saida = formato_saida
+        self.tamanho_bytes = tamanho_bytes
+        self.linhas_total = linhas_total
+        self.status = "na_fila"
+        self.criada_em = time.time()
+        self.iniciada_em = None
+        self.concluida_em = None
+        self.versao_modelo = None
+        self.linhas_processadas = 0
+        self.linhas_invalidas = 0
+        self.blocos = 0
+        self.erro = None
+        self.trava = None
+
+    @property
+    def entrada(self):
+        return os.path.join(self.diretorio, f"entrada.{self.formato_entrada}")
+
+    @property
+    def resultado(self):
+        return os.path.join(self.diretorio, f"resultado.{self.formato_saida}")
+
+    @property
+    def manifesto(self):
+        return os.path.join(self.diretorio, "tarefa.json")
+
+    @property
+    def cancelamento(self):
+        # Criado por DELETE /jobs/{id} em qualquer worker; o dono para no próximo bloco
+        return os.path.join(self.diretorio, "cancelar")
+
+    @property
+    def finalizada(self):
+        return self.status in ("concluida", "erro", "cancelada")
+
+    def travar(self):
+        """Marca este processo como dono da tarefa até liberar()"""
+        self.trava = os.open(os.path.join(self.diretorio, "dono.lock"), os.O_RDWR | os.O_CREAT)
+        fcntl.flock(self.trava, fcntl.LOCK_EX)
+
+    def liberar(self):
+        if self.trava is not None:
+            os.close(self.trava)
+            self.trava = None
+
+    def dono_ativo(self):
+        try:
+            trava = os.open(os.path.join(self.diretorio, "dono.lock"), os.O_RDWR)
+        except FileNotFoundError:
+            return False
+        try:
+            fcntl.flock(trava, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        finally:
+            os.close(trava)
+        return False
+
+    def salvar(self):
+        """Grava o estado em tarefa.json (arquivo temporário do processo + rename)"""
+        temporario = f"{self.manifesto}.{os.getpid()}.tmp"
+        with open(temporario, "w") as f:
+            json.dump({campo: getattr(self, campo) for campo in self.CAMPOS}, f)
+        os.replace(temporario, self.manifesto)
+
+    @classmethod
+    def carregar(cls, diretorio):
+        """
+        Estado gravado em diretorio/tarefa.json, como visto por qualquer worker, ou
+        None se a tarefa não existe (ou foi cancelada). Uma tarefa pendente cujo
+        dono parou aparece com status "erro".
+        """
+        for _ in range(2):
+            tarefa = cls._ler(diretorio)
+            if tarefa is None or tarefa.finalizada or tarefa.dono_ativo():
+                return tarefa
+            # O dono pode ter acabado de terminar: relê antes de declarar a tarefa órfã
+        tarefa.status = "erro"
+        tarefa.erro = "Tarefa interrompida: o worker que a executava parou"
+        tarefa.concluida_em = os.path.getmtime(tarefa.manifesto)
+        return tarefa
+
+    @classmethod
+    def _ler(cls, diretorio):
+        if os.path.exists(os.path.join(diretorio, "cancelar")):
+            return None
+        try:
+            with open(os.path.join(diretorio, "tarefa.json")) as f:
+                dados = json.load(f)
+        except (OSError, ValueError):
+            return None
+        tarefa = cls(dados["id"], diretorio, dados["nome_arquivo"], dados["formato_entrada"],
+                     dados["formato_saida"], dados["tamanho_bytes"], dados["linhas_total"])
+        for campo in cls.CAMPOS:
+            setattr(tarefa, campo, dados[campo])
+        return tarefa
+
+    def descrever(self):
+        fim = self.concluida_em or time.time()
+        duracao = fim - self.iniciada_em if self.iniciada_em else None
+        descricao = {
+            "id": self.id,
+            "status": self.status,
+            "arquivo": self.nome_arquivo,
+            "tamanho_bytes": self.tamanho_bytes,
+            "formato_saida": self.formato_saida,
+            "versao_modelo": self.versao_modelo,
+            "linhas_total": self.linhas_total,
+            "linhas_processadas": self.linhas_processadas,
+            "linhas_invalidas": self.linhas_invalidas,
+            "blocos": self.blocos,
+            "progresso": min(1.0, self.linhas_processadas / self.linhas_total) if self.linhas_total else None,
+            "criada_em": time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(self.criada_em)),
+            "duracao_s": duracao,
+            "linhas_por_s": self.linhas_processadas / duracao if duracao else None,
+            "status_url": f"/jobs/{self.id}",
+        }
+        if self.status == "concluida":
+            descricao["resultado_url"] = f"/jobs/{self.id}/resultado"
+        if self.erro is not None:
+            descricao["erro"] = self.erro
+        return descricao
+
+
+class EscritorResultado:
+    """Acrescenta os blocos pontuados a um único arquivo CSV ou Parquet (um row group por bloco)"""
+
+    def __init__(self, caminho, formato):
+        self.caminho = caminho
+        self.formato = formato
+        self.escritor_parquet = None
+        self.vazio = True
+
+    def escrever(self, resultado):
+        if self.formato == "csv":
+            resultado.to_csv(self.caminho, mode="w" if self.vazio else "a", header=self.vazio, index=False)
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            esquema = self.escritor_parquet.schema if self.escritor_parquet is not None else None
+            tabela = pa.Table.from_pandas(resultado, schema=esquema, preserve_index=False)
+            if self.escritor_parquet is None:
+                self.escritor_parquet = pq.ParquetWriter(self.caminho, tabela.schema)
+            self.escritor_parquet.write_table(tabela)
+        self.vazio = False
+
+    def fechar(self):
+        if self.escritor_parquet is not None:
+            self.escritor_parquet.close()
+            self.escritor_parquet = None
+        if self.vazio:
+            raise ValueError("Arquivo sem linhas")
+
+    def abortar(self):
+        if self.escritor_parquet is not None:
+            self.escritor_parquet.close()
+            self.escritor_parquet = None
+
+
+class GerenciadorTarefas:
+    """
+    Tarefas de pontuação de arquivos enviados por upload, fora do ciclo da
+    requisição HTTP.
+
+    submeter() grava o upload em disco (diretorio/<id>/entrada.csv|parquet) e põe
+    a tarefa em uma fila limitada; `workers` tarefas do event loop a consomem.
+    Cada tarefa lê o arquivo em blocos de tamanho_bloco linhas em uma thread,
+    pontua cada bloco com pontuar_bloco(bloco, inicio, contexto) e acrescenta o
+    resultado a diretorio/<id>/resultado.csv|parquet, atualizando o progresso a
+    cada bloco. Entre um bloco e outro o executor de inferência fica livre para
+    as requisições online.
+
+    O estado de cada tarefa fica em diretorio/<id>/tarefa.json: com vários
+    workers do gunicorn no mesmo diretório, qualquer um deles consulta, lista e
+    cancela as tarefas, mas só o que recebeu o upload a executa.
+
+    preparar() roda no início de cada tarefa e devolve (versao_modelo, contexto):
+    o mesmo contexto (a versão do modelo, as medianas) vale para todos os blocos.
+    Tarefas finalizadas há mais de `retencao` segundos são apagadas com os seus
+    arquivos no próximo upload.
+    """
+
+    def __init__(self, diretorio, preparar, pontuar_bloco, workers=1, max_fila=16, tamanho_bloco=10000,
+                 max_bytes=1024 ** 3, retencao=86400.0):
+        self.diretorio = diretorio
+        self.preparar = preparar
+        self.pontuar_bloco = pontuar_bloco
+        self.workers = workers
+        self.max_fila = max_fila
+        self.tamanho_bloco = tamanho_bloco
+        self.max_bytes = max_bytes
+        self.retencao = retencao
+        self.fila = None
+        self.trabalhadores = []
+        os.makedirs(diretorio, exist_ok=True)
+
+    def iniciar(self):
+        self.fila = asyncio.Queue()
+        self.trabalhadores = [asyncio.create_task(self._trabalhar()) for _ in range(self.workers)]
+
+    async def parar(self):
+        for trabalhador in self.trabalhadores:
+            trabalhador.cancel()
+        for trabalhador in self.trabalhadores:
+            try:
+                await trabalhador
+            except asyncio.CancelledError:
+                pass
+        self.trabalhadores = []
+
+    def buscar(self, id_tarefa):
+        """Tarefa lida do disco, de qualquer worker, ou None"""
+        if not ID_TAREFA.fullmatch(id_tarefa):
+            return None
+        return TarefaPontuacao.carregar(os.path.join(self.diretorio, id_tarefa))
+
+    def listar(self):
+        tarefas = (self.buscar(nome) for nome in sorted(os.listdir(self.diretorio)))
+        return sorted((tarefa for tarefa in tarefas if tarefa is not None), key=lambda tarefa: tarefa.criada_em)
+
+    def pendentes(self):
+        return sum(1 for tarefa in self.listar() if not tarefa.finalizada)
+
+    async def submeter(self, arquivo, nome_arquivo, formato_saida="parquet"):
+        """Grava o upload (objeto arquivo binário) em disco e enfileira a tarefa"""
+        formato_entrada = FORMATOS_ENTRADA.get(os.path.splitext(nome_arquivo or "")[1].lower())
+        if formato_entrada is None:
+            raise ErroTarefa(415, f"Arquivo deve ser .csv ou .parquet: {nome_arquivo}")
+        await asyncio.to_thread(self.limpar_expiradas)
+        if await asyncio.to_thread(self.pendentes) >= self.max_fila:
+            raise ErroTarefa(429, "Fila de tarefas cheia, tente novamente", headers={"Retry-After": "60"})
+
+        id_tarefa = uuid.uuid4().hex[:12]
+        diretorio = os.path.join(self.diretorio, id_tarefa)
+        os.makedirs(diretorio)
+        destino = os.path.join(diretorio, f"entrada.{formato_entrada}")
+        tarefa = None
+        try:
+            tamanho, linhas = await asyncio.to_thread(self._gravar_upload, arquivo, destino, formato_entrada)
+            tarefa = TarefaPontuacao(id_tarefa, diretorio, nome_arquivo, formato_entrada, formato_saida, tamanho,
+                                     linhas)
+            tarefa.travar()
+            tarefa.salvar()
+        except BaseException:
+            if tarefa is not None:
+                tarefa.liberar()
+            shutil.rmtree(diretorio, ignore_errors=True)
+            raise
+
+        self.fila.put_nowait(tarefa)
+        return tarefa
+
+    def _gravar_upload(self, arquivo, destino, formato_entrada):
+        """
+        Copia em blocos, limitando o tamanho; devolve (bytes, linhas de dados). As
+        linhas de um CSV são contadas pelo leitor no início da tarefa (None até lá)
+        """
+        tamanho = 0
+        with open(destino, "wb") as f:
+            while bloco := arquivo.read(TAMANHO_COPIA):
+                tamanho += len(bloco)
+                if tamanho > self.max_bytes:
+                    raise ErroTarefa(413, f"Arquivo maior que o limite de {self.max_bytes} bytes")
+                f.write(bloco)
+        if tamanho == 0:
+            raise ErroTarefa(400, "Arquivo vazio")
+
+        if formato_entrada == "csv":
+            return tamanho, None
+        try:
+            linhas = contar_linhas(destino)
+        except Exception as e:
+            raise ErroTarefa(400, f"Parquet inválido: {e}")
+        if linhas <= 0:
+            raise ErroTarefa(400, "Arquivo sem linhas")
+        return tamanho, linhas
+
+    def limpar_expiradas(self, agora=None):
+        agora = time.time() if agora is None else agora
+        for tarefa in self.listar():
+            if tarefa.finalizada and agora - tarefa.concluida_em > self.retencao:
+                shutil.rmtree(tarefa.diretorio, ignore_errors=True)
+
+    def remover(self, id_tarefa):
+        """
+        Cancela (se ainda não terminou) e apaga a tarefa e os seus arquivos. Uma
+        tarefa pendente só é marcada como cancelada: o worker dono a descarta ao
+        tirá-la da fila, ou para no próximo bloco, e apaga os arquivos
+        """
+        tarefa = self.buscar(id_tarefa)
+        if tarefa is None:
+            raise KeyError(id_tarefa)
+        if tarefa.finalizada:
+            shutil.rmtree(tarefa.diretorio, ignore_errors=True)
+        else:
+            open(tarefa.cancelamento, "w").close()
+
+    async def _trabalhar(self):
+        while True:
+            tarefa = await self.fila.get()
+            if os.path.exists(tarefa.cancelamento):
+                tarefa.liberar()
+                shutil.rmtree(tarefa.diretorio, ignore_errors=True)
+            else:
+                await self._executar(tarefa)
+
+    async def _executar(self, tarefa):
+        tarefa.status = "executando"
+        tarefa.iniciada_em = time.time()
+        temporario = f"{tarefa.resultado}.tmp"
+        escritor = EscritorResultado(temporario, tarefa.formato_saida)
+        try:
+            tarefa.versao_modelo, contexto = await self.preparar()
+            if tarefa.linhas_total is None:
+                # Pelo mesmo leitor dos blocos: campos entre aspas podem conter quebras de linha
+                tarefa.linhas_total = await asyncio.to_thread(contar_linhas, tarefa.entrada)
+            await asyncio.to_thread(tarefa.salvar)
+            blocos = ler_blocos(tarefa.entrada, self.tamanho_bloco)
+            while not os.path.exists(tarefa.cancelamento):
+                bloco = await asyncio.to_thread(next, blocos, None)
+                if bloco is None:
+                    break
+                resultado = await self.pontuar_bloco(bloco, tarefa.linhas_processadas, contexto)
+                await asyncio.to_thread(escritor.escrever, resultado)
+                tarefa.linhas_processadas += len(bloco)
+                tarefa.linhas_invalidas += int((~resultado['valida']).sum())
+                tarefa.blocos += 1
+                await asyncio.to_thread(tarefa.salvar)
+            if os.path.exists(tarefa.cancelamento):
+                tarefa.status = "cancelada"
+            else:
+                await asyncio.to_thread(escritor.fechar)
+                os.replace(temporario, tarefa.resultado)
+                tarefa.status = "concluida"
+            tarefa.concluida_em = time.time()
+        except Exception as e:
+            print(f"Erro na tarefa {tarefa.id}: {e}")
+            tarefa.status = "erro"
+            tarefa.erro = str(e)
+            tarefa.concluida_em = time.time()
+        finally:
+            escritor.abortar()
+        if tarefa.status == "cancelada":
+            shutil.rmtree(tarefa.diretorio, ignore_errors=True)
+        else:
+            await asyncio.to_thread(tarefa.salvar)
+        tarefa.liberar()
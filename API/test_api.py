@@ -1,82 +1,256 @@
-import requests
+"""
+Teste de carga reproduzível da API.
+
+Gera leituras sintéticas de MachineData a partir das distribuições do
+bootcamp_train.csv (mesma semente, mesmas leituras), dispara as requisições com
+um cliente assíncrono em várias conexões simultâneas e grava um relatório JSON
+com vazão e latência p50/p95/p99 por endpoint, para comparar builds antes de
+colocá-los em produção.
+
+Sem --url, a API roda no próprio processo (transporte ASGI do httpx, com o
+lifespan completo), então não é preciso subir o uvicorn:
+    python test_api.py
+    python test_api.py --concorrencia 32 --requisicoes 2000 --saida carga.json
+
+Contra uma API já rodando (ex.: gunicorn com vários workers):
+    python test_api.py --url http://localhost:8000
+
+As variáveis de ambiente da API (INFERENCIA_BACKEND, MICROBATCH_ATIVO, ...) valem
+no modo em processo e são copiadas para o relatório.
+"""
+import argparse
+import asyncio
 import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import httpx
+import numpy as np
+import pandas as pd
+
+from train_model import preprocess_data
+
+CSV_PADRAO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '2. Base de dados', 'bootcamp_train.csv')
+ENDPOINTS = ['predict', 'predict_batch', 'predict_columnar']
+
+COLUNAS_NUMERICAS = ['temperatura_ar', 'temperatura_processo', 'umidade_relativa',
+                     'velocidade_rotacional', 'torque', 'desgaste_da_ferramenta']
+# Coluna do CSV -> campo do MachineData
+COLUNAS_FALHA = {
+    'FDF (Falha Desgaste Ferramenta)': 'fdf_falha_desgaste_ferramenta',
+    'FDC (Falha Dissipacao Calor)': 'fdc_falha_dissipacao_calor',
+    'FP (Falha Potencia)': 'fp_falha_potencia',
+    'FTE (Falha Tensao Excessiva)': 'fte_falha_tensao_excessiva',
+    'FA (Falha Aleatoria)': 'fa_falha_aleatoria',
+}
+
+
+class GeradorLeituras:
+    """
+    Leituras sintéticas com as distribuições marginais do dataset de treino:
+    cada coluna numérica é sorteada dos valores observados (já tratados por
+    preprocess_data), o tipo pela frequência de L/M/H e cada indicador de falha
+    pela sua taxa.
+    """
 
-# URL base da API (ajuste conforme necessário)
-BASE_URL = "http://localhost:8000"
-
-def test_health():
-    """Testa o endpoint de health check"""
-    response = requests.get(f"{BASE_URL}/health")
-    print("Health Check:", response.json())
-
-def test_single_prediction():
-    """Testa predição única"""
-    # Dados de exemplo
-    data = {
-        "temperatura_ar": 298.5,
-        "temperatura_processo": 309.2,
-        "umidade_relativa": 90.0,
-        "velocidade_rotacional": 1500.0,
-        "torque": 40.5,
-        "desgaste_da_ferramenta": 120.0,
-        "tipo": "L",
-        "fdf_falha_desgaste_ferramenta": 0,
-        "fdc_falha_dissipacao_calor": 0,
-        "fp_falha_potencia": 0,
-        "fte_falha_tensao_excessiva": 0,
-        "fa_falha_aleatoria": 0
+    def __init__(self, csv_file, semente=42):
+        data, _ = preprocess_data(pd.read_csv(csv_file))
+        self.valores = {col: data[col].dropna().to_numpy(dtype=np.float64) for col in COLUNAS_NUMERICAS}
+        frequencias = data['tipo'].value_counts(normalize=True)
+        self.tipos = frequencias.index.to_numpy()
+        self.prob_tipos = frequencias.to_numpy()
+        self.taxas_falha = {campo: float(data[col].mean()) for col, campo in COLUNAS_FALHA.items()}
+        self.rng = np.random.default_rng(semente)
+
+    def colunas(self, n):
+        """n leituras no formato colunar (coluna -> lista de valores)"""
+        colunas = {col: self.rng.choice(valores, size=n).tolist() for col, valores in self.valores.items()}
+        colunas['tipo'] = self.rng.choice(self.tipos, size=n, p=self.prob_tipos).tolist()
+        for campo, taxa in self.taxas_falha.items():
+            colunas[campo] = (self.rng.random(n) < taxa).astype(int).tolist()
+        return colunas
+
+    def leituras(self, n):
+        """n leituras como objetos MachineData (lista de dicionários)"""
+        colunas = self.colunas(n)
+        return [dict(zip(colunas, valores)) for valores in zip(*colunas.values())]
+
+
+def montar_requisicoes(gerador, endpoint, quantidade, tamanho_lote):
+    """Corpos JSON já serializados, para o tempo de serialização ficar fora da medição"""
+    corpos = []
+    for _ in range(quantidade):
+        if endpoint == 'predict':
+            corpo = gerador.leituras(1)[0]
+        elif endpoint == 'predict_batch':
+            corpo = gerador.leituras(tamanho_lote)
+        else:
+            corpo = gerador.colunas(tamanho_lote)
+        corpos.append(json.dumps(corpo).encode())
+    return corpos
+
+
+def percentis(latencias):
+    if not latencias:
+        return {}
+    ms = np.asarray(latencias) * 1000
+    return {
+        "p50": float(np.percentile(ms, 50)),
+        "p95": float(np.percentile(ms, 95)),
+        "p99": float(np.percentile(ms, 99)),
+        "media": float(ms.mean()),
+        "max": float(ms.max()),
     }
 
-    response = requests.post(f"{BASE_URL}/predict", json=data)
-    print("Predição única:", response.json())
-
-def test_batch_prediction():
-    """Testa predição em lote"""
-    data_list = [
-        {
-            "temperatura_ar": 298.5,
-            "temperatura_processo": 309.2,
-            "umidade_relativa": 90.0,
-            "velocidade_rotacional": 1500.0,
-            "torque": 40.5,
-            "desgaste_da_ferramenta": 120.0,
-            "tipo": "L",
-            "fdf_falha_desgaste_ferramenta": 0,
-            "fdc_falha_dissipacao_calor": 0,
-            "fp_falha_potencia": 0,
-            "fte_falha_tensao_excessiva": 0,
-            "fa_falha_aleatoria": 0
-        },
-        {
-            "temperatura_ar": 304.0,
-            "temperatura_processo": 313.0,
-            "umidade_relativa": 90.0,
-            "velocidade_rotacional": 1200.0,
-            "torque": 70.0,
-            "desgaste_da_ferramenta": 250.0,
-            "tipo": "H",
-            "fdf_falha_desgaste_ferramenta": 1,
-            "fdc_falha_dissipacao_calor": 1,
-            "fp_falha_potencia": 0,
-            "fte_falha_tensao_excessiva": 1,
-            "fa_falha_aleatoria": 0
-        }
-    ]
-
-    response = requests.post(f"{BASE_URL}/predict_batch", json=data_list)
-    print("Predição em lote:", response.json())
 
-if __name__ == "__main__":
-    print("Testando API de Predição de Falhas...")
-    print("=" * 50)
+async def carregar_endpoint(cliente, endpoint, corpos, concorrencia, linhas_por_requisicao):
+    """Envia os corpos com `concorrencia` requisições em voo e mede cada uma"""
+    latencias = []
+    status = {}
+    erros = 0
+    proximo = iter(corpos)
+
+    async def trabalhador():
+        nonlocal erros
+        for corpo in proximo:
+            inicio = time.perf_counter()
+            try:
+                resposta = await cliente.post(f"/{endpoint}", content=corpo,
+                                              headers={"content-type": "application/json"})
+            except httpx.HTTPError:
+                erros += 1
+                continue
+            duracao = time.perf_counter() - inicio
+            status[resposta.status_code] = status.get(resposta.status_code, 0) + 1
+            if resposta.status_code == 200:
+                latencias.append(duracao)
+            else:
+                erros += 1
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*[trabalhador() for _ in range(concorrencia)])
+    duracao = time.perf_counter() - inicio
 
+    sucesso = len(latencias)
+    return {
+        "requisicoes": len(corpos),
+        "sucesso": sucesso,
+        "erros": erros,
+        "status": {str(codigo): total for codigo, total in sorted(status.items())},
+        "linhas_por_requisicao": linhas_por_requisicao,
+        "duracao_s": duracao,
+        "requisicoes_por_s": sucesso / duracao if duracao else 0.0,
+        "linhas_por_s": sucesso * linhas_por_requisicao / duracao if duracao else 0.0,
+        "latencia_ms": percentis(latencias),
+    }
+
+
+async def aguardar_pronto(cliente, limite_s=120):
+    """Espera o /ready (o modelo carrega em segundo plano no lifespan)"""
+    fim = time.monotonic() + limite_s
+    while time.monotonic() < fim:
+        try:
+            if (await cliente.get("/ready")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError("A API não ficou pronta a tempo")
+
+
+def commit_atual():
     try:
-        test_health()
-        print()
-        test_single_prediction()
-        print()
-        test_batch_prediction()
-    except requests.exceptions.ConnectionError:
-        print("Erro: Não foi possível conectar à API. Certifique-se de que ela está rodando.")
-    except Exception as e:
-        print(f"Erro durante os testes: {e}")
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def executar_carga(cliente, args):
+    await aguardar_pronto(cliente)
+    modelos = await cliente.get("/models")
+    versao = modelos.json().get("atual", {}).get("versao") if modelos.status_code == 200 else None
+
+    gerador = GeradorLeituras(args.csv, semente=args.semente)
+    resultados = {}
+    for endpoint in args.endpoints:
+        linhas = 1 if endpoint == 'predict' else args.tamanho_lote
+        aquecimento = montar_requisicoes(gerador, endpoint, args.aquecimento, args.tamanho_lote)
+        corpos = montar_requisicoes(gerador, endpoint, args.requisicoes, args.tamanho_lote)
+        await carregar_endpoint(cliente, endpoint, aquecimento, args.concorrencia, linhas)
+        resultados[endpoint] = await carregar_endpoint(cliente, endpoint, corpos, args.concorrencia, linhas)
+        print(f"{endpoint}: {resultados[endpoint]['requisicoes_por_s']:.1f} req/s, "
+              f"p50 {resultados[endpoint]['latencia_ms'].get('p50', float('nan')):.2f} ms, "
+              f"p99 {resultados[endpoint]['latencia_ms'].get('p99', float('nan')):.2f} ms, "
+              f"{resultados[endpoint]['erros']} erros", file=sys.stderr)
+
+    return {
+        "inicio": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "alvo": args.url or "em_processo",
+        "commit": commit_atual(),
+        "versao_modelo": versao,
+        "configuracao": {
+            "concorrencia": args.concorrencia,
+            "requisicoes": args.requisicoes,
+            "aquecimento": args.aquecimento,
+            "tamanho_lote": args.tamanho_lote,
+            "semente": args.semente,
+        },
+        "ambiente": {
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "variaveis": {chave: valor for chave, valor in sorted(os.environ.items())
+                          if chave.startswith(('INFERENCIA_', 'MICROBATCH_', 'CACHE_', 'CASCATA_', 'METRICAS_'))},
+        },
+        "endpoints": resultados,
+    }
+
+
+async def main(args):
+    if args.url:
+        limites = httpx.Limits(max_connections=args.concorrencia)
+        async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limites) as cliente:
+            return await executar_carga(cliente, args)
+
+    # Em processo: o lifespan do app (carga do modelo, executor, micro-batcher) roda aqui
+    import main as api
+    async with api.app.router.lifespan_context(api.app):
+        transporte = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transporte, base_url="http://api", timeout=args.timeout) as cliente:
+            return await executar_carga(cliente, args)
+
+
+def ler_argumentos(argv=None):
+    parser = argparse.ArgumentParser(description="Teste de carga da API de predição de falhas")
+    parser.add_argument('--url', help="URL de uma API já rodando; sem ela a API roda no próprio processo")
+    parser.add_argument('--endpoints', default=",".join(ENDPOINTS),
+                        type=lambda valor: [e for e in valor.split(",") if e],
+                        help=f"Endpoints separados por vírgula (padrão: {','.join(ENDPOINTS)})")
+    parser.add_argument('--concorrencia', type=int, default=16, help="Requisições simultâneas (padrão: 16)")
+    parser.add_argument('--requisicoes', type=int, default=500, help="Requisições medidas por endpoint (padrão: 500)")
+    parser.add_argument('--aquecimento', type=int, default=50, help="Requisições descartadas antes da medição (padrão: 50)")
+    parser.add_argument('--tamanho-lote', type=int, default=100, help="Linhas por requisição nos endpoints de lote (padrão: 100)")
+    parser.add_argument('--semente', type=int, default=42, help="Semente das leituras sintéticas (padrão: 42)")
+    parser.add_argument('--csv', default=CSV_PADRAO, help="Dataset de onde vêm as distribuições")
+    parser.add_argument('--timeout', type=float, default=30.0, help="Timeout por requisição em segundos")
+    parser.add_argument('--saida', help="Arquivo do relatório JSON (padrão: stdout)")
+    args = parser.parse_args(argv)
+    invalidos = [e for e in args.endpoints if e not in ENDPOINTS]
+    if invalidos:
+        parser.error(f"Endpoints inválidos: {invalidos}")
+    return args
+
+
+if __name__ == "__main__":
+    args = ler_argumentos()
+    relatorio = asyncio.run(main(args))
+    texto = json.dumps(relatorio, indent=2, ensure_ascii=False)
+    if args.saida:
+        with open(args.saida, 'w') as f:
+            f.write(texto + "\n")
+        print(f"Relatório salvo em {args.saida}", file=sys.stderr)
+    else:
+        print(texto)
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+from cache_predicoes import RESOLUCOES_PADRAO, CachePredicoes, ler_resolucoes
+
+COLUNAS = list(RESOLUCOES_PADRAO)
+
+
+def linha(**valores):
+    base = {'temperatura_ar': 298.1, 'temperatura_processo': 308.6, 'umidade_relativa': 90.0,
+            'velocidade_rotacional': 1551.0, 'torque': 42.8, 'desgaste_da_ferramenta': 10.0}
+    base.update(valores)
+    return np.array([[base.get(col, 0.0) for col in COLUNAS]])
+
+
+def test_resolucao_por_feature():
+    cache = CachePredicoes(resolucao=ler_resolucoes(COLUNAS))
+    chave = cache.chaves(linha())[0]
+    # Meio rpm e meio minuto ficam na mesma chave; meio kelvin não
+    assert cache.chaves(linha(velocidade_rotacional=1551.4, desgaste_da_ferramenta=10.3))[0] == chave
+    assert cache.chaves(linha(temperatura_ar=298.6))[0] != chave
+
+
+def test_ler_resolucoes_global_e_ajustes():
+    assert ler_resolucoes(COLUNAS, 0.5) == [0.5] * len(COLUNAS)
+    resolucoes = ler_resolucoes(COLUNAS, por_coluna="torque=2, velocidade_rotacional=10")
+    assert resolucoes[COLUNAS.index('torque')] == 2.0
+    assert resolucoes[COLUNAS.index('velocidade_rotacional')] == 10.0
+    with pytest.raises(ValueError):
+        ler_resolucoes(COLUNAS, por_coluna="pressao=1")
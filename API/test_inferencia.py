@@ -0,0 +1,25 @@
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier, StackingClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.preprocessing import StandardScaler
+
+
+def test_stacking_com_passthrough_atras_do_modelo_por_tamanho(diretorio_api):
+    from inferencia import ModeloPorTamanho, prever_com_modelo
+
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(200, 4))
+    y = X[:, 0] + X[:, 1] > 0
+    scaler = StandardScaler().fit(X)
+    stacking = StackingClassifier(
+        estimators=[('rf', RandomForestClassifier(n_estimators=5, random_state=0))],
+        final_estimator=LogisticRegression(), passthrough=True,
+    ).fit(scaler.transform(X), y)
+    # max_lote=0 faz todo lote ir para o scikit-learn
+    modelo = ModeloPorTamanho(None, stacking, max_lote=0)
+
+    _, probabilidades, tempos, _ = prever_com_modelo(modelo, scaler, X, medir=True)
+
+    esperadas = stacking.predict_proba(scaler.transform(X))[:, 1]
+    np.testing.assert_allclose(probabilidades, esperadas)
+    assert 'meta' in tempos
@@ -0,0 +1,59 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from microbatch import FilaMicroBatchCheia, MicroBatcher
+
+
+def test_fila_cheia_recusa_na_hora():
+    async def cenario():
+        liberar = asyncio.Event()
+
+        async def funcao_lote(features):
+            await liberar.wait()
+            return np.zeros(len(features)), np.full(len(features), 0.5), "v1"
+
+        batcher = MicroBatcher(funcao_lote, max_tamanho=1, max_espera=0, max_fila=2, max_lotes_simultaneos=1)
+        batcher.iniciar()
+        try:
+            # Uma no modelo e duas na fila; a seguinte é recusada
+            chamadas = [asyncio.create_task(batcher.submeter(np.zeros((1, 12))))]
+            await asyncio.sleep(0.01)
+            chamadas += [asyncio.create_task(batcher.submeter(np.zeros((1, 12)))) for _ in range(2)]
+            await asyncio.sleep(0.01)
+            with pytest.raises(FilaMicroBatchCheia):
+                await batcher.submeter(np.zeros((1, 12)))
+            liberar.set()
+            resultados = await asyncio.gather(*chamadas)
+        finally:
+            await batcher.parar()
+        return batcher, resultados
+
+    batcher, resultados = asyncio.run(cenario())
+    assert [r[2] for r in resultados] == ["v1"] * 3
+    assert batcher.recusadas == 1
+
+
+def test_lotes_simultaneos():
+    async def cenario():
+        rodando = 0
+        maximo = 0
+
+        async def funcao_lote(features):
+            nonlocal rodando, maximo
+            rodando += 1
+            maximo = max(maximo, rodando)
+            await asyncio.sleep(0.02)
+            rodando -= 1
+            return np.zeros(len(features)), np.zeros(len(features))
+
+        batcher = MicroBatcher(funcao_lote, max_tamanho=1, max_espera=0, max_lotes_simultaneos=2)
+        batcher.iniciar()
+        try:
+            await asyncio.gather(*(batcher.submeter(np.zeros((1, 12))) for _ in range(6)))
+        finally:
+            await batcher.parar()
+        return maximo
+
+    assert asyncio.run(cenario()) == 2
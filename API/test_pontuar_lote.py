@@ -0,0 +1,37 @@
+import glob
+import os
+
+import pandas as pd
+import pytest
+
+CSV_TREINO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '2. Base de dados', 'bootcamp_train.csv')
+FTE = 'FTE (Falha Tensao Excessiva)'
+
+
+@pytest.fixture
+def csv_sujo(tmp_path):
+    """20 linhas do treino com FTE em branco na linha 3 e texto no torque da linha 7"""
+    bloco = pd.read_csv(CSV_TREINO, nrows=20)
+    bloco[FTE] = bloco[FTE].astype(object)
+    bloco.loc[3, FTE] = None
+    bloco['torque'] = bloco['torque'].astype(object)
+    bloco.loc[7, 'torque'] = 'erro de leitura'
+    caminho = tmp_path / "entrada.csv"
+    bloco.to_csv(caminho, index=False)
+    return str(caminho)
+
+
+def test_linha_suja_fica_invalida_sem_interromper_o_bloco(diretorio_api, csv_sujo, tmp_path):
+    from pontuar_lote import pontuar_arquivo
+
+    saida = str(tmp_path / "saida")
+    resumo = pontuar_arquivo(csv_sujo, saida, tamanho_bloco=8, workers=1)
+
+    assert resumo["linhas_pontuadas"] == 20
+    assert resumo["linhas_invalidas"] == 2
+    resultado = pd.concat(pd.read_parquet(p) for p in sorted(glob.glob(os.path.join(saida, "parte-*.parquet"))))
+    resultado = resultado.set_index('linha')
+    assert not resultado.loc[3, 'valida'] and not resultado.loc[7, 'valida']
+    assert resultado.loc[[3, 7], 'probabilidade_falha'].isna().all()
+    assert resultado.drop(index=[3, 7])['valida'].all()
+    assert resultado.drop(index=[3, 7])['probabilidade_falha'].notna().all()
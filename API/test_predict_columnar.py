@@ -0,0 +1,29 @@
+import pytest
+
+COLUNAS = {
+    'temperatura_ar': [298.1],
+    'temperatura_processo': [308.6],
+    'umidade_relativa': [90.0],
+    'velocidade_rotacional': [1551.0],
+    'torque': [42.8],
+    'desgaste_da_ferramenta': [0.0],
+}
+
+
+def test_colunar_valido(cliente):
+    resposta = cliente.post("/predict_columnar", json={**COLUNAS, 'tipo': ['M']})
+    assert resposta.status_code == 200
+    assert len(resposta.json()["predictions"]) == 1
+
+
+@pytest.mark.parametrize("tipo", [[None], [1], ['L', None]])
+def test_colunar_tipo_nao_texto_responde_400(cliente, tipo):
+    colunas = {nome: valores * len(tipo) for nome, valores in COLUNAS.items()}
+    resposta = cliente.post("/predict_columnar", json={**colunas, 'tipo': tipo})
+    assert resposta.status_code == 400
+    assert "Tipo deve ser" in resposta.json()["detail"]
+
+
+def test_colunar_tipo_desconhecido_responde_400(cliente):
+    resposta = cliente.post("/predict_columnar", json={**COLUNAS, 'tipo': ['X']})
+    assert resposta.status_code == 400
@@ -0,0 +1,61 @@
+import json
+
+REGISTRO = {
+    'temperatura_ar': 298.1,
+    'temperatura_processo': 308.6,
+    'velocidade_rotacional': 1551.0,
+    'torque': 42.8,
+    'desgaste_da_ferramenta': 0.0,
+    'tipo': 'M',
+}
+
+
+def enviar_stream(cliente, linhas):
+    corpo = "\n".join(linha if isinstance(linha, str) else json.dumps(linha) for linha in linhas) + "\n"
+    resposta = cliente.post("/predict_stream", content=corpo.encode(),
+                            headers={"content-type": "application/x-ndjson"})
+    assert resposta.status_code == 200
+    return [json.loads(linha) for linha in resposta.text.splitlines()]
+
+
+def test_registros_invalidos_nao_derrubam_o_lote_nem_o_stream(cliente, api, monkeypatch):
+    monkeypatch.setattr(api, "STREAM_TAMANHO_LOTE", 4)
+    linhas = [
+        REGISTRO,
+        '{"temperatura_ar": 298.1,',
+        REGISTRO,
+        {**REGISTRO, 'tipo': 'X'},
+        {k: v for k, v in REGISTRO.items() if k != 'torque'},
+        [1, 2],
+        REGISTRO,
+    ]
+    saida = enviar_stream(cliente, linhas)
+
+    assert len(saida) == len(linhas)
+    erros = {linha["linha"] for linha in saida if "erro" in linha}
+    assert erros == {1, 3, 4, 5}
+    for i in (0, 2, 6):
+        assert "probabilidade_falha" in saida[i]
+
+
+def test_linha_grande_demais_so_afeta_a_propria_linha(cliente, api, monkeypatch):
+    monkeypatch.setattr(api, "STREAM_MAX_BYTES_LINHA", 512)
+    saida = enviar_stream(cliente, [REGISTRO, {**REGISTRO, 'id_produto': "M" * 2048}, REGISTRO])
+
+    assert len(saida) == 3
+    assert saida[1] == {"erro": "Linha maior que 512 bytes", "linha": 1}
+    assert "probabilidade_falha" in saida[0] and "probabilidade_falha" in saida[2]
+
+
+def test_leituras_com_id_produto_entram_no_estado(cliente, api, monkeypatch):
+    from estado_maquinas import EstadoMaquinas
+    monkeypatch.setattr(api, "estado_maquinas", EstadoMaquinas(janela=4, max_maquinas=8))
+    saida = enviar_stream(cliente, [
+        {**REGISTRO, 'id_produto': 'M1', 'desgaste_da_ferramenta': 10.0},
+        REGISTRO,
+        {**REGISTRO, 'id_produto': 'M1', 'desgaste_da_ferramenta': 13.0},
+    ])
+
+    assert "tendencia" not in saida[1]
+    assert saida[2]["tendencia"]["desgaste_da_ferramenta"]["delta"] == 3.0
+    assert api.estado_maquinas.descrever('M1')["leituras"] == 2
@@ -0,0 +1,18 @@
+import numpy as np
+
+
+def test_sem_latencia_do_principal_conta_so_a_discordancia(diretorio_api):
+    from sombra import AvaliadorSombra
+
+    avaliador = AvaliadorSombra(lambda features: None, "v-teste")
+    predicoes = np.array([True, False])
+    probabilidades = np.array([0.9, 0.1])
+    avaliador._registrar(predicoes, probabilidades, np.array([True, True]), np.array([0.8, 0.6]), 0.004, 0.006)
+    # Lote com linhas do cache: a duração do principal não cobre o lote inteiro
+    avaliador._registrar(predicoes, probabilidades, predicoes, probabilidades, None, 0.5)
+
+    metricas = avaliador.metricas()
+    assert metricas["avaliadas"] == 2 and metricas["linhas_discordantes"] == 1
+    assert metricas["avaliadas_com_latencia"] == 1
+    assert np.isclose(metricas["latencia_media_principal_ms"], 4.0)
+    assert np.isclose(metricas["diferenca_latencia_ms"]["p50"], 2.0)
@@ -0,0 +1,120 @@
+import io
+import os
+import time
+
+import pandas as pd
+import pytest
+
+CSV_TREINO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '2. Base de dados', 'bootcamp_train.csv')
+FTE = 'FTE (Falha Tensao Excessiva)'
+
+
+def esperar_tarefa(cliente, id_tarefa, timeout=60):
+    limite = time.monotonic() + timeout
+    while True:
+        tarefa = cliente.get(f"/jobs/{id_tarefa}").json()
+        if tarefa["status"] not in ("na_fila", "executando"):
+            return tarefa
+        assert time.monotonic() < limite, "Tarefa não terminou"
+        time.sleep(0.05)
+
+
+@pytest.mark.parametrize("saida", ["parquet", "csv"])
+def test_linha_suja_nao_derruba_a_tarefa(cliente, api, monkeypatch, saida):
+    monkeypatch.setattr(api.gerenciador_tarefas, "tamanho_bloco", 8)
+    bloco = pd.read_csv(CSV_TREINO, nrows=20)
+    bloco[FTE] = bloco[FTE].astype(object)
+    bloco.loc[5, FTE] = 'talvez'
+    # Upload truncado: a última linha termina no meio
+    conteudo = bloco.to_csv(index=False).encode()
+    conteudo = conteudo[:conteudo.rindex(b",", 0, len(conteudo) - 40)]
+
+    resposta = cliente.post(f"/jobs?saida={saida}", files={"arquivo": ("frota.csv", conteudo, "text/csv")})
+    assert resposta.status_code == 202
+    tarefa = esperar_tarefa(cliente, resposta.json()["id"])
+
+    assert tarefa["status"] == "concluida", tarefa.get("erro")
+    assert tarefa["linhas_processadas"] == 20
+    baixado = cliente.get(tarefa["resultado_url"])
+    assert baixado.status_code == 200
+    if saida == "parquet":
+        resultado = pd.read_parquet(io.BytesIO(baixado.content))
+    else:
+        resultado = pd.read_csv(io.BytesIO(baixado.content))
+    resultado = resultado.set_index('linha')
+    assert not resultado.loc[5, 'valida']
+    assert pd.isna(resultado.loc[5, 'probabilidade_falha'])
+    assert not resultado.loc[19, 'valida']
+    assert resultado.drop(index=[5, 19])['valida'].all()
+
+
+def test_csv_com_quebra_de_linha_entre_aspas(cliente):
+    bloco = pd.read_csv(CSV_TREINO, nrows=20)
+    bloco['id_produto'] = bloco['id_produto'].astype(str)
+    bloco.loc[3, 'id_produto'] = 'L\n56434'
+    conteudo = bloco.to_csv(index=False).encode()
+
+    resposta = cliente.post("/jobs?saida=csv", files={"arquivo": ("frota.csv", conteudo, "text/csv")})
+    assert resposta.status_code == 202
+    tarefa = esperar_tarefa(cliente, resposta.json()["id"])
+
+    assert tarefa["status"] == "concluida", tarefa.get("erro")
+    assert tarefa["linhas_total"] == tarefa["linhas_processadas"] == 20
+
+
+def test_outro_worker_consulta_e_cancela_pelo_disco(cliente, api):
+    from tarefas import GerenciadorTarefas
+    conteudo = pd.read_csv(CSV_TREINO, nrows=20).to_csv(index=False).encode()
+    id_tarefa = cliente.post("/jobs", files={"arquivo": ("frota.csv", conteudo, "text/csv")}).json()["id"]
+    esperar_tarefa(cliente, id_tarefa)
+
+    # Outro processo do gunicorn: mesmo diretório, nenhuma tarefa em memória
+    outro = GerenciadorTarefas(api.gerenciador_tarefas.diretorio, None, None)
+    assert outro.buscar(id_tarefa).status == "concluida"
+    assert id_tarefa in [tarefa.id for tarefa in outro.listar()]
+
+    outro.remover(id_tarefa)
+    assert cliente.get(f"/jobs/{id_tarefa}").status_code == 404
+
+
+def test_tarefa_sem_dono_aparece_com_erro(api):
+    from tarefas import TarefaPontuacao
+    diretorio = os.path.join(api.gerenciador_tarefas.diretorio, "0123456789ab")
+    os.makedirs(diretorio)
+    tarefa = TarefaPontuacao("0123456789ab", diretorio, "frota.csv", "csv", "parquet", 100, None)
+    tarefa.status = "executando"
+    tarefa.salvar()
+
+    assert api.gerenciador_tarefas.buscar("0123456789ab").status == "erro"
+
+
+def test_upload_grande_demais_recusado_antes_de_ler_o_corpo(diretorio_api):
+    from fastapi import FastAPI, File, UploadFile
+    from fastapi.testclient import TestClient
+    from tarefas import MiddlewareLimiteUpload
+
+    app = FastAPI()
+    app.add_middleware(MiddlewareLimiteUpload, max_bytes=1000, rotas={"/jobs"})
+    recebidos = []
+
+    @app.post("/jobs")
+    async def receber(arquivo: UploadFile = File(...)):
+        recebidos.append(arquivo.filename)
+        return {}
+
+    with TestClient(app) as cliente:
+        resposta = cliente.post("/jobs", files={"arquivo": ("frota.csv", b"x" * 5000, "text/csv")})
+        assert resposta.status_code == 413
+
+        # Sem Content-Length (chunked): recusado pela contagem dos bytes recebidos
+        def corpo():
+            yield b'--limite\r\nContent-Disposition: form-data; name="arquivo"; filename="frota.csv"\r\n\r\n'
+            for _ in range(10):
+                yield b"x" * 500
+            yield b"\r\n--limite--\r\n"
+        resposta = cliente.post("/jobs", content=corpo(),
+                                headers={"content-type": "multipart/form-data; boundary=limite"})
+        assert resposta.status_code == 413
+
+        assert cliente.post("/jobs", files={"arquivo": ("frota.csv", b"x" * 100, "text/csv")}).status_code == 200
+    assert recebidos == ["frota.csv"]
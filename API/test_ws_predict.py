@@ -0,0 +1,72 @@
+import json
+import threading
+
+REGISTRO = {
+    'temperatura_ar': 298.1,
+    'temperatura_processo': 308.6,
+    'velocidade_rotacional': 1551.0,
+    'torque': 42.8,
+    'desgaste_da_ferramenta': 0.0,
+    'tipo': 'M',
+}
+
+
+def sem_travar(funcao, timeout=30):
+    """Roda funcao em uma thread e falha se ela não terminar em timeout segundos"""
+    erros = []
+
+    def alvo():
+        try:
+            funcao()
+        except BaseException as e:
+            erros.append(e)
+
+    thread = threading.Thread(target=alvo, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "Conexão WebSocket travou"
+    if erros:
+        raise erros[0]
+
+
+def test_frame_binario_recebe_erro_e_conexao_fecha(cliente):
+    respostas = []
+
+    def conversar():
+        with cliente.websocket_connect("/ws/predict") as ws:
+            ws.send_bytes(b"\x00\x01")
+            ws.send_text(json.dumps({**REGISTRO, 'id': 'a'}))
+            respostas.append(json.loads(ws.receive_text()))
+            respostas.append(json.loads(ws.receive_text()))
+
+    sem_travar(conversar)
+    assert "erro" in respostas[0]
+    assert respostas[1]["id"] == "a" and "probabilidade_falha" in respostas[1]
+
+
+def test_frame_malformado_seguido_de_desconexao(cliente):
+    respostas = []
+
+    def conversar():
+        with cliente.websocket_connect("/ws/predict") as ws:
+            ws.send_text('{"temperatura_ar": ')
+            respostas.append(json.loads(ws.receive_text()))
+
+    sem_travar(conversar)
+    assert "erro" in respostas[0]
+
+
+def test_leituras_com_id_produto_entram_no_estado(cliente, api, monkeypatch):
+    from estado_maquinas import EstadoMaquinas
+    monkeypatch.setattr(api, "estado_maquinas", EstadoMaquinas(janela=4, max_maquinas=8))
+    respostas = []
+
+    def conversar():
+        with cliente.websocket_connect("/ws/predict") as ws:
+            for desgaste in (10.0, 12.0):
+                ws.send_text(json.dumps({**REGISTRO, 'id_produto': 'W1', 'desgaste_da_ferramenta': desgaste}))
+                respostas.append(json.loads(ws.receive_text()))
+
+    sem_travar(conversar)
+    assert respostas[1]["tendencia"]["desgaste_da_ferramenta"]["delta"] == 2.0
+    assert api.estado_maquinas.descrever('W1')["leituras"] == 2
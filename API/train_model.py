@@ -2,13 +2,75 @@ import pandas as pd
 import numpy as np
 from sklearn.model_selection import train_test_split, cross_val_score
 from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier, StackingClassifier
+from sklearn.kernel_approximation import Nystroem, RBFSampler
 from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import make_pipeline
 from sklearn.svm import SVC
+from sklearn.tree import DecisionTreeClassifier
 from sklearn.preprocessing import LabelEncoder, StandardScaler
-from sklearn.metrics import classification_report, confusion_matrix, accuracy_score
+from sklearn.metrics import classification_report, confusion_matrix, accuracy_score, recall_score
 import joblib
+import os
+import time
 import warnings
-warnings.filterwarnings('ignore')
+
+from registro_modelos import RegistroModelos
+
+
+# Colunas do dataset usadas pelo modelo, na ordem das features
+feature_cols = ['temperatura_ar', 'temperatura_processo', 'umidade_relativa',
+               'velocidade_rotacional', 'torque', 'desgaste_da_ferramenta', 'tipo_encoded',
+               'FDF (Falha Desgaste Ferramenta)', 'FDC (Falha Dissipacao Calor)',
+               'FP (Falha Potencia)', 'FTE (Falha Tensao Excessiva)', 'FA (Falha Aleatoria)']
+
+# Features numéricas com valores especiais que indicam leitura ausente
+numeric_cols = ['temperatura_ar', 'temperatura_processo', 'velocidade_rotacional',
+               'torque', 'desgaste_da_ferramenta']
+valores_especiais = [-36, -38, -161, -202]
+
+falha_cols = ['FDF (Falha Desgaste Ferramenta)', 'FDC (Falha Dissipacao Calor)',
+              'FP (Falha Potencia)', 'FA (Falha Aleatoria)']
+
+def tratar_numericas(data, medianas=None):
+    """
+    Troca os valores especiais por NaN e preenche com a mediana de cada coluna
+    (do próprio data ou as medianas informadas, como as do treino). Altera data
+    e devolve as medianas usadas.
+    """
+    medianas = dict(medianas) if medianas is not None else {}
+    for col in numeric_cols:
+        # Substituir valores especiais por NaN
+        data[col] = data[col].replace(valores_especiais, np.nan)
+        # Preencher com mediana
+        if col not in medianas:
+            medianas[col] = data[col].median()
+        data[col] = data[col].fillna(medianas[col])
+    return medianas
+
+def converter_fte(serie):
+    """FTE para 0 ou 1 (true/false, em bool ou texto, ou 0/1); vazio e outros valores viram NaN"""
+    valores = serie.astype(str).str.lower().map({'true': 1, 'false': 0})
+    valores = valores.fillna(pd.to_numeric(serie, errors='coerce')).astype(float)
+    return valores.where(valores.isin([0, 1]))
+
+def padronizar_falhas(data, fte_inteiro=True):
+    """
+    Converte as colunas de falha (true/false, sim/não, 0/1, -) para 0 ou 1; altera data.
+    Com fte_inteiro=False, FTE que não é booleano vira NaN em vez de interromper a
+    conversão, para a linha ser marcada como inválida na pontuação.
+    """
+    for col in falha_cols:
+        data[col] = data[col].astype(str).str.lower()
+        data[col] = data[col].map({
+            'true': 1, 'false': 0, 'sim': 1, 'não': 0, 'nao': 0,
+            'n': 0, '0': 0, '1': 1, '-': 0
+        }).fillna(0).astype(int)
+
+    if fte_inteiro:
+        # Converter FTE para int
+        data['FTE (Falha Tensao Excessiva)'] = data['FTE (Falha Tensao Excessiva)'].astype(int)
+    else:
+        data['FTE (Falha Tensao Excessiva)'] = converter_fte(data['FTE (Falha Tensao Excessiva)'])
 
 def preprocess_data(df):
     """Preprocessa os dados do dataset"""
@@ -22,37 +84,123 @@ def preprocess_data(df):
     data['falha_maquina'] = data['falha_maquina'].map(falha_mapping)
 
     # Tratar valores especiais nas features numéricas
-    numeric_cols = ['temperatura_ar', 'temperatura_processo', 'velocidade_rotacional', 
-                   'torque', 'desgaste_da_ferramenta']
-
-    for col in numeric_cols:
-        # Substituir valores especiais por NaN
-        data[col] = data[col].replace([-36, -38, -161, -202], np.nan)
-        # Preencher com mediana
-        data[col] = data[col].fillna(data[col].median())
+    tratar_numericas(data)
 
     # Codificar variável categórica 'tipo'
     le_tipo = LabelEncoder()
     data['tipo_encoded'] = le_tipo.fit_transform(data['tipo'])
 
     # Padronizar colunas de falha
-    falha_cols = ['FDF (Falha Desgaste Ferramenta)', 'FDC (Falha Dissipacao Calor)', 
-                  'FP (Falha Potencia)', 'FA (Falha Aleatoria)']
+    padronizar_falhas(data)
 
-    for col in falha_cols:
-        data[col] = data[col].astype(str).str.lower()
-        data[col] = data[col].map({
-            'true': 1, 'false': 0, 'sim': 1, 'não': 0, 'nao': 0, 
-            'n': 0, '0': 0, '1': 1, '-': 0
-        }).fillna(0).astype(int)
+    return data, le_tipo
 
-    # Converter FTE para int
-    data['FTE (Falha Tensao Excessiva)'] = data['FTE (Falha Tensao Excessiva)'].astype(int)
+def criar_membro_svm(tipo='exato', gamma='scale', n_componentes=500):
+    """
+    Membro SVM do stacking. 'exato' é o SVC com kernel RBF; 'nystroem' e 'rff'
+    aproximam o mesmo kernel com n_componentes features explícitas (Nystroem ou
+    random Fourier features) seguidas de uma LogisticRegression, o que torna o
+    treino linear no número de amostras e a inferência independente do número
+    de vetores de suporte. gamma precisa ser numérico nas aproximações.
+    """
+    if tipo == 'exato':
+        return SVC(probability=True, random_state=42, class_weight='balanced')
+    if tipo == 'nystroem':
+        mapa = Nystroem(kernel='rbf', gamma=gamma, n_components=n_componentes, random_state=42)
+    elif tipo == 'rff':
+        mapa = RBFSampler(gamma=gamma, n_components=n_componentes, random_state=42)
+    else:
+        raise ValueError(f"Tipo de membro SVM desconhecido: {tipo}")
+    return make_pipeline(mapa, LogisticRegression(class_weight='balanced', max_iter=1000, random_state=42))
 
-    return data, le_tipo
+def gamma_scale(X):
+    """Mesmo gamma que o SVC usa com gamma='scale'"""
+    return 1.0 / (X.shape[1] * np.asarray(X).var())
+
+def comparar_membros_svm(X_train_scaled, y_train, X_test_scaled, y_test, n_componentes=500):
+    """
+    Compara o SVC exato com as aproximações do kernel: tempo de treino, latência
+    de predict_proba (lote de teste e linha única), recall da classe de falha e a
+    diferença de recall em relação ao SVC exato.
+    """
+    gamma = gamma_scale(X_train_scaled)
+    resultados = {}
+    for tipo in ('exato', 'nystroem', 'rff'):
+        membro = criar_membro_svm(tipo, gamma if tipo != 'exato' else 'scale', n_componentes)
+        inicio = time.perf_counter()
+        membro.fit(X_train_scaled, y_train)
+        tempo_treino = time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        prob = membro.predict_proba(X_test_scaled)[:, 1]
+        latencia_lote = time.perf_counter() - inicio
+
+        linha = X_test_scaled[:1]
+        inicio = time.perf_counter()
+        for _ in range(100):
+            membro.predict_proba(linha)
+        latencia_linha = (time.perf_counter() - inicio) / 100
+
+        resultados[tipo] = {
+            'treino_s': tempo_treino,
+            'lote_ms': latencia_lote * 1000,
+            'linha_ms': latencia_linha * 1000,
+            'recall': recall_score(y_test, prob > 0.5),
+            'tamanho': len(membro.support_vectors_) if tipo == 'exato' else n_componentes,
+        }
 
-def train_stacking_model(csv_file='bootcamp_train.csv'):
-    """Treina o modelo Stacking Ensemble"""
+    print(f"\nMembro SVM: exato x aproximações do kernel RBF ({len(X_test_scaled)} linhas de teste):")
+    print(f"{'tipo':<10}{'treino (s)':>12}{'lote (ms)':>12}{'linha (ms)':>12}{'recall':>9}{'Δ recall':>10}{'vetores':>9}")
+    for tipo, r in resultados.items():
+        delta = r['recall'] - resultados['exato']['recall']
+        print(f"{tipo:<10}{r['treino_s']:>12.2f}{r['lote_ms']:>12.2f}{r['linha_ms']:>12.3f}"
+              f"{r['recall']:>9.4f}{delta:>+10.4f}{r['tamanho']:>9}")
+    return resultados
+
+def train_primeiro_estagio(stacking_model, X_train_scaled, X_test_scaled, banda=(0.01, 0.99)):
+    """
+    Treina o primeiro estágio da cascata da API: uma árvore rasa que imita as
+    predições do stacking (destilação). Linhas com probabilidade dentro da banda
+    são escaladas para o stacking; a taxa de escalonamento e a concordância com
+    o stacking são medidas no conjunto de teste.
+    """
+    arvore = DecisionTreeClassifier(max_depth=8, min_samples_leaf=10, random_state=42)
+    arvore.fit(X_train_scaled, stacking_model.predict(X_train_scaled))
+
+    prob_primeiro = arvore.predict_proba(X_test_scaled)[:, 1]
+    escalar = (prob_primeiro >= banda[0]) & (prob_primeiro <= banda[1])
+    pred_stacking = stacking_model.predict(X_test_scaled)
+    pred_cascata = np.where(escalar, pred_stacking, prob_primeiro > 0.5)
+
+    print(f"\nPrimeiro estágio da cascata (banda {banda[0]} a {banda[1]}):")
+    print(f"- taxa de escalonamento: {escalar.mean():.4f}")
+    print(f"- concordância com o stacking: {(pred_cascata == pred_stacking).mean():.4f}")
+    print(f"- concordância do primeiro estágio sozinho: {((prob_primeiro > 0.5) == pred_stacking).mean():.4f}")
+    return arvore
+
+def retreinar_primeiro_estagio(csv_file='bootcamp_train.csv', caminho_modelo='stacking_model.pkl',
+                               caminho_scaler='scaler.pkl', destino='primeiro_estagio.pkl'):
+    """
+    Treina de novo só o primeiro estágio da cascata a partir do stacking e do
+    scaler já salvos, com a mesma divisão treino/teste de train_stacking_model
+    """
+    df = pd.read_csv(csv_file)
+    data_processed, _ = preprocess_data(df)
+    X_train, X_test = train_test_split(data_processed[feature_cols], data_processed['falha_maquina'],
+                                       test_size=0.2, random_state=42, stratify=data_processed['falha_maquina'])[:2]
+    stacking_model = joblib.load(caminho_modelo)
+    scaler = joblib.load(caminho_scaler)
+    primeiro_estagio = train_primeiro_estagio(stacking_model, scaler.transform(X_train), scaler.transform(X_test))
+    joblib.dump(primeiro_estagio, destino)
+    print(f"- {destino}")
+    return primeiro_estagio
+
+def train_stacking_model(csv_file='bootcamp_train.csv', diretorio_registro=None, svm='exato', comparar_svm=False):
+    """
+    Treina o modelo Stacking Ensemble; com diretorio_registro publica também uma
+    nova versão no registro. svm escolhe o membro SVM (ver criar_membro_svm) e
+    comparar_svm imprime antes a comparação entre o SVC exato e as aproximações.
+    """
     print("Carregando dataset...")
     df = pd.read_csv(csv_file)
 
@@ -60,11 +208,6 @@ def train_stacking_model(csv_file='bootcamp_train.csv'):
     data_processed, le_tipo = preprocess_data(df)
 
     # Preparar features e target
-    feature_cols = ['temperatura_ar', 'temperatura_processo', 'umidade_relativa',
-                   'velocidade_rotacional', 'torque', 'desgaste_da_ferramenta', 'tipo_encoded',
-                   'FDF (Falha Desgaste Ferramenta)', 'FDC (Falha Dissipacao Calor)', 
-                   'FP (Falha Potencia)', 'FTE (Falha Tensao Excessiva)', 'FA (Falha Aleatoria)']
-
     X = data_processed[feature_cols]
     y = data_processed['falha_maquina']
 
@@ -79,11 +222,14 @@ def train_stacking_model(csv_file='bootcamp_train.csv'):
     X_train_scaled = scaler.fit_transform(X_train)
     X_test_scaled = scaler.transform(X_test)
 
+    if comparar_svm:
+        comparar_membros_svm(X_train_scaled, y_train, X_test_scaled, y_test)
+
     # Definir modelos base
     base_models = [
         ('rf', RandomForestClassifier(n_estimators=100, random_state=42, class_weight='balanced')),
         ('gb', GradientBoostingClassifier(n_estimators=100, random_state=42)),
-        ('svm', SVC(probability=True, random_state=42, class_weight='balanced'))
+        ('svm', criar_membro_svm(svm, gamma_scale(X_train_scaled) if svm != 'exato' else 'scale'))
     ]
 
     # Meta-modelo
@@ -109,17 +255,36 @@ def train_stacking_model(csv_file='bootcamp_train.csv'):
     print("\nRelatório de classificação:")
     print(classification_report(y_test, y_pred))
 
+    primeiro_estagio = train_primeiro_estagio(stacking_model, X_train_scaled, X_test_scaled)
+
     # Salvar modelos
     joblib.dump(stacking_model, 'stacking_model.pkl')
     joblib.dump(scaler, 'scaler.pkl')
     joblib.dump(le_tipo, 'label_encoder.pkl')
+    joblib.dump(primeiro_estagio, 'primeiro_estagio.pkl')
 
     print("\nModelos salvos:")
     print("- stacking_model.pkl")
     print("- scaler.pkl")
     print("- label_encoder.pkl")
+    print("- primeiro_estagio.pkl")
+
+    if diretorio_registro:
+        versao = RegistroModelos(diretorio_registro).publicar(
+            'stacking_model.pkl', 'scaler.pkl', 'label_encoder.pkl', caminho_primeiro_estagio='primeiro_estagio.pkl'
+        )
+        print(f"- versão publicada em {diretorio_registro}: {versao}")
 
     return stacking_model, scaler, le_tipo
 
 if __name__ == "__main__":
-    train_stacking_model()
+    # Só ao rodar o treino: quem importa este módulo (API, pontuar_lote.py) mantém os avisos
+    warnings.filterwarnings('ignore')
+    if os.getenv("APENAS_PRIMEIRO_ESTAGIO", "0") == "1":
+        retreinar_primeiro_estagio(os.getenv("CSV_TREINO", "bootcamp_train.csv"))
+    else:
+        train_stacking_model(
+            diretorio_registro=os.getenv("MODELOS_DIR"),
+            svm=os.getenv("SVM_MEMBRO", "exato"),
+            comparar_svm=os.getenv("COMPARAR_SVM", "0") == "1",
+        )